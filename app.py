@@ -1,6 +1,6 @@
 from flask import Flask
 from config import Config
-from models.database import init_databases
+from models.database import init_databases, recover_transactions, get_request_io
 from utils.helpers import run_startup_tasks, inject_settings
 import os
 
@@ -11,6 +11,9 @@ def create_app():
     # Initialize databases
     init_databases()
     
+    # Finish any multi-collection write a crash interrupted
+    recover_transactions()
+    
     # Register blueprints
     from routes.auth import auth_bp
     from routes.proposals import proposals_bp
@@ -30,9 +33,32 @@ def create_app():
     from routes.proposals import index
     app.add_url_rule('/', 'index', index)
     
+    # Follow-up reminders are sent in the background, not on page loads
+    from utils import reminders
+    reminders.start()
+    
+    # Queued email is delivered by background threads
+    from utils import email_service
+    email_service.start()
+    
+    # Backups are taken in the background, not on each save
+    from models import backups
+    backups.start()
+    
     # Template context processors
     app.context_processor(inject_settings)
     
+    # Per-request collection reads, only when profiling
+    if Config.LOG_REQUEST_IO:
+        @app.after_request
+        def log_collection_io(response):
+            from flask import request
+            io = get_request_io()
+            if io:
+                print(f"{request.method} {request.path}: {io['loads']} loads, "
+                      f"{io['reads']} reads, {io['parses']} parses")
+            return response
+    
     # Error handlers
     @app.errorhandler(404)
     def not_found(e):
@@ -40,7 +66,7 @@ def create_app():
         if request.path.startswith('/api/'):
             return jsonify({'status': 'error', 'message': 'Endpoint not found'}), 404
         return render_template('404.html'), 404
-
+    
     @app.errorhandler(500)
     def server_error(e):
         from flask import request, jsonify, render_template
@@ -8,8 +8,111 @@ class Config:
     # Email Configuration
     EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
     EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
-    SMTP_SERVER = "smtp.office365.com"
-    SMTP_PORT = 587
+    SMTP_SERVER = os.getenv('SMTP_SERVER', "smtp.office365.com")
+    SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+    SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'true').lower() == 'true'
+    SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', 30))
+    
+    # Outgoing email is queued in the email_outbox collection and delivered by
+    # EMAIL_WORKERS background threads per process: 'console' prints it
+    # (development), 'smtp' sends it through SMTP_SERVER. A failed message is
+    # retried with doubling delays and left as dead after EMAIL_MAX_ATTEMPTS.
+    EMAIL_DELIVERY = os.getenv('EMAIL_DELIVERY', 'console')
+    EMAIL_WORKERS = int(os.getenv('EMAIL_WORKERS', 2))
+    EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 20))
+    EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', 5))
+    EMAIL_RETRY_SECONDS = int(os.getenv('EMAIL_RETRY_SECONDS', 60))
+    EMAIL_RETRY_MAX_SECONDS = int(os.getenv('EMAIL_RETRY_MAX_SECONDS', 3600))
+    
+    # Notifications to one recipient within EMAIL_DIGEST_SECONDS of the first
+    # go out together as one digest (0 sends each on its own). Messages in
+    # the urgent categories are never held back.
+    EMAIL_DIGEST_SECONDS = int(os.getenv('EMAIL_DIGEST_SECONDS', 300))
+    EMAIL_URGENT_CATEGORIES = set(filter(None, os.getenv('EMAIL_URGENT_CATEGORIES',
+                                                         'urgent,legal_questions').split(',')))
+    
+    # Storage backend: 'json' (files under data/) or 'sqlite'
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+    SQLITE_DATABASE = os.getenv('SQLITE_DATABASE', 'data/geocon.db')
+    
+    # Record collections: the SQLite backend stores them one row per record,
+    # the JSON backend as a base file plus an append-only journal, and units of
+    # work lock them in this order
+    RECORD_COLLECTIONS = ['proposals', 'projects', 'insurance_requests', 'sub_requests',
+                          'pw_dir_questions', 'executed_contracts', 'analytics_aggregates',
+                          'analytics_rollups', 'number_counters', 'email_outbox']
+    
+    # Record journals on the JSON backend are folded into their base file once
+    # they grow past this size or the size of the base, whichever is larger
+    JOURNAL_COMPACT_BYTES = int(os.getenv('JOURNAL_COMPACT_BYTES', 1024 * 1024))
+    
+    # Backups of every collection, taken in the background every
+    # BACKUP_INTERVAL_SECONDS and after BACKUP_EVERY_WRITES writes in a process
+    # (0 turns either off). The last BACKUP_KEEP_RECENT snapshots are kept,
+    # and the newest of each of the last BACKUP_KEEP_HOURLY hours and
+    # BACKUP_KEEP_DAILY days.
+    BACKUP_DIR = os.getenv('BACKUP_DIR', 'data/backups')
+    BACKUP_INTERVAL_SECONDS = int(os.getenv('BACKUP_INTERVAL_SECONDS', 3600))
+    BACKUP_EVERY_WRITES = int(os.getenv('BACKUP_EVERY_WRITES', 500))
+    BACKUP_KEEP_RECENT = int(os.getenv('BACKUP_KEEP_RECENT', 10))
+    BACKUP_KEEP_HOURLY = int(os.getenv('BACKUP_KEEP_HOURLY', 24))
+    BACKUP_KEEP_DAILY = int(os.getenv('BACKUP_KEEP_DAILY', 14))
+    
+    # Intent files of multi-collection writes (units of work) in progress;
+    # any found at startup are from a crash and are rolled forward
+    TRANSACTION_DIR = os.getenv('TRANSACTION_DIR', 'data/system/transactions')
+    
+    # Record fields the JSON backend keeps a value -> keys index on, so
+    # query() on them reads only the matching records
+    RECORD_INDEXES = {
+        'proposals': ['status'],
+        'projects': ['status'],
+        'insurance_requests': ['project_number'],
+        'sub_requests': ['project_number'],
+        'pw_dir_questions': ['project_number'],
+        'executed_contracts': ['project_number'],
+        'email_outbox': ['status', 'to']
+    }
+    
+    # Activity log: append-only JSON-lines segments, rotated by size or age
+    ACTIVITY_LOG_DIR = os.getenv('ACTIVITY_LOG_DIR', 'data/audit/activity')
+    ACTIVITY_LOG_SEGMENT_BYTES = int(os.getenv('ACTIVITY_LOG_SEGMENT_BYTES', 4 * 1024 * 1024))
+    ACTIVITY_LOG_SEGMENT_SECONDS = int(os.getenv('ACTIVITY_LOG_SEGMENT_SECONDS', 24 * 3600))
+    ACTIVITY_LOG_RETENTION_SEGMENTS = int(os.getenv('ACTIVITY_LOG_RETENTION_SEGMENTS', 90))
+    ACTIVITY_LOG_RETENTION_DAYS = int(os.getenv('ACTIVITY_LOG_RETENTION_DAYS', 365))
+    
+    # Buffered activity logging: entries are queued and written in batches by a
+    # background thread. Overflow policy when the queue is full: 'sync' (write
+    # on the request thread), 'block', 'drop_oldest' or 'drop_newest'.
+    ACTIVITY_LOG_ASYNC = os.getenv('ACTIVITY_LOG_ASYNC', 'true').lower() == 'true'
+    ACTIVITY_LOG_QUEUE_SIZE = int(os.getenv('ACTIVITY_LOG_QUEUE_SIZE', 10000))
+    ACTIVITY_LOG_BATCH_SIZE = int(os.getenv('ACTIVITY_LOG_BATCH_SIZE', 200))
+    ACTIVITY_LOG_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_LOG_FLUSH_INTERVAL', 1.0))
+    ACTIVITY_LOG_OVERFLOW = os.getenv('ACTIVITY_LOG_OVERFLOW', 'sync')
+    ACTIVITY_LOG_BLOCK_TIMEOUT = float(os.getenv('ACTIVITY_LOG_BLOCK_TIMEOUT', 0.5))
+    
+    # Analytics results are cached until the collections they read change;
+    # a TTL (seconds, 0 for none) additionally bounds how long one is reused
+    ANALYTICS_CACHE_TTL = float(os.getenv('ANALYTICS_CACHE_TTL', 0))
+    
+    # Follow-up reminders are sent by a background scheduler in each worker;
+    # a reminder whose email can't be queued is retried after FOLLOW_UP_RETRY_SECONDS
+    FOLLOW_UP_REMINDERS = os.getenv('FOLLOW_UP_REMINDERS', 'true').lower() == 'true'
+    FOLLOW_UP_RETRY_SECONDS = int(os.getenv('FOLLOW_UP_RETRY_SECONDS', 3600))
+    
+    # How long a proposal or project form holds the number it reserved
+    NUMBER_LEASE_SECONDS = int(os.getenv('NUMBER_LEASE_SECONDS', 30 * 60))
+    
+    # List pages (dashboard, past projects, legal queue) are paginated server-side
+    PAGE_SIZE = int(os.getenv('PAGE_SIZE', 50))
+    MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 200))
+    
+    # In-process cache of parsed JSON documents (budget is measured in bytes on disk)
+    DOCUMENT_CACHE_MAX_BYTES = int(os.getenv('DOCUMENT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    DOCUMENT_CACHE_MAX_ENTRIES = int(os.getenv('DOCUMENT_CACHE_MAX_ENTRIES', 32))
+    
+    # Print each request's collection loads, reads and parses (profiling only)
+    LOG_REQUEST_IO = os.getenv('LOG_REQUEST_IO', 'false').lower() == 'true'
     
     # Database files - Modular structure for better scalability
     DATABASES = {
@@ -17,11 +120,15 @@ class Config:
         'projects': 'data/projects/projects_db.json',
         'users': 'data/users/users_db.json',
         'counters': 'data/system/counters_db.json',
+        'number_counters': 'data/system/number_counters.json',
         'analytics': 'data/analytics/analytics_db.json',
+        'analytics_aggregates': 'data/analytics/aggregates_db.json',
+        'analytics_rollups': 'data/analytics/rollups_db.json',
         'settings': 'data/system/system_settings.json',
         'audit_log': 'data/audit/audit_log.json',
         'deletion_log': 'data/audit/deletion_log.json',
         'email_log': 'data/system/email_log.json',
+        'email_outbox': 'data/system/email_outbox.json',
         'activity_log': 'data/audit/activity_log.json',
         'executed_contracts': 'data/legal/executed_contracts.json',
         'sub_requests': 'data/sub_requests.json',
@@ -0,0 +1,17 @@
+# Gunicorn reads this file from the working directory automatically
+
+def post_worker_init(worker):
+    """Start the reminder scheduler, email delivery and backups in each worker (threads do not survive --preload forks)"""
+    from models import backups
+    from models.database import recover_transactions
+    from utils import email_service, reminders
+    # A worker restarted after a crash finishes the unit of work it left behind
+    recover_transactions()
+    reminders.start()
+    email_service.start()
+    backups.start()
+
+def worker_exit(server, worker):
+    """Write buffered activity log entries before the worker exits"""
+    from models.activity_log import flush
+    flush()
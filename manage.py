@@ -0,0 +1,256 @@
+"""Maintenance commands: python manage.py <command> --help"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from config import Config
+from models.database import init_databases
+
+def migrate_sqlite(args):
+    """Import the data/ JSON files into the SQLite database"""
+    from models import sqlite_store
+
+    init_databases()
+    results = sqlite_store.migrate_from_json(overwrite=args.overwrite)
+    for name, result in results.items():
+        print(f"  {name:<20} {result}")
+    print(f"\nMigrated into {Config.SQLITE_DATABASE}. Set STORAGE_BACKEND=sqlite to use it.")
+
+def rebuild_analytics(args):
+    """Recompute the analytics aggregates and rollups from the proposals and projects"""
+    from models import aggregates, rollups
+    from models.analytics import (analytics_from_aggregates, enhanced_from_aggregates,
+                                  scan_analytics, scan_enhanced_analytics)
+    from models.database import load_json
+
+    init_databases()
+    store = aggregates.rebuild_aggregates()
+    print(f"Rebuilt {len(store) - 1} aggregate counters into {Config.DATABASES['analytics_aggregates']}")
+    buckets = rollups.rebuild_rollups()
+    print(f"Rebuilt {len(buckets) - 1} rollup buckets into {Config.DATABASES['analytics_rollups']}")
+
+    if args.verify:
+        proposals = load_json(Config.DATABASES['proposals'])
+        projects = load_json(Config.DATABASES['projects'])
+        analytics = load_json(Config.DATABASES['analytics'])
+        now = datetime.now()
+        differences = _compare(scan_analytics(proposals, projects, analytics),
+                               analytics_from_aggregates(store, analytics))
+        differences += _compare(scan_enhanced_analytics(proposals, projects, now),
+                                enhanced_from_aggregates(store, now), '/enhanced')
+        for difference in differences:
+            print(f"  MISMATCH {difference}")
+        print('Aggregates match a full scan.' if not differences else f"{len(differences)} mismatches.")
+        return 1 if differences else 0
+
+def backfill_analytics(args):
+    """Rebuild the monthly analytics, aggregates and rollups from the historical records"""
+    from models import backfill
+
+    init_databases()
+    summary = backfill.run_backfill(workers=args.workers, chunk_size=args.chunk_size)
+    print(f"Backfilled from {summary['proposals']} proposals and {summary['projects']} projects "
+          f"in {summary['seconds']}s")
+    print(f"  partitions         {', '.join(summary['partitions']) or '-'}")
+    print(f"  aggregate counters {summary['aggregate_counters']}")
+    print(f"  rollup buckets     {summary['rollup_buckets']}")
+
+def denormalize_fees(args):
+    """Copy each proposal's fee onto its project, for projects created before projects stored it"""
+    from models.database import load_json, write_records
+
+    init_databases()
+    proposals = load_json(Config.DATABASES['proposals'])
+    projects = load_json(Config.DATABASES['projects'])
+    ops = []
+    for key, project in projects.items():
+        proposal = proposals.get(project.get('proposal_number'))
+        if proposal is not None and project.get('fee') != proposal.get('fee', 0):
+            ops.append({'op': 'put', 'key': key, 'value': dict(project, fee=proposal.get('fee', 0))})
+    if ops:
+        write_records('projects', ops)
+    print(f"Updated the fee of {len(ops)} of {len(projects)} projects")
+
+def email_outbox(args):
+    """Show the email outbox, deliver what is due or requeue dead messages"""
+    from collections import Counter
+    from models.database import load_json
+    from utils import email_service
+
+    init_databases()
+    if args.retry_dead:
+        print(f"Requeued {email_service.requeue_dead()} dead messages")
+    if args.deliver:
+        print(f"Tried {email_service.deliver_due()} due messages")
+
+    outbox = load_json(Config.DATABASES['email_outbox'])
+    counts = Counter(message.get('status') for message in outbox.values())
+    for status in ['queued', 'sending', 'dead']:
+        print(f"  {status:<8} {counts.get(status, 0)}")
+    for message in outbox.values():
+        if message.get('status') == 'dead':
+            print(f"  dead: {message['to']} {message['subject']!r} - {message.get('last_error')}")
+
+def backup(args):
+    """Take a backup snapshot of every collection now, or list the snapshots"""
+    from models import backups
+
+    init_databases()
+    if not args.list:
+        manifest = backups.take_snapshot('manual')
+        print(f"Took backup {manifest['id']} ({manifest['stored']} collections stored)")
+        return
+
+    for manifest in backups.list_snapshots():
+        size = sum(entry['bytes'] for entry in manifest['collections'].values())
+        print(f"  {manifest['id']}  {manifest['created']}  {manifest['trigger']:<8} "
+              f"{len(manifest['collections'])} collections, {size / 1024:.0f} KB, "
+              f"{manifest['stored']} stored")
+
+def restore_backup(args):
+    """Restore collections from a backup snapshot (the current data is backed up first)"""
+    from models import backups
+
+    init_databases()
+    try:
+        names = backups.restore(args.snapshot, args.collection)
+    except ValueError as e:
+        print(e)
+        return 1
+    for name in names:
+        print(f"  restored {name}")
+    print(f"\nRestored {len(names)} collections from {args.snapshot}")
+
+def benchmark_analytics(args):
+    """Time the full-scan analytics against the columnar engine on synthetic data"""
+    from models import columnar
+    from models.analytics import analytics_from_aggregates, scan_analytics
+
+    proposals, projects = _synthetic_collections(args.proposals, args.seed)
+    print(f"{len(proposals)} proposals, {len(projects)} projects, engine: {columnar.engine_name()}")
+
+    def best_of(function):
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            result = function()
+            timings.append(time.perf_counter() - started)
+        return min(timings), result
+
+    scan_time, expected = best_of(lambda: scan_analytics(proposals, projects, {}))
+    build_time, columns = best_of(lambda: columnar.build_columns(proposals, projects))
+    group_time, store = best_of(lambda: columnar.aggregate(columns))
+    actual = analytics_from_aggregates(store, {})
+
+    columnar_time = build_time + group_time
+    print(f"  full scan        {scan_time * 1000:9.1f} ms")
+    print(f"  columnar         {columnar_time * 1000:9.1f} ms  "
+          f"(columns {build_time * 1000:.1f} ms, group-bys {group_time * 1000:.1f} ms)")
+    print(f"  speedup          {scan_time / columnar_time:9.1f}x")
+
+    differences = _compare(expected, actual)
+    print('  results match' if not differences else f"  {len(differences)} mismatches, e.g. {differences[0]}")
+    return 1 if differences else 0
+
+def _synthetic_collections(count, seed):
+    """Generate proposals and projects shaped like the real ones"""
+    rng = random.Random(seed)
+    offices = ['SD', 'LA', 'OC', 'RV', 'SF']
+    statuses = ['pending'] * 5 + ['converted_to_project'] * 3 + ['lost'] * 2
+    start = datetime(2020, 1, 1)
+    proposals = {}
+    projects = {}
+    for i in range(count):
+        created = start + timedelta(days=rng.randrange(2000))
+        proposal = {
+            'proposal_number': f"P-{i:07d}",
+            'date': created.strftime('%Y-%m-%d'),
+            'office': rng.choice(offices),
+            'client': f"Client {rng.randrange(2000)}",
+            'project_manager': f"PM {rng.randrange(80)}",
+            'project_type': rng.choice(['Commercial', 'Residential', 'Public', 'Industrial']),
+            'service_type': rng.choice(['GT', 'MT', 'EN', 'GE']),
+            'fee': str(rng.choice([0, rng.randrange(1000, 900000)])),
+            'status': rng.choice(statuses)
+        }
+        if proposal['status'] == 'converted_to_project':
+            proposal['won_date'] = (created + timedelta(days=rng.randrange(120))).strftime('%Y-%m-%d')
+            projects[f"G-{i:07d}"] = {
+                'status': rng.choice(['pending_legal', 'active', 'completed', 'dead']),
+                'legal_status': rng.choice([None, 'signed', 'in_review'])
+            }
+        proposals[proposal['proposal_number']] = proposal
+    return proposals, projects
+
+def _compare(expected, actual, path=''):
+    """List the differences between two analytics results, allowing float rounding"""
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        differences = []
+        for key in sorted(set(expected) | set(actual), key=str):
+            if key not in actual or key not in expected:
+                differences.append(f"{path}/{key}: only in {'full scan' if key in expected else 'aggregates'}")
+            else:
+                differences.extend(_compare(expected[key], actual[key], f"{path}/{key}"))
+        return differences
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+        if abs(expected - actual) <= 1e-6 * max(1, abs(expected)):
+            return []
+    elif expected == actual:
+        return []
+    return [f"{path}: full scan {expected!r}, aggregates {actual!r}"]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Geocon proposal system maintenance')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('migrate-sqlite', help=migrate_sqlite.__doc__)
+    command.add_argument('--overwrite', action='store_true',
+                         help='replace collections that already exist in the database')
+    command.set_defaults(func=migrate_sqlite)
+
+    command = commands.add_parser('rebuild-analytics', help=rebuild_analytics.__doc__)
+    command.add_argument('--verify', action='store_true',
+                         help='compare the result with a full scan of the collections')
+    command.set_defaults(func=rebuild_analytics)
+
+    command = commands.add_parser('backfill-analytics', help=backfill_analytics.__doc__)
+    command.add_argument('--workers', type=int, default=None,
+                         help='processes reducing the yearly partitions (default: one per CPU)')
+    command.add_argument('--chunk-size', type=int, default=5000,
+                         help='records read and reduced at a time')
+    command.set_defaults(func=backfill_analytics)
+
+    command = commands.add_parser('denormalize-fees', help=denormalize_fees.__doc__)
+    command.set_defaults(func=denormalize_fees)
+
+    command = commands.add_parser('email-outbox', help=email_outbox.__doc__)
+    command.add_argument('--deliver', action='store_true',
+                         help='deliver the messages that are due now, in this process')
+    command.add_argument('--retry-dead', action='store_true',
+                         help='queue the dead messages again')
+    command.set_defaults(func=email_outbox)
+
+    command = commands.add_parser('backup', help=backup.__doc__)
+    command.add_argument('--list', action='store_true',
+                         help='list the snapshots instead of taking one')
+    command.set_defaults(func=backup)
+
+    command = commands.add_parser('restore-backup', help=restore_backup.__doc__)
+    command.add_argument('snapshot', help='snapshot id, as shown by backup --list')
+    command.add_argument('--collection', action='append',
+                         help='restore only this collection (repeatable; default: all)')
+    command.set_defaults(func=restore_backup)
+
+    command = commands.add_parser('benchmark-analytics', help=benchmark_analytics.__doc__)
+    command.add_argument('--proposals', type=int, default=200000)
+    command.add_argument('--repeat', type=int, default=3)
+    command.add_argument('--seed', type=int, default=1)
+    command.set_defaults(func=benchmark_analytics)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,299 @@
+import atexit
+import json
+import os
+import queue
+import signal
+import threading
+import time
+from datetime import datetime
+from config import Config
+
+# The activity log is a directory of append-only JSON-lines segments named
+# activity-<YYYYmmdd-HHMMSS-micros>-<pid>.jsonl. Each worker appends to the newest
+# segment and starts a new one once it passes the size or age limit; the
+# oldest segments are removed beyond the retention limits.
+#
+# log_entry() does not touch the disk: entries go into a bounded in-process
+# queue that a background writer flushes in batches, on size or interval.
+# flush() drains it synchronously and runs at exit and on worker shutdown.
+# Entries only move from the queue to the pending batch under _flush_lock,
+# so a flush never misses one the writer has taken but not yet batched.
+
+SEGMENT_PREFIX = 'activity-'
+SEGMENT_SUFFIX = '.jsonl'
+
+_lock = threading.Lock()
+_current = {'path': None, 'started': 0}
+
+_queue = None
+_wakeup = threading.Event()
+_pending = []
+_flush_lock = threading.RLock()
+_start_lock = threading.Lock()
+_writer = {'thread': None, 'pid': None, 'hooks_installed': False}
+_stats = {'enqueued': 0, 'written': 0, 'dropped': 0, 'batches': 0,
+          'sync_writes': 0, 'write_errors': 0}
+
+def _segment_paths():
+    """List segment paths, oldest first"""
+    folder = Config.ACTIVITY_LOG_DIR
+    if not os.path.exists(folder):
+        return []
+    names = sorted(n for n in os.listdir(folder)
+                   if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX))
+    return [os.path.join(folder, n) for n in names]
+
+def _segment_started(path):
+    """Get the creation time encoded in a segment name"""
+    stamp = os.path.basename(path)[len(SEGMENT_PREFIX):len(SEGMENT_PREFIX) + 15]
+    try:
+        return datetime.strptime(stamp, '%Y%m%d-%H%M%S').timestamp()
+    except ValueError:
+        return 0
+
+def _is_full(path, started):
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return True
+    return (size >= Config.ACTIVITY_LOG_SEGMENT_BYTES or
+            time.time() - started >= Config.ACTIVITY_LOG_SEGMENT_SECONDS)
+
+def _open_segment():
+    """Pick the segment to append to, rotating if the current one is full"""
+    path = _current['path']
+    if path and not _is_full(path, _current['started']):
+        return path
+    
+    # Another worker may already have started a fresh segment
+    segments = _segment_paths()
+    if segments and not _is_full(segments[-1], _segment_started(segments[-1])):
+        path = segments[-1]
+    else:
+        if not os.path.exists(Config.ACTIVITY_LOG_DIR):
+            os.makedirs(Config.ACTIVITY_LOG_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        path = os.path.join(Config.ACTIVITY_LOG_DIR,
+                            f"{SEGMENT_PREFIX}{stamp}-{os.getpid()}{SEGMENT_SUFFIX}")
+        _enforce_retention(segments + [path])
+    
+    _current['path'] = path
+    _current['started'] = _segment_started(path)
+    return path
+
+def _enforce_retention(segments):
+    """Delete the oldest segments beyond the count and age limits"""
+    excess = len(segments) - Config.ACTIVITY_LOG_RETENTION_SEGMENTS
+    cutoff = time.time() - Config.ACTIVITY_LOG_RETENTION_DAYS * 86400
+    for i, path in enumerate(segments[:-1]):
+        if i < excess or _segment_started(path) < cutoff:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def append_entries(entries):
+    """Append entries to the current segment in a single write"""
+    if not entries:
+        return
+    payload = ''.join(json.dumps(e, separators=(',', ':'), default=str) + '\n' for e in entries)
+    
+    with _lock:
+        path = _open_segment()
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, payload.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+def append_entry(entry):
+    """Append one entry to the activity log"""
+    append_entries([entry])
+
+def log_entry(entry):
+    """Queue an entry for the background writer"""
+    if not Config.ACTIVITY_LOG_ASYNC:
+        append_entry(entry)
+        return
+    
+    _ensure_writer()
+    try:
+        _queue.put_nowait(entry)
+        _stats['enqueued'] += 1
+    except queue.Full:
+        _handle_overflow(entry)
+    _wakeup.set()
+
+def _handle_overflow(entry):
+    """Apply Config.ACTIVITY_LOG_OVERFLOW when the queue is full"""
+    policy = Config.ACTIVITY_LOG_OVERFLOW
+    if policy == 'block':
+        try:
+            _queue.put(entry, timeout=Config.ACTIVITY_LOG_BLOCK_TIMEOUT)
+            _stats['enqueued'] += 1
+        except queue.Full:
+            _stats['dropped'] += 1
+    elif policy == 'drop_oldest':
+        try:
+            _queue.get_nowait()
+            _stats['dropped'] += 1
+        except queue.Empty:
+            pass
+        try:
+            _queue.put_nowait(entry)
+            _stats['enqueued'] += 1
+        except queue.Full:
+            _stats['dropped'] += 1
+    elif policy == 'drop_newest':
+        _stats['dropped'] += 1
+    else:
+        # 'sync': fall back to writing on the caller's thread
+        _write_batch([entry])
+        _stats['sync_writes'] += 1
+
+def _ensure_writer():
+    """Start the writer thread in this process if it is not running"""
+    global _queue, _wakeup
+    thread = _writer['thread']
+    if thread is not None and _writer['pid'] == os.getpid() and thread.is_alive():
+        return
+    
+    with _start_lock:
+        thread = _writer['thread']
+        if thread is not None and _writer['pid'] == os.getpid() and thread.is_alive():
+            return
+        
+        # After a fork the parent's queue and thread are not ours
+        if _writer['pid'] != os.getpid():
+            _queue = queue.Queue(maxsize=Config.ACTIVITY_LOG_QUEUE_SIZE)
+            _wakeup = threading.Event()
+            del _pending[:]
+        
+        thread = threading.Thread(target=_run_writer, name='activity-log-writer', daemon=True)
+        _writer.update(thread=thread, pid=os.getpid())
+        thread.start()
+        
+        if not _writer['hooks_installed']:
+            atexit.register(flush)
+            _install_sigterm_handler()
+            _writer['hooks_installed'] = True
+
+def _install_sigterm_handler():
+    """Flush on SIGTERM unless something else (e.g. a gunicorn worker) owns the signal"""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    if signal.getsignal(signal.SIGTERM) not in (signal.SIG_DFL, None):
+        return
+    
+    def handle_sigterm(signum, frame):
+        flush()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        os.kill(os.getpid(), signal.SIGTERM)
+    
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+def _drain():
+    """Move everything queued into the pending batch (hold _flush_lock)"""
+    while True:
+        try:
+            _pending.append(_queue.get_nowait())
+        except queue.Empty:
+            return
+
+def _run_writer():
+    """Collect entries into batches and write them on size or interval"""
+    deadline = None
+    while True:
+        if deadline is None:
+            _wakeup.wait(Config.ACTIVITY_LOG_FLUSH_INTERVAL)
+        else:
+            _wakeup.wait(max(deadline - time.monotonic(), 0))
+        # Cleared before draining, so an entry queued after the drain wakes us again
+        _wakeup.clear()
+        
+        with _flush_lock:
+            _drain()
+            if not _pending:
+                deadline = None
+                continue
+            if deadline is None:
+                deadline = time.monotonic() + Config.ACTIVITY_LOG_FLUSH_INTERVAL
+            if len(_pending) < Config.ACTIVITY_LOG_BATCH_SIZE and time.monotonic() < deadline:
+                continue
+            _flush_pending()
+        deadline = None
+
+def _flush_pending():
+    with _flush_lock:
+        batch = list(_pending)
+        del _pending[:]
+        _write_batch(batch)
+
+def _write_batch(batch):
+    if not batch:
+        return
+    try:
+        append_entries(batch)
+        _stats['written'] += len(batch)
+        _stats['batches'] += 1
+    except Exception as e:
+        _stats['write_errors'] += 1
+        print(f"Error writing activity log: {e}")
+
+def flush():
+    """Write everything queued so far; safe to call from any thread"""
+    if _queue is None or _writer['pid'] != os.getpid():
+        return
+    with _flush_lock:
+        _drain()
+        _flush_pending()
+
+def get_logger_stats():
+    """Get queue depth and counters of the buffered writer"""
+    return {
+        **_stats,
+        'queue_depth': _queue.qsize() if _queue is not None else 0,
+        'pending': len(_pending),
+        'overflow_policy': Config.ACTIVITY_LOG_OVERFLOW
+    }
+
+def _read_segment_reversed(path):
+    try:
+        with open(path, 'rb') as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return
+    for line in reversed(lines):
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Torn final line from an interrupted write
+            continue
+
+def iter_activity(limit=None, action=None, user=None):
+    """Iterate activity entries newest first, across segments and the legacy log file"""
+    flush()
+    count = 0
+    sources = [lambda p=p: _read_segment_reversed(p) for p in reversed(_segment_paths())]
+    sources.append(_read_legacy_reversed)
+    
+    for source in sources:
+        for entry in source():
+            if action and entry.get('action') != action:
+                continue
+            if user and entry.get('user') != user:
+                continue
+            yield entry
+            count += 1
+            if limit is not None and count >= limit:
+                return
+
+def _read_legacy_reversed():
+    """Entries from activity_log.json, written before the log was segmented"""
+    try:
+        with open(Config.DATABASES['activity_log'], 'r') as f:
+            legacy = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return
+    if isinstance(legacy, list):
+        yield from reversed(legacy)
@@ -0,0 +1,134 @@
+import json
+from datetime import datetime
+from models import counter_store
+
+# Analytics counters kept up to date on every proposal and project write, so
+# get_analytics does not have to scan the collections. The store is a record
+# collection keyed "<group>|<label>", e.g. "client|Acme" or
+# "proposal_status|pending", holding integer counters. Fees are summed in
+# cents so adding and removing a record always cancels out exactly.
+#
+# Each write turns the old and new version of the record into counter deltas
+# (a handful of keys), applied as one journal append; see counter_store.
+# Whole-collection saves mark the store stale and the next read rebuilds it.
+
+COLLECTION = 'analytics_aggregates'
+
+# Bump when the set of counters changes; older stores are rebuilt on read
+STORE_FORMAT = 2
+
+# (aggregate group, proposal field)
+PERFORMANCE_GROUPS = [
+    ('client', 'client'),
+    ('project_type', 'project_type'),
+    ('service_type', 'service_type'),
+    ('pm', 'project_manager')
+]
+
+# (bucket name, exclusive upper bound of the fee)
+FEE_RANGES = [
+    ('under_10k', 10000),
+    ('10k_50k', 50000),
+    ('50k_100k', 100000),
+    ('100k_500k', 500000),
+    ('over_500k', None)
+]
+
+def label(value):
+    """Key label for a field value: what JSON serialization gives a non-string dict key"""
+    return value if isinstance(value, str) else json.dumps(value)
+
+def parse_fee(record):
+    """Get a record's fee as a float, 0 if it is missing or not a number"""
+    try:
+        return float(record.get('fee', 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+def fee_range(fee):
+    """Get the FEE_RANGES bucket a fee falls into"""
+    for name, upper in FEE_RANGES:
+        if upper is None or fee < upper:
+            return name
+
+def days_to_win(proposal):
+    """Days between a proposal's date and its won_date, or None if unknown"""
+    try:
+        proposal_date = proposal.get('date', '')
+        won_date = proposal.get('won_date', '')
+        if proposal_date and won_date:
+            return (datetime.strptime(won_date, '%Y-%m-%d') -
+                    datetime.strptime(proposal_date, '%Y-%m-%d')).days
+    except (TypeError, ValueError):
+        pass
+    return None
+
+def proposal_counters(proposal):
+    """Counters one proposal contributes, as {key: {field: amount}}"""
+    won = proposal.get('status') == 'converted_to_project'
+    fee = parse_fee(proposal)
+    cents = int(round(fee * 100))
+    
+    counters = {f"proposal_status|{label(proposal.get('status'))}": {'count': 1}}
+    for group, field in PERFORMANCE_GROUPS:
+        stats = {'total': 1, 'fee_cents': cents}
+        if won:
+            stats.update(won=1, revenue_cents=cents)
+        counters[f"{group}|{label(proposal.get(field, 'Unknown'))}"] = stats
+    
+    # Only proposals with a fee filled in count towards the fee ranges
+    if proposal.get('fee', 0):
+        counters[f"fee_range|{fee_range(fee)}"] = {'count': 1}
+        if won:
+            counters[f"won_fee_range|{fee_range(fee)}"] = {'count': 1}
+    
+    # Proposals per creation month ('YYYY-MM')
+    date = proposal.get('date', '')
+    if isinstance(date, str):
+        counters[f"proposal_month|{date[:7]}"] = {'count': 1}
+    
+    if won:
+        counters[f"office_revenue|{label(proposal.get('office', 'Unknown'))}"] = \
+            {'count': 1, 'revenue_cents': cents}
+        days = days_to_win(proposal)
+        if days is not None:
+            counters['win_time|all'] = {'count': 1, 'days': days}
+    return counters
+
+def project_counters(project):
+    """Counters one project contributes, as {key: {field: amount}}"""
+    counters = {f"project_status|{label(project.get('status'))}": {'count': 1}}
+    if in_legal_queue(project):
+        counters['legal_queue|all'] = {'count': 1}
+    return counters
+
+def in_legal_queue(project):
+    """Check whether a project is waiting on legal"""
+    legal_status = project.get('legal_status')
+    return (project.get('status') == 'pending_legal' or
+            bool(legal_status and legal_status not in ['signed', 'not_signed']))
+
+def _build(proposals, projects):
+    from models import columnar
+    return columnar.aggregate(columnar.build_columns(proposals, projects))
+
+def rebuild_aggregates():
+    """Recompute every counter from the proposals and projects collections"""
+    return counter_store.rebuild(COLLECTION, _build, STORE_FORMAT)
+
+def load_aggregates():
+    """Get the aggregate store, rebuilding it if it is missing, stale or out of step"""
+    return counter_store.load(COLLECTION, _build, STORE_FORMAT)
+
+def split_groups(aggregates):
+    """Group the store's counters as {group: {label: counters}}"""
+    groups = {}
+    for key, counters in aggregates.items():
+        group, _, name = key.partition('|')
+        groups.setdefault(group, {})[name] = counters
+    return groups
+
+counter_store.track(COLLECTION, {
+    'proposals': proposal_counters,
+    'projects': project_counters
+})
@@ -1,64 +1,160 @@
 from datetime import datetime, timedelta
-from models.database import load_json, save_json
+from models.database import load_json, save_json, collection_version
+from models import aggregates, json_store, result_cache
 from config import Config
 
 def update_analytics(action, data):
     """Update analytics data with better tracking"""
-    analytics = load_json(Config.DATABASES['analytics'])
-    month_key = datetime.now().strftime('%Y-%m')
-    
-    if action == 'new_proposal':
-        # Track new proposals (NOT as wins!)
-        analytics.setdefault('monthly_proposals', {})[month_key] = \
-            analytics.get('monthly_proposals', {}).get(month_key, 0) + 1
-        
-        # Track by office
-        office = data.get('office')
-        if office:
-            analytics.setdefault('office_performance', {}).setdefault(office, {})
-            analytics['office_performance'][office].setdefault('proposals', {})[month_key] = \
-                analytics['office_performance'][office].get('proposals', {}).get(month_key, 0) + 1
-    
-    elif action == 'proposal_won':
-        # Track actual wins (when proposal is converted to project)
-        analytics.setdefault('monthly_wins', {})[month_key] = \
-            analytics.get('monthly_wins', {}).get(month_key, 0) + 1
+    # Serialized with the analytics backfill, which replaces this document
+    with json_store.collection_lock(Config.DATABASES['analytics']):
+        analytics = load_json(Config.DATABASES['analytics'])
+        month_key = datetime.now().strftime('%Y-%m')
         
-        fee = float(data.get('fee', 0))
-        analytics.setdefault('monthly_revenue', {})[month_key] = \
-            analytics.get('monthly_revenue', {}).get(month_key, 0) + fee
+        if action == 'new_proposal':
+            # Track new proposals (NOT as wins!)
+            analytics.setdefault('monthly_proposals', {})[month_key] = \
+                analytics.get('monthly_proposals', {}).get(month_key, 0) + 1
+            
+            # Track by office
+            office = data.get('office')
+            if office:
+                analytics.setdefault('office_performance', {}).setdefault(office, {})
+                analytics['office_performance'][office].setdefault('proposals', {})[month_key] = \
+                    analytics['office_performance'][office].get('proposals', {}).get(month_key, 0) + 1
         
-        # Track by PM
-        pm = data.get('project_manager')
-        if pm:
-            analytics.setdefault('pm_performance', {}).setdefault(pm, {})
-            analytics['pm_performance'][pm]['wins'] = \
-                analytics['pm_performance'][pm].get('wins', 0) + 1
-            analytics['pm_performance'][pm]['revenue'] = \
-                analytics['pm_performance'][pm].get('revenue', 0) + fee
+        elif action == 'proposal_won':
+            # Track actual wins (when proposal is converted to project)
+            analytics.setdefault('monthly_wins', {})[month_key] = \
+                analytics.get('monthly_wins', {}).get(month_key, 0) + 1
+            
+            fee = float(data.get('fee', 0))
+            analytics.setdefault('monthly_revenue', {})[month_key] = \
+                analytics.get('monthly_revenue', {}).get(month_key, 0) + fee
+            
+            # Track by PM
+            pm = data.get('project_manager')
+            if pm:
+                analytics.setdefault('pm_performance', {}).setdefault(pm, {})
+                analytics['pm_performance'][pm]['wins'] = \
+                    analytics['pm_performance'][pm].get('wins', 0) + 1
+                analytics['pm_performance'][pm]['revenue'] = \
+                    analytics['pm_performance'][pm].get('revenue', 0) + fee
             
-        # Track by office
-        office = data.get('office')
-        if office:
-            analytics.setdefault('office_performance', {}).setdefault(office, {})
-            analytics['office_performance'][office]['wins'] = \
-                analytics['office_performance'][office].get('wins', 0) + 1
-            analytics['office_performance'][office]['revenue'] = \
-                analytics['office_performance'][office].get('revenue', 0) + fee
-    
-    elif action == 'project_completed':
-        # Track completed projects
-        analytics.setdefault('monthly_completed', {})[month_key] = \
-            analytics.get('monthly_completed', {}).get(month_key, 0) + 1
-    
-    save_json(Config.DATABASES['analytics'], analytics)
+            # Track by office
+            office = data.get('office')
+            if office:
+                analytics.setdefault('office_performance', {}).setdefault(office, {})
+                analytics['office_performance'][office]['wins'] = \
+                    analytics['office_performance'][office].get('wins', 0) + 1
+                analytics['office_performance'][office]['revenue'] = \
+                    analytics['office_performance'][office].get('revenue', 0) + fee
+        
+        elif action == 'project_completed':
+            # Track completed projects
+            analytics.setdefault('monthly_completed', {})[month_key] = \
+                analytics.get('monthly_completed', {}).get(month_key, 0) + 1
+        
+        save_json(Config.DATABASES['analytics'], analytics)
+
+# Collections the analytics results are computed from
+ANALYTICS_SOURCES = ['proposals', 'projects', 'analytics', 'analytics_aggregates']
+
+def _sources_version():
+    return tuple(collection_version(name) for name in ANALYTICS_SOURCES)
 
 def get_analytics():
-    """Get comprehensive analytics data"""
-    proposals = load_json(Config.DATABASES['proposals'])
-    projects = load_json(Config.DATABASES['projects'])
+    """Get comprehensive analytics data, cached until the collections behind it change"""
+    return result_cache.get_or_compute('analytics', _sources_version(), _compute_analytics,
+                                       ttl=Config.ANALYTICS_CACHE_TTL)
+
+def _compute_analytics():
+    """Build analytics from the incrementally maintained aggregates"""
     analytics = load_json(Config.DATABASES['analytics'])
+    return analytics_from_aggregates(aggregates.load_aggregates(), analytics)
+
+def analytics_from_aggregates(store, analytics):
+    """Build the get_analytics result from the aggregate store's counters"""
+    groups = aggregates.split_groups(store)
+    proposal_status = {k: v.get('count', 0) for k, v in groups.get('proposal_status', {}).items()}
+    project_status = {k: v.get('count', 0) for k, v in groups.get('project_status', {}).items()}
+    
+    active_proposals = proposal_status.get('pending', 0)
+    lost_proposals = proposal_status.get('lost', 0)
+    won_proposals = proposal_status.get('converted_to_project', 0)
+    pending_legal_projects = project_status.get('pending_legal', 0)
+    pending_additional_info_projects = project_status.get('pending_additional_info', 0)
+    active_projects = project_status.get('active', 0)
+    completed_projects = project_status.get('completed', 0)
+    dead_jobs = project_status.get('dead', 0)
+    
+    total_decided = won_proposals + lost_proposals
+    win_rate = (won_proposals / total_decided * 100) if total_decided > 0 else 0
+    
+    office_revenue = groups.get('office_revenue', {})
+    revenue_by_office = {office: stats.get('revenue_cents', 0) / 100 for office, stats in office_revenue.items()}
+    total_revenue = sum(stats.get('revenue_cents', 0) for stats in office_revenue.values()) / 100 if office_revenue else 0
+    
+    def performance(group, with_avg_fee=False):
+        result = {}
+        for label, stats in groups.get(group, {}).items():
+            won = stats.get('won', 0)
+            result[label] = {
+                'total': stats['total'],
+                'won': won,
+                'revenue': stats.get('revenue_cents', 0) / 100 if won else 0,
+                'win_rate': won / stats['total'] * 100
+            }
+            if with_avg_fee:
+                result[label]['avg_fee'] = stats.get('fee_cents', 0) / 100 / stats['total']
+        return result
+    
+    def fee_ranges(group):
+        buckets = groups.get(group, {})
+        return {name: buckets.get(name, {}).get('count', 0) for name, _ in aggregates.FEE_RANGES}
+    
+    win_time = groups.get('win_time', {}).get('all', {})
+    avg_time_to_win = win_time.get('days', 0) / win_time['count'] if win_time.get('count') else 0
+    
+    return {
+        'win_rate': round(win_rate, 1),
+        'won_proposals': won_proposals,
+        'total_proposals': total_decided,
+        'active_proposals': active_proposals,
+        'pending_legal_projects': pending_legal_projects,
+        'pending_additional_info_projects': pending_additional_info_projects,
+        'active_projects': active_projects,
+        'completed_projects': completed_projects,
+        'lost_proposals': lost_proposals,
+        'dead_jobs': dead_jobs,
+        'total_active_items': active_proposals + pending_legal_projects + pending_additional_info_projects + active_projects,
+        'total_completed_items': completed_projects + lost_proposals + dead_jobs,
+        'total_revenue': total_revenue,
+        'revenue_by_office': revenue_by_office,
+        'pm_performance': performance('pm'),
+        'client_performance': performance('client', with_avg_fee=True),
+        'project_type_performance': performance('project_type'),
+        'service_type_performance': performance('service_type'),
+        'fee_ranges': fee_ranges('fee_range'),
+        'won_fee_ranges': fee_ranges('won_fee_range'),
+        'avg_time_to_win': round(avg_time_to_win, 1),
+        'legal_queue_analytics': {
+            'total_pending': pending_legal_projects,
+            'avg_processing_time': 0,
+            'bottlenecks': []
+        },
+        'lifecycle_analytics': {
+            'avg_proposal_to_sent': 0,
+            'avg_sent_to_won': 0,
+            'avg_sent_to_lost': 0
+        },
+        'monthly_data': analytics
+    }
+
+def scan_analytics(proposals, projects, analytics):
+    """Compute analytics with a full scan of every proposal and project
     
+    Reference implementation for the aggregates; see manage.py rebuild-analytics --verify.
+    """
     # Calculate different categories
     active_proposals = {k: v for k, v in proposals.items() if v.get('status') == 'pending'}
     pending_legal_projects = {k: v for k, v in projects.items() if v.get('status') == 'pending_legal'}
@@ -233,12 +329,42 @@ def get_analytics():
 
 def get_enhanced_analytics():
     """Get enhanced analytics with last month proposals and legal queue count"""
-    proposals = load_json(Config.DATABASES['proposals'])
-    projects = load_json(Config.DATABASES['projects'])
-    analytics = load_json(Config.DATABASES['analytics'])
+    now = datetime.now()
+    # "Last month" moves with the date, so it is part of the key
+    key = (_sources_version(), (now - timedelta(days=30)).strftime('%Y-%m'))
+    return result_cache.get_or_compute(
+        'enhanced_analytics', key,
+        lambda: enhanced_from_aggregates(aggregates.load_aggregates(), now),
+        ttl=Config.ANALYTICS_CACHE_TTL)
+
+def enhanced_from_aggregates(store, now):
+    """Build the get_enhanced_analytics result from the aggregate store's counters"""
+    last_month = now - timedelta(days=30)
+    
+    def count(key):
+        return store.get(key, {}).get('count', 0)
+    
+    active_proposals = count('proposal_status|pending')
+    won_proposals = count('proposal_status|converted_to_project')
+    lost_proposals = count('proposal_status|lost')
+    total_decided = won_proposals + lost_proposals
+    win_rate = (won_proposals / total_decided * 100) if total_decided > 0 else 0
     
+    return {
+        'last_month_proposals': count(f"proposal_month|{last_month.strftime('%Y-%m')}"),
+        'last_month_name': last_month.strftime('%B %Y'),
+        'total_active_items': active_proposals + count('project_status|pending_additional_info') +
+                              count('project_status|pending_legal'),
+        'win_rate': round(win_rate, 1),
+        'won_proposals': won_proposals,
+        'lost_proposals': lost_proposals,
+        'legal_queue_count': count('legal_queue|all')
+    }
+
+def scan_enhanced_analytics(proposals, projects, now):
+    """Compute get_enhanced_analytics with a full scan (reference for the aggregates)"""
     # Get last month's data
-    last_month = (datetime.now() - timedelta(days=30))
+    last_month = (now - timedelta(days=30))
     last_month_key = last_month.strftime('%Y-%m')
     last_month_name = last_month.strftime('%B %Y')
     
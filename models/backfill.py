@@ -0,0 +1,210 @@
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from config import Config
+from models import aggregates, counter_store, json_store, rollups
+from models.aggregates import label, parse_fee
+from models.database import iter_chunks, save_json
+
+# Backfill of every analytics store from the historical proposals and projects:
+# the monthly counters in analytics_db, the aggregate counters and the
+# date-bucketed rollups. Meant for importing history or repairing counters
+# that drifted, on collections too big to load in one piece.
+#
+# 1. The collections are streamed in chunks and spilled to one JSON-lines file
+#    per year of the record's date, so no more than a chunk is held at once.
+# 2. Each year is reduced to counters by a worker process. All counters are
+#    sums, so the per-year results simply add up.
+# 3. The stores are replaced in one go while writers are held off (see
+#    counter_store), so the listeners carry on from the backfilled counters.
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# Partition for records without a parseable date
+UNDATED = 'undated'
+
+def _month(value):
+    day = rollups.parse_day(value)
+    return day.strftime('%Y-%m') if day else None
+
+def monthly_counters(collection, record):
+    """Counters one record contributes to the analytics_db document
+    
+    The same events update_analytics counts as they happen, dated by the
+    record's date, won_date and completion_date instead of the time of the
+    request.
+    """
+    counters = {}
+    if collection == 'projects':
+        completed = _month(record.get('completion_date'))
+        if record.get('status') == 'completed' and completed:
+            counters['monthly_completed'] = {completed: 1}
+        return counters
+    
+    office = record.get('office')
+    created = _month(record.get('date'))
+    if created:
+        counters['monthly_proposals'] = {created: 1}
+        if office:
+            counters[f"office_proposals|{label(office)}"] = {created: 1}
+    
+    if record.get('status') == 'converted_to_project':
+        cents = int(round(parse_fee(record) * 100))
+        won = _month(record.get('won_date'))
+        if won:
+            counters['monthly_wins'] = {won: 1}
+            counters['monthly_revenue'] = {won: cents}
+        pm = record.get('project_manager')
+        if pm:
+            counters[f"pm|{label(pm)}"] = {'wins': 1, 'revenue': cents}
+        if office:
+            counters[f"office|{label(office)}"] = {'wins': 1, 'revenue': cents}
+    return counters
+
+def monthly_document(counters):
+    """Turn summed monthly counters into the analytics_db document"""
+    document = {
+        'monthly_proposals': counters.get('monthly_proposals', {}),
+        'monthly_wins': counters.get('monthly_wins', {}),
+        'monthly_revenue': {month: cents / 100
+                            for month, cents in counters.get('monthly_revenue', {}).items()},
+        'monthly_completed': counters.get('monthly_completed', {}),
+        'pm_performance': {},
+        'office_performance': {}
+    }
+    for key, fields in counters.items():
+        group, _, name = key.partition('|')
+        if group == 'pm':
+            document['pm_performance'][name] = {'wins': fields['wins'],
+                                                'revenue': fields['revenue'] / 100}
+        elif group == 'office':
+            office = document['office_performance'].setdefault(name, {})
+            office.update(wins=fields['wins'], revenue=fields['revenue'] / 100)
+        elif group == 'office_proposals':
+            document['office_performance'].setdefault(name, {})['proposals'] = fields
+    return document
+
+def _partition_key(record):
+    day = rollups.parse_day(record.get('date'))
+    return str(day.year) if day else UNDATED
+
+def _spill(spill_dir, chunk_size):
+    """Stream both collections into one file per year; returns (sources, {year: path}, counts)"""
+    paths = {}
+    files = {}
+    sources = {}
+    counts = {}
+    try:
+        for collection in counter_store.SOURCES:
+            version, chunks = iter_chunks(collection, chunk_size)
+            sources[collection] = version
+            counts[collection] = 0
+            for chunk in chunks:
+                for key, record in chunk.items():
+                    year = _partition_key(record)
+                    if year not in files:
+                        paths[year] = os.path.join(spill_dir, f"{year}.jsonl")
+                        files[year] = open(paths[year], 'w')
+                    files[year].write(json.dumps([collection, key, record]) + '\n')
+                counts[collection] += len(chunk)
+    finally:
+        for f in files.values():
+            f.close()
+    
+    if Config.STORAGE_BACKEND != 'sqlite':
+        sources = None
+    return sources, paths, counts
+
+def _reduce_chunk(totals, proposals, projects):
+    from models import columnar
+    counter_store.add_counters(totals['aggregates'],
+                               columnar.aggregate(columnar.build_columns(proposals, projects)))
+    for collection, records in (('proposals', proposals), ('projects', projects)):
+        for record in records.values():
+            counter_store.add_counters(totals['rollups'], rollups.COUNTERS[collection](record))
+            counter_store.add_counters(totals['monthly'], monthly_counters(collection, record))
+
+def reduce_partition(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Compute the counters of every store for one spilled partition"""
+    totals = {'aggregates': {}, 'rollups': {}, 'monthly': {}}
+    chunk = {'proposals': {}, 'projects': {}}
+    size = 0
+    with open(path) as f:
+        for line in f:
+            collection, key, record = json.loads(line)
+            chunk[collection][key] = record
+            size += 1
+            if size >= chunk_size:
+                _reduce_chunk(totals, chunk['proposals'], chunk['projects'])
+                chunk = {'proposals': {}, 'projects': {}}
+                size = 0
+    if size:
+        _reduce_chunk(totals, chunk['proposals'], chunk['projects'])
+    return totals
+
+@contextlib.contextmanager
+def _backfill_locks():
+    """Hold off writers to the sources and every store being replaced"""
+    with contextlib.ExitStack() as locks:
+        # Sources before stores, the order the change listeners take them in
+        for name in counter_store.SOURCES:
+            locks.enter_context(json_store.collection_lock(Config.DATABASES[name]))
+        locks.enter_context(counter_store.store_lock(aggregates.COLLECTION))
+        locks.enter_context(counter_store.store_lock(rollups.COLLECTION))
+        locks.enter_context(json_store.collection_lock(Config.DATABASES['analytics']))
+        yield
+
+def run_backfill(workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Rebuild analytics_db, the aggregate store and the rollup store from the records
+    
+    workers is the number of processes reducing partitions (default: one
+    per CPU, 1 to stay in this process). Returns a summary dict.
+    """
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    spill_dir = tempfile.mkdtemp(prefix='analytics-backfill-')
+    try:
+        with _backfill_locks():
+            sources, paths, counts = _spill(spill_dir, chunk_size)
+            years = sorted(paths)
+            
+            totals = {'aggregates': {}, 'rollups': {}, 'monthly': {}}
+            if workers > 1 and len(years) > 1:
+                with ProcessPoolExecutor(max_workers=min(workers, len(years))) as pool:
+                    results = pool.map(reduce_partition, [paths[y] for y in years],
+                                       [chunk_size] * len(years))
+                    for result in results:
+                        for store, counters in result.items():
+                            counter_store.add_counters(totals[store], counters)
+            else:
+                for year in years:
+                    for store, counters in reduce_partition(paths[year], chunk_size).items():
+                        counter_store.add_counters(totals[store], counters)
+            
+            # Swap the new stores in: each save replaces its file (or SQLite
+            # table) atomically
+            aggregate_store = totals['aggregates']
+            aggregate_store[counter_store.STATE_KEY] = counter_store.new_state(
+                aggregates.STORE_FORMAT, sources)
+            rollup_store = totals['rollups']
+            rollup_store[counter_store.STATE_KEY] = counter_store.new_state(
+                rollups.STORE_FORMAT, sources)
+            
+            save_json(Config.DATABASES[aggregates.COLLECTION], aggregate_store)
+            save_json(Config.DATABASES[rollups.COLLECTION], rollup_store)
+            save_json(Config.DATABASES['analytics'], monthly_document(totals['monthly']))
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    
+    return {
+        'proposals': counts.get('proposals', 0),
+        'projects': counts.get('projects', 0),
+        'partitions': years,
+        'aggregate_counters': len(aggregate_store) - 1,
+        'rollup_buckets': len(rollup_store) - 1,
+        'seconds': round(time.perf_counter() - started, 2)
+    }
@@ -0,0 +1,251 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from config import Config
+from models import json_store
+from models.database import load_json, save_json, collection_version, register_change_listener
+
+# Generational backups of every collection in Config.DATABASES, taken by a
+# background thread rather than on each save. A snapshot is a manifest in
+# <BACKUP_DIR>/snapshots naming one object per collection; objects are the
+# gzipped JSON of a collection, stored once under <BACKUP_DIR>/objects by
+# the sha256 of their content. A collection whose version has not changed
+# since the last snapshot is not read again, and identical content is never
+# stored twice, so a snapshot of a quiet system writes only its manifest.
+#
+# Snapshots are taken every BACKUP_INTERVAL_SECONDS (one worker does it;
+# the others see a recent snapshot and skip) and after BACKUP_EVERY_WRITES
+# writes in a process. Retention keeps the last BACKUP_KEEP_RECENT snapshots
+# and the newest snapshot of each of the last BACKUP_KEEP_HOURLY hours and
+# BACKUP_KEEP_DAILY days; objects no kept snapshot refers to are deleted.
+# Run by hand with manage.py backup / restore-backup.
+
+_condition = threading.Condition()
+_state = {'writes': 0, 'last': 0}
+_start_lock = threading.Lock()
+_worker = {'thread': None, 'pid': None}
+
+def _folder(name):
+    return os.path.join(Config.BACKUP_DIR, name)
+
+def _lock():
+    """Serialize snapshots and pruning across worker processes"""
+    os.makedirs(Config.BACKUP_DIR, exist_ok=True)
+    return json_store.collection_lock(os.path.join(Config.BACKUP_DIR, 'backups'))
+
+def _object_path(digest):
+    return os.path.join(_folder('objects'), digest[:2], f"{digest}.json.gz")
+
+def _write_file(path, payload):
+    """Write bytes to a path by rename, so a crash never leaves half a file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_name = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_name, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, path)
+
+def _serialize(name):
+    """Current content of a collection as JSON bytes"""
+    path = Config.DATABASES[name]
+    if Config.STORAGE_BACKEND == 'sqlite':
+        from models import sqlite_store
+        _, _, data = sqlite_store.read_collection(name, default=None)
+        if data is None:
+            data = load_json(path)
+        return json.dumps(data).encode('utf-8')
+    
+    if name not in Config.RECORD_COLLECTIONS:
+        # Replaced by rename on every save, so the file is never half-written
+        with open(path, 'rb') as f:
+            return f.read()
+    
+    # The base plus its journal, as one document; nothing is appended while
+    # the lock is held
+    with json_store.collection_lock(path):
+        return json.dumps(load_json(path)).encode('utf-8')
+
+def list_snapshots():
+    """Get the snapshot manifests, newest first"""
+    folder = _folder('snapshots')
+    if not os.path.exists(folder):
+        return []
+    manifests = []
+    for filename in sorted(os.listdir(folder), reverse=True):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(folder, filename), 'r') as f:
+                manifests.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Error reading backup {filename}: {e}")
+    return manifests
+
+def get_snapshot(snapshot_id):
+    """Get one snapshot manifest, or None"""
+    path = os.path.join(_folder('snapshots'), f"{snapshot_id}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def take_snapshot(trigger='manual', min_age=0):
+    """Back up every collection; returns the manifest, or None if a snapshot newer than min_age exists"""
+    with _lock():
+        snapshots = list_snapshots()
+        previous = snapshots[0] if snapshots else None
+        if previous and time.time() - previous['timestamp'] < min_age:
+            return None
+        
+        collections = {}
+        stored = 0
+        for name in Config.DATABASES:
+            # JSON round trip, so it compares equal to the version in the manifest
+            version = json.loads(json.dumps(collection_version(name)))
+            if version is None:
+                continue
+            last = previous['collections'].get(name) if previous else None
+            if last is not None and last['version'] == version:
+                collections[name] = last
+                continue
+            
+            payload = _serialize(name)
+            digest = hashlib.sha256(payload).hexdigest()
+            path = _object_path(digest)
+            if not os.path.exists(path):
+                _write_file(path, gzip.compress(payload))
+                stored += 1
+            collections[name] = {'object': digest, 'version': version, 'bytes': len(payload)}
+        
+        now = datetime.now()
+        manifest = {
+            'id': now.strftime('%Y%m%d-%H%M%S-%f'),
+            'created': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'timestamp': now.timestamp(),
+            'trigger': trigger,
+            'stored': stored,
+            'collections': collections
+        }
+        _write_file(os.path.join(_folder('snapshots'), f"{manifest['id']}.json"),
+                    json.dumps(manifest, indent=2).encode('utf-8'))
+        _prune([manifest] + snapshots)
+    return manifest
+
+def _prune(snapshots):
+    """Delete the snapshots retention does not keep, then the objects none of the rest use (hold _lock)"""
+    keep = {manifest['id'] for manifest in snapshots[:max(Config.BACKUP_KEEP_RECENT, 1)]}
+    hours = []
+    days = []
+    for manifest in snapshots:
+        moment = datetime.fromtimestamp(manifest['timestamp'])
+        hour = moment.strftime('%Y-%m-%d %H')
+        day = moment.strftime('%Y-%m-%d')
+        if hour not in hours and len(hours) < Config.BACKUP_KEEP_HOURLY:
+            hours.append(hour)
+            keep.add(manifest['id'])
+        if day not in days and len(days) < Config.BACKUP_KEEP_DAILY:
+            days.append(day)
+            keep.add(manifest['id'])
+    
+    used = set()
+    for manifest in snapshots:
+        if manifest['id'] in keep:
+            used.update(entry['object'] for entry in manifest['collections'].values())
+        else:
+            os.remove(os.path.join(_folder('snapshots'), f"{manifest['id']}.json"))
+    
+    objects = _folder('objects')
+    for prefix in os.listdir(objects) if os.path.exists(objects) else []:
+        for filename in os.listdir(os.path.join(objects, prefix)):
+            if filename.split('.', 1)[0] not in used:
+                os.remove(os.path.join(objects, prefix, filename))
+
+def read_object(digest):
+    """Get the parsed content of a backed up collection"""
+    with gzip.open(_object_path(digest), 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))
+
+def restore(snapshot_id, collections=None):
+    """Put collections back as they were in a snapshot; returns the names restored
+    
+    A snapshot of the current data is taken first, so a restore can be undone.
+    """
+    manifest = get_snapshot(snapshot_id)
+    if manifest is None:
+        raise ValueError(f"No backup {snapshot_id}")
+    names = collections or list(manifest['collections'])
+    unknown = [name for name in names if name not in manifest['collections']]
+    if unknown:
+        raise ValueError(f"Not in backup {snapshot_id}: {', '.join(unknown)}")
+    
+    # Read before the new snapshot's pruning can retire this one
+    contents = {name: read_object(manifest['collections'][name]['object']) for name in names}
+    take_snapshot('restore')
+    for name, data in contents.items():
+        save_json(Config.DATABASES[name], data)
+    return names
+
+def _on_change(collection, changes, version):
+    """Count writes towards the next snapshot"""
+    with _condition:
+        _state['writes'] += 1
+        if Config.BACKUP_EVERY_WRITES and _state['writes'] >= Config.BACKUP_EVERY_WRITES:
+            _condition.notify()
+
+def _next_trigger():
+    """Wait for the schedule or the write count; returns what triggered the snapshot"""
+    with _condition:
+        while True:
+            if Config.BACKUP_EVERY_WRITES and _state['writes'] >= Config.BACKUP_EVERY_WRITES:
+                trigger = 'writes'
+                break
+            if Config.BACKUP_INTERVAL_SECONDS:
+                wait = _state['last'] + Config.BACKUP_INTERVAL_SECONDS - time.time()
+                if wait <= 0:
+                    trigger = 'schedule'
+                    break
+                _condition.wait(wait)
+            else:
+                _condition.wait()
+        _state['writes'] = 0
+        _state['last'] = time.time()
+        return trigger
+
+def _run():
+    snapshots = list_snapshots()
+    with _condition:
+        _state['last'] = snapshots[0]['timestamp'] if snapshots else 0
+    while True:
+        trigger = _next_trigger()
+        try:
+            # Only one worker takes the scheduled snapshot
+            min_age = Config.BACKUP_INTERVAL_SECONDS / 2 if trigger == 'schedule' else 0
+            take_snapshot(trigger, min_age)
+        except Exception as e:
+            print(f"Error taking backup: {e}")
+
+def _is_running():
+    return (_worker['pid'] == os.getpid() and _worker['thread'] is not None and
+            _worker['thread'].is_alive())
+
+def start():
+    """Start the backup thread in this process if it is not running"""
+    if not Config.BACKUP_INTERVAL_SECONDS and not Config.BACKUP_EVERY_WRITES:
+        return
+    with _start_lock:
+        if _is_running():
+            return
+        
+        with _condition:
+            _state['writes'] = 0
+        thread = threading.Thread(target=_run, name='backups', daemon=True)
+        _worker.update(thread=thread, pid=os.getpid())
+        thread.start()
+
+for _name in Config.DATABASES:
+    register_change_listener(_name, _on_change)
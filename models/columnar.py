@@ -0,0 +1,202 @@
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from datetime import datetime
+from itertools import compress
+from models import aggregates
+
+try:
+    import numpy
+except ImportError:  # optional; the array-backed group-bys are used instead
+    numpy = None
+
+# Full-recompute engine for the analytics counters. One pass over the
+# collections turns each field into a compact typed column: categorical fields
+# become integer codes into a label list, fees become integer cents. The
+# counters are then group-bys over those columns, done with numpy.bincount when
+# NumPy is installed and with Counter/compress over the arrays otherwise.
+
+# Proposal fields kept as categorical code columns: (aggregate group, field,
+# value when missing), matching aggregates.proposal_counters
+CATEGORIES = ([('proposal_status', 'status', None)] +
+              [(group, field, 'Unknown') for group, field in aggregates.PERFORMANCE_GROUPS] +
+              [('office_revenue', 'office', 'Unknown')])
+
+FEE_BOUNDS = [upper for _, upper in aggregates.FEE_RANGES if upper is not None]
+WON_STATUS = 'converted_to_project'
+
+def engine_name():
+    """Name of the group-by implementation in use"""
+    return 'numpy' if numpy is not None else 'array'
+
+def _intern_column(values, label):
+    """Encode values as codes into a list of distinct labels, in first-seen order"""
+    try:
+        distinct = list(dict.fromkeys(values))
+        labels = [v if v.__class__ is str else label(v) for v in distinct]
+        if len(set(labels)) == len(labels):
+            lookup = {v: code for code, v in enumerate(distinct)}
+            return array('l', map(lookup.__getitem__, values)), labels
+    except TypeError:
+        pass
+    
+    # Unhashable values, or different values sharing a label (None and 'null')
+    lookup = {}
+    codes = array('l', [lookup.setdefault(v if v.__class__ is str else label(v), len(lookup))
+                        for v in values])
+    return codes, list(lookup)
+
+def _parse_fee(value):
+    # aggregates.parse_fee on the raw field value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def build_columns(proposals, projects):
+    """Turn the proposals and projects collections into typed columns
+    
+    Each column is extracted in one pass over the records.
+    """
+    label = aggregates.label
+    records = list(proposals.values())
+    columns = {}
+    labels = {}
+    
+    for group, field, default in CATEGORIES:
+        columns[group], labels[group] = _intern_column(
+            [p.get(field, default) for p in records], label)
+    
+    month_lookup = {}
+    columns['proposal_month'] = array('l', [
+        month_lookup.setdefault(d[:7], len(month_lookup)) if isinstance(d, str) else -1
+        for d in (p.get('date', '') for p in records)])
+    labels['proposal_month'] = list(month_lookup)
+    
+    raw_fees = [p.get('fee', 0) for p in records]
+    fees = [_parse_fee(f) for f in raw_fees]
+    columns['fee_cents'] = array('q', [round(f * 100) for f in fees])
+    columns['fee_range'] = array('b', [bisect_right(FEE_BOUNDS, f) if raw else -1
+                                       for f, raw in zip(fees, raw_fees)])
+    
+    won = array('b', [p.get('status') == WON_STATUS for p in records])
+    win_days = array('l', bytes(array('l').itemsize * len(records)))
+    has_win_days = array('b', bytes(len(records)))
+    
+    # Only won proposals need their dates parsed; the same dates recur a lot
+    ordinals = {}
+    def ordinal(text):
+        value = ordinals.get(text)
+        if value is None:
+            value = ordinals[text] = datetime.strptime(text, '%Y-%m-%d').toordinal()
+        return value
+    
+    for i in compress(range(len(records)), won):
+        proposal = records[i]
+        proposal_date = proposal.get('date', '')
+        won_date = proposal.get('won_date', '')
+        if proposal_date and won_date:
+            try:
+                win_days[i] = ordinal(won_date) - ordinal(proposal_date)
+                has_win_days[i] = 1
+            except (TypeError, ValueError):
+                pass
+    columns.update(won=won, win_days=win_days, has_win_days=has_win_days)
+    
+    project_records = list(projects.values())
+    columns['project_status'], labels['project_status'] = _intern_column(
+        [p.get('status') for p in project_records], label)
+    columns['legal_queue'] = array('b', [aggregates.in_legal_queue(p) for p in project_records])
+    
+    columns['labels'] = labels
+    return columns
+
+def _group_numpy(codes, size, weights=None, mask=None):
+    """Sum weights (or count rows) per code, skipping negative codes and masked-out rows"""
+    keep = codes >= 0
+    if mask is not None:
+        keep &= mask
+    codes = codes[keep]
+    if weights is None:
+        return numpy.bincount(codes, minlength=size).tolist()
+    sums = numpy.bincount(codes, weights=weights[keep], minlength=size)
+    # Cents and days are integers well inside float64's exact range
+    return numpy.rint(sums).astype(numpy.int64).tolist()
+
+def _group_arrays(codes, size, weights=None, mask=None):
+    """Sum weights (or count rows) per code, skipping negative codes and masked-out rows"""
+    result = [0] * size
+    if weights is None:
+        counts = Counter(codes if mask is None else compress(codes, mask))
+        for code, count in counts.items():
+            if code >= 0:
+                result[code] = count
+        return result
+    
+    pairs = zip(codes, weights) if mask is None else compress(zip(codes, weights), mask)
+    for code, weight in pairs:
+        if code >= 0:
+            result[code] += weight
+    return result
+
+def _prepare(columns):
+    """Get the columns the group-by implementation works on, and the group-by itself"""
+    if numpy is None:
+        return columns, _group_arrays
+    
+    prepared = {name: numpy.frombuffer(column, dtype=column.typecode)
+                for name, column in columns.items() if isinstance(column, array)}
+    for name in ['won', 'has_win_days', 'legal_queue']:
+        prepared[name] = prepared[name].astype(bool)
+    return prepared, _group_numpy
+
+def aggregate(columns):
+    """Compute every analytics counter from the columns, as {key: {field: amount}}
+    
+    The result is exactly what adding up aggregates.proposal_counters and
+    project_counters over every record gives.
+    """
+    labels = columns['labels']
+    data, group = _prepare(columns)
+    result = {}
+    
+    def emit(prefix, names, **fields):
+        # Buckets no record contributes to are left out, as in the store
+        presence = fields.get('count', fields.get('total'))
+        for i, name in enumerate(names):
+            if presence[i] > 0:
+                result[f"{prefix}|{name}"] = {field: values[i] for field, values in fields.items()
+                                               if field in ('count', 'total') or values[i]}
+    
+    won, fee_cents = data['won'], data['fee_cents']
+    for prefix, _, _ in CATEGORIES:
+        codes, size = data[prefix], len(labels[prefix])
+        if prefix == 'proposal_status':
+            emit(prefix, labels[prefix], count=group(codes, size))
+        elif prefix == 'office_revenue':
+            emit(prefix, labels[prefix], count=group(codes, size, mask=won),
+                 revenue_cents=group(codes, size, fee_cents, mask=won))
+        else:
+            emit(prefix, labels[prefix],
+                 total=group(codes, size),
+                 fee_cents=group(codes, size, fee_cents),
+                 won=group(codes, size, mask=won),
+                 revenue_cents=group(codes, size, fee_cents, mask=won))
+    
+    emit('proposal_month', labels['proposal_month'],
+         count=group(data['proposal_month'], len(labels['proposal_month'])))
+    
+    range_names = [name for name, _ in aggregates.FEE_RANGES]
+    emit('fee_range', range_names, count=group(data['fee_range'], len(range_names)))
+    emit('won_fee_range', range_names,
+         count=group(data['fee_range'], len(range_names), mask=won))
+    
+    # Single-bucket counters
+    has_win_days = columns['has_win_days']
+    emit('win_time', ['all'], count=[sum(has_win_days)],
+         days=[sum(compress(columns['win_days'], has_win_days))])
+    
+    emit('project_status', labels['project_status'],
+         count=group(data['project_status'], len(labels['project_status'])))
+    emit('legal_queue', ['all'], count=[sum(columns['legal_queue'])])
+    return result
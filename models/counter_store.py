@@ -0,0 +1,193 @@
+import contextlib
+import json
+from datetime import datetime
+from config import Config
+from models import json_store
+from models.database import (load_json, save_json, write_records, register_change_listener,
+                             collection_version)
+
+# Shared machinery for stores of integer counters derived from the proposals
+# and projects collections (analytics aggregates, time-series rollups).
+#
+# A store is a record collection of buckets, {key: {field: amount}}. A
+# counters function maps one source record to the buckets it contributes to;
+# on every write the listener subtracts the old record's counters, adds the
+# new one's and applies the difference as one journal append. Buckets whose
+# counters all drop to zero are deleted. The "meta|state" record holds the
+# store format, a stale flag, on SQLite the source versions the last rebuild
+# read, and the version of each source the store has counted up to. A load
+# compares those against collection_version, so checking that a store is in
+# step never reads the sources themselves.
+
+STATE_KEY = 'meta|state'
+SOURCES = ['proposals', 'projects']
+
+def _path(store):
+    return Config.DATABASES[store]
+
+def store_lock(store):
+    """Serialize read-modify-write of a store across threads and workers"""
+    return json_store.collection_lock(_path(store))
+
+def add_counters(totals, counters, sign=1):
+    """Add (or with sign=-1 subtract) counters into totals in place"""
+    for key, fields in counters.items():
+        bucket = totals.setdefault(key, {})
+        for field, amount in fields.items():
+            bucket[field] = bucket.get(field, 0) + sign * amount
+
+def apply_deltas(store, deltas, state=None):
+    """Add counter deltas to a store, dropping buckets that become empty
+    
+    state, if given, replaces the meta state in the same write.
+    """
+    current = load_json(_path(store))
+    ops = [{'op': 'put', 'key': STATE_KEY, 'value': state}] if state is not None else []
+    for key, fields in deltas.items():
+        if not any(fields.values()):
+            continue
+        bucket = dict(current.get(key, {}))
+        for field, amount in fields.items():
+            bucket[field] = bucket.get(field, 0) + amount
+        if any(bucket.values()):
+            ops.append({'op': 'put', 'key': key, 'value': bucket})
+        elif key in current:
+            ops.append({'op': 'del', 'key': key})
+    if ops:
+        write_records(store, ops)
+
+def read_state(data):
+    """Get the meta state of a loaded store"""
+    return data.get(STATE_KEY) or {}
+
+def source_version(name, sqlite_version=None):
+    """A source's collection version in the form kept in the state (JSON round trip)
+    
+    sqlite_version is the SQLite write counter when the caller has it.
+    """
+    if sqlite_version is not None:
+        return ['sqlite', sqlite_version]
+    return json.loads(json.dumps(collection_version(name)))
+
+def _counted(state, collection, version):
+    """The state's source versions after counting a write to collection"""
+    versions = dict(state.get('versions') or {})
+    seen = versions.get(collection)
+    # SQLite listeners can run out of order; keep the highest version counted
+    if version is None or not seen or seen[0] != 'sqlite' or seen[1] < version:
+        versions[collection] = source_version(collection, version)
+    return versions
+
+def in_step(data):
+    """Check whether a store has counted every write made to its sources"""
+    versions = read_state(data).get('versions') or {}
+    return all(versions.get(name) == source_version(name) for name in SOURCES)
+
+def mark_stale(store):
+    """Force the next load of a store to rebuild it"""
+    with store_lock(store):
+        state = dict(read_state(load_json(_path(store))), stale=True)
+        write_records(store, [{'op': 'put', 'key': STATE_KEY, 'value': state}])
+
+def track(store, counters_by_source):
+    """Keep a store in step with writes to the source collections
+    
+    counters_by_source maps 'proposals'/'projects' to the function giving
+    one record's counters.
+    """
+    def on_change(collection, changes, version):
+        if any(key is None for key, _, _ in changes):
+            mark_stale(store)
+            return
+        
+        counters = counters_by_source[collection]
+        deltas = {}
+        for key, old, new in changes:
+            if old is not None:
+                add_counters(deltas, counters(old), -1)
+            if new is not None:
+                add_counters(deltas, counters(new))
+        
+        try:
+            with store_lock(store):
+                # On SQLite, skip writes a concurrent rebuild already counted
+                state = read_state(load_json(_path(store)))
+                sources = state.get('sources') or {}
+                if version is not None and version <= sources.get(collection, 0):
+                    return
+                # On JSON this runs under the source's lock, so the version
+                # read is the one this write produced
+                apply_deltas(store, deltas,
+                             dict(state, versions=_counted(state, collection, version)))
+        except Exception as e:
+            print(f"Error updating {store}: {e}")
+            mark_stale(store)
+    
+    for source in counters_by_source:
+        register_change_listener(source, on_change)
+
+def read_sources():
+    """Read proposals and projects, with their SQLite versions when on that backend"""
+    if Config.STORAGE_BACKEND == 'sqlite':
+        from models import sqlite_store
+        proposals_version, _, proposals = sqlite_store.read_collection('proposals', {})
+        projects_version, _, projects = sqlite_store.read_collection('projects', {})
+        return proposals, projects, {'proposals': proposals_version, 'projects': projects_version}
+    
+    return (load_json(Config.DATABASES['proposals']),
+            load_json(Config.DATABASES['projects']), None)
+
+@contextlib.contextmanager
+def rebuild_locks(store):
+    """Hold off writers to the sources and the store while a rebuild reads them"""
+    with contextlib.ExitStack() as locks:
+        # Same order writers take them: a source collection, then the store
+        for name in SOURCES:
+            locks.enter_context(json_store.collection_lock(Config.DATABASES[name]))
+        locks.enter_context(store_lock(store))
+        yield
+
+def new_state(store_format, sources):
+    """Meta state for a freshly rebuilt store (call under the rebuild locks)"""
+    return {
+        'format': store_format,
+        'stale': False,
+        'sources': sources,
+        'versions': {name: source_version(name, sources[name] if sources else None)
+                     for name in SOURCES},
+        'rebuilt_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+def _rebuild_locked(store, build, store_format):
+    proposals, projects, sources = read_sources()
+    data = build(proposals, projects)
+    data[STATE_KEY] = new_state(store_format, sources)
+    save_json(_path(store), data)
+    return data
+
+def rebuild(store, build, store_format):
+    """Replace a store with build(proposals, projects), computed under the rebuild locks"""
+    with rebuild_locks(store):
+        return _rebuild_locked(store, build, store_format)
+
+def load(store, build, store_format):
+    """Get a store, rebuilding it if it is missing, stale or behind its sources
+    
+    Catches writes made without the listener (another tool, or a crash
+    between a record write and its counters) by version alone.
+    """
+    data = load_json(_path(store))
+    if not needs_rebuild(data, store_format) and in_step(data):
+        return data
+    
+    with rebuild_locks(store):
+        # A writer may have been between its record write and its counters
+        data = load_json(_path(store))
+        if not needs_rebuild(data, store_format) and in_step(data):
+            return data
+        return _rebuild_locked(store, build, store_format)
+
+def needs_rebuild(data, store_format):
+    """Check whether a loaded store is missing, stale or from an older format"""
+    state = read_state(data)
+    return state.get('format') != store_format or bool(state.get('stale'))
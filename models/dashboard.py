@@ -0,0 +1,140 @@
+from datetime import datetime
+from config import Config
+from models import search_index
+from models.database import load_json, query
+
+# Query engine behind the dashboard. A filter spec (the search box, status,
+# office, PM and date filters plus the viewer's role) is compiled once into a
+# list of predicates; every collection is then read once and each record is
+# routed to its section by status and tested against the predicates. The
+# search box goes through the search index, and a searched section is listed
+# best match first.
+
+# (section, collection, status, number field)
+SECTIONS = [
+    ('proposals', 'proposals', 'pending', 'proposal_number'),
+    ('pending_legal', 'projects', 'pending_legal', 'project_number'),
+    ('pending_additional_info', 'projects', 'pending_additional_info', 'project_number')
+]
+
+def make_spec(args, session):
+    """Build the filter spec from the request arguments and the session"""
+    is_admin = session.get('is_admin', False)
+    logged_in_pm = session.get('pm_filter_name', '')
+    return {
+        'search': args.get('search', '').lower(),
+        'status': args.get('status', ''),
+        'office': args.get('office', ''),
+        'pm': args.get('pm_filter', '') if is_admin else logged_in_pm,
+        'date_from': args.get('date_from', ''),
+        'date_to': args.get('date_to', ''),
+        'is_admin': is_admin,
+        'logged_in_pm': logged_in_pm
+    }
+
+def shows_all(spec):
+    """Whether no filter is applied, in which case everyone sees every item"""
+    return not any([spec['search'], spec['status'], spec['office'],
+                    spec['pm'] if spec['is_admin'] else False,
+                    spec['date_from'], spec['date_to']])
+
+def compile_spec(spec, ranks=None):
+    """Turn a filter spec into one predicate over (key, record)
+    
+    ranks holds the search index's matches for the spec's search text.
+    """
+    show_all = shows_all(spec)
+    checks = []
+    
+    # Role scope: PMs only see their own items once they filter
+    if not (show_all or spec['is_admin']):
+        own_pm = spec['logged_in_pm']
+        checks.append(lambda key, r: r.get('project_manager') == own_pm)
+    
+    if spec['search']:
+        checks.append(lambda key, r: key in ranks)
+    
+    office = spec['office']
+    if office:
+        checks.append(lambda key, r: r.get('office') == office)
+    
+    # An admin's PM filter matches the PM or the project director
+    pm = spec['pm']
+    if not show_all and spec['is_admin'] and pm:
+        checks.append(lambda key, r: r.get('project_manager') == pm or
+                      r.get('project_director') == pm)
+    
+    date_from, date_to = spec['date_from'], spec['date_to']
+    if date_from:
+        checks.append(lambda key, r: (r.get('date') or '') >= date_from)
+    if date_to:
+        checks.append(lambda key, r: (r.get('date') or '') <= date_to)
+    
+    if not checks:
+        return lambda key, r: True
+    if len(checks) == 1:
+        return checks[0]
+    return lambda key, r: all(check(key, r) for check in checks)
+
+def _index_filters(spec):
+    """Equality filters a storage index can apply ahead of the predicates"""
+    filters = {}
+    if not (shows_all(spec) or spec['is_admin']):
+        filters['project_manager'] = spec['logged_in_pm']
+    if spec['office']:
+        filters['office'] = spec['office']
+    return filters
+
+def _scan(collection, statuses, spec):
+    """Yield (key, record) candidates of the given statuses, through an index when there is one"""
+    if Config.STORAGE_BACKEND == 'sqlite':
+        # Indexed status (and PM/office) lookups instead of a full scan
+        for status in statuses:
+            yield from query(collection, status=status, **_index_filters(spec)).items()
+        return
+    yield from load_json(Config.DATABASES[collection]).items()
+
+def _days_pending(project):
+    """Days since legal approved a project waiting on additional information"""
+    try:
+        approved = datetime.strptime(project['legal_approved_date'].split(' ')[0], '%Y-%m-%d')
+        return (datetime.now() - approved).days
+    except Exception:
+        return 0
+
+def query_dashboard(spec):
+    """Get the dashboard sections as {section: {key: record}}
+    
+    Records are shared with the document cache, except the pending
+    additional info projects, which are copies carrying days_pending.
+    """
+    results = {section: {} for section, _, _, _ in SECTIONS}
+    collections = {}
+    for section, collection, status, _ in SECTIONS:
+        # A status filter rules out every section of another status
+        if spec['status'] and spec['status'] != status:
+            continue
+        collections.setdefault(collection, {})[status] = section
+    
+    for collection, by_status in collections.items():
+        ranks = None
+        if spec['search']:
+            ranks = {key: position for position, (key, _) in
+                     enumerate(search_index.search(collection, spec['search']))}
+        predicate = compile_spec(spec, ranks)
+        
+        for key, record in _scan(collection, list(by_status), spec):
+            section = by_status.get(record.get('status'))
+            if section is not None and predicate(key, record):
+                results[section][key] = record
+        
+        if ranks is not None:
+            for section in by_status.values():
+                results[section] = dict(sorted(results[section].items(),
+                                               key=lambda item: ranks[item[0]]))
+    
+    pending_info = results['pending_additional_info']
+    for key, project in pending_info.items():
+        pending_info[key] = dict(project, days_pending=_days_pending(project)
+                                 if project.get('legal_approved_date') else 0)
+    return results
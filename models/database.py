@@ -1,71 +1,743 @@
+import contextlib
+import copy
 import json
 import os
-import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from datetime import datetime
-from flask import request, session
+from flask import g, has_request_context, request, session
 from config import Config
+from models import json_store
+
+# In-process cache of parsed documents, keyed by path. Each entry holds the
+# (mtime, size, inode) signature of the file it was parsed from, so a write
+# by another worker is picked up on the next load. Documents are shared
+# between callers: treat them as read-only unless you save them back.
+_document_cache = OrderedDict()
+_document_cache_lock = threading.RLock()
+_document_cache_bytes = 0
+_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+# Secondary indexes of the JSON record collections (Config.RECORD_INDEXES),
+# keyed by path: {'data': document, 'fields': {field: {value: {key: None}}}}.
+# An index belongs to one cached document object; it is built on first use
+# and kept in step with every journal op applied to that document, ours or
+# replayed from other workers. A new document object gets a new index.
+_field_indexes = {}
+_field_indexes_lock = threading.Lock()
+
+# Request snapshot: inside a request every collection is read once. The
+# first load_json (or collection_version) of a collection is kept on flask.g
+# as {path: {'version': ..., 'data': ...}} and later calls in the same request
+# get it back without looking at the file again. Writes through this module
+# drop the entry, so a request sees its own writes; reads under a collection
+# lock bypass it. The version is taken before the data, so it never claims
+# more than the data it goes with.
+
+# Callbacks run after a collection is written, as
+# callback(collection, changes, version) where changes is a list of
+# (key, old record, new record) and None stands for a missing record. A key of
+# None means the whole collection was replaced by save_json (the only kind of
+# write to collections that are not record collections). version is the
+# SQLite collection version after the write, or None on the JSON backend,
+# where callbacks run while the collection's write lock is still held.
+_change_listeners = {}
+
+def _resolve_path(filename):
+    """Map legacy bare filenames onto the modular data/ layout"""
+    # Handle both old format and new format
+    if not filename.startswith('data/'):
+        # Map old filenames to new structure
+        old_to_new = {
+            'proposals_db.json': Config.DATABASES['proposals'],
+            'projects_db.json': Config.DATABASES['projects'],
+            'users_db.json': Config.DATABASES['users'],
+            'counters_db.json': Config.DATABASES['counters'],
+            'analytics_db.json': Config.DATABASES['analytics'],
+            'system_settings.json': Config.DATABASES['settings'],
+            'deletion_logs.json': Config.DATABASES['deletion_log']
+        }
+        filename = old_to_new.get(filename, filename)
+    return filename
+
+def _collection_name(filename):
+    """Get the Config.DATABASES name for a resolved path, or None"""
+    for name, path in Config.DATABASES.items():
+        if path == filename:
+            return name
+    return None
+
+def _use_sqlite(name):
+    """Check whether a collection is served by the SQLite backend"""
+    return name is not None and Config.STORAGE_BACKEND == 'sqlite'
+
+def _is_journaled(name):
+    """Check whether a collection is a JSON base file plus a record journal"""
+    return name in Config.RECORD_COLLECTIONS and not _use_sqlite(name)
+
+def _empty_document(filename):
+    return {} if not filename.endswith('_log.json') else []
+
+def _file_signature(filename):
+    """Return the (mtime, size, inode) signature of a file"""
+    st = os.stat(filename)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _cache_get(filename, signature):
+    """Return the cached document for filename if its signature still matches"""
+    with _document_cache_lock:
+        entry = _document_cache.get(filename)
+        if entry is None or entry[0] != signature:
+            _cache_stats['misses'] += 1
+            return None
+        _document_cache.move_to_end(filename)
+        _cache_stats['hits'] += 1
+        return entry[1]
+
+def _cache_put(filename, signature, data, size):
+    """Store a parsed document, evicting least recently used entries over budget"""
+    global _document_cache_bytes
+    if size > Config.DOCUMENT_CACHE_MAX_BYTES:
+        _cache_invalidate(filename)
+        return
+    
+    with _document_cache_lock:
+        old = _document_cache.pop(filename, None)
+        if old is not None:
+            _document_cache_bytes -= old[2]
+        _document_cache[filename] = (signature, data, size)
+        _document_cache_bytes += size
+        
+        while (len(_document_cache) > Config.DOCUMENT_CACHE_MAX_ENTRIES or
+               _document_cache_bytes > Config.DOCUMENT_CACHE_MAX_BYTES):
+            _, evicted = _document_cache.popitem(last=False)
+            _document_cache_bytes -= evicted[2]
+            _cache_stats['evictions'] += 1
+
+def _cache_invalidate(filename):
+    """Drop a cached document"""
+    global _document_cache_bytes
+    with _document_cache_lock:
+        entry = _document_cache.pop(filename, None)
+        if entry is not None:
+            _document_cache_bytes -= entry[2]
+            _cache_stats['invalidations'] += 1
+
+def clear_document_cache():
+    """Drop every cached document"""
+    global _document_cache_bytes
+    with _document_cache_lock:
+        _document_cache.clear()
+        _document_cache_bytes = 0
+
+def get_cache_stats():
+    """Get document cache hit/miss counters and current footprint"""
+    with _document_cache_lock:
+        lookups = _cache_stats['hits'] + _cache_stats['misses']
+        return {
+            **_cache_stats,
+            'hit_ratio': round(_cache_stats['hits'] / lookups * 100, 1) if lookups else 0,
+            'entries': len(_document_cache),
+            'bytes': _document_cache_bytes
+        }
+
+def _request_snapshot():
+    """Get this request's collection snapshot, or None outside a request"""
+    if not has_request_context():
+        return None
+    if 'collection_snapshot' not in g:
+        g.collection_snapshot = {}
+        g.collection_io = {'loads': 0, 'reads': 0, 'parses': 0}
+    return g.collection_snapshot
+
+def _count_parse():
+    if has_request_context() and 'collection_io' in g:
+        g.collection_io['parses'] += 1
+
+def _snapshot_drop(filename):
+    """Forget a collection in this request's snapshot after writing it"""
+    if has_request_context() and 'collection_snapshot' in g:
+        g.collection_snapshot.pop(filename, None)
+
+def get_request_io():
+    """Get this request's {'loads', 'reads', 'parses'} counts, or None if it loaded nothing"""
+    if not has_request_context():
+        return None
+    return g.get('collection_io')
 
 def load_json(filename):
-    """Load JSON file with error handling"""
+    """Load JSON file with error handling, served from the document cache when unchanged
+    
+    Within a request, every load of a file returns the same object, except
+    under the file's collection lock, where a writer needs the latest data.
+    """
+    filename = _resolve_path(filename)
+    snapshot = _request_snapshot()
+    if snapshot is None or json_store.holds_lock(filename):
+        return _load_document(filename)
+    
+    g.collection_io['loads'] += 1
+    entry = snapshot.setdefault(filename, {})
+    if 'data' not in entry:
+        name = _collection_name(filename)
+        if 'version' not in entry and name is not None:
+            entry['version'] = _current_version(name, filename)
+        g.collection_io['reads'] += 1
+        entry['data'] = _load_document(filename)
+    return entry['data']
+
+def _load_document(filename):
     try:
-        # Handle both old format and new format
-        if not filename.startswith('data/'):
-            # Map old filenames to new structure
-            old_to_new = {
-                'proposals_db.json': Config.DATABASES['proposals'],
-                'projects_db.json': Config.DATABASES['projects'],
-                'users_db.json': Config.DATABASES['users'],
-                'counters_db.json': Config.DATABASES['counters'],
-                'analytics_db.json': Config.DATABASES['analytics'],
-                'system_settings.json': Config.DATABASES['settings'],
-                'deletion_logs.json': Config.DATABASES['deletion_log']
-            }
-            filename = old_to_new.get(filename, filename)
+        name = _collection_name(filename)
+        
+        if _use_sqlite(name):
+            return _load_sqlite(filename, name)
+        if _is_journaled(name):
+            return _load_journaled(filename)
+        
+        signature = _file_signature(filename)
+        data = _cache_get(filename, signature)
+        if data is not None:
+            return data
         
         with open(filename, 'r') as f:
-            return json.load(f)
+            data = json.load(f)
+        _count_parse()
+        
+        # Only cache if the file was not replaced while we were parsing it
+        if _file_signature(filename) == signature:
+            _cache_put(filename, signature, data, signature[1])
+        return data
     except FileNotFoundError:
         # Initialize if file doesn't exist
         if filename in Config.DATABASES.values():
             init_databases()
-            return load_json(filename)
-        return {} if not filename.endswith('_log.json') else []
+            return _load_document(filename)
+        return _empty_document(filename)
     except json.JSONDecodeError:
-        return {} if not filename.endswith('_log.json') else []
+        return _empty_document(filename)
     except Exception as e:
         print(f"Error loading {filename}: {e}")
-        return {} if not filename.endswith('_log.json') else []
+        return _empty_document(filename)
+
+def _load_sqlite(filename, name):
+    """Load a collection from SQLite, validated against its write counter"""
+    from models import sqlite_store
+    
+    data = _cache_get(filename, ('sqlite', sqlite_store.get_version(name)))
+    if data is not None:
+        return data
+    
+    version, size, data = sqlite_store.read_collection(name, default=_default_document(name))
+    _count_parse()
+    _cache_put(filename, ('sqlite', version), data, size)
+    return data
+
+def _load_journaled(filename):
+    """Load a record collection: the cached base plus any journal lines appended since"""
+    base_signature = _file_signature(filename)
+    journal_ino, journal_size = json_store.journal_state(filename)
+    
+    with _document_cache_lock:
+        entry = _document_cache.get(filename)
+        # Usable unless the base was replaced or the journal vanished under it
+        if entry is not None and entry[0][0] == base_signature and \
+                (journal_ino is not None or entry[0][1] is None):
+            (_, cached_ino, offset), data, _ = entry
+            if (cached_ino, offset) != (journal_ino, journal_size):
+                # Catch up with records appended by other writers
+                cached_ino, offset = json_store.replay_journal(
+                    filename, data, cached_ino, offset,
+                    on_op=lambda op: _index_changes(filename, data, [
+                        (op['key'], data.get(op['key']), op.get('value'))]))
+                _cache_put(filename, (base_signature, cached_ino, offset), data,
+                           base_signature[1] + offset)
+            _document_cache.move_to_end(filename)
+            _cache_stats['hits'] += 1
+            return data
+        _cache_stats['misses'] += 1
+    
+    with open(filename, 'r') as f:
+        st = os.fstat(f.fileno())
+        base_signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        data = json.load(f)
+    _count_parse()
+    journal_ino, offset = json_store.replay_journal(filename, data)
+    _cache_put(filename, (base_signature, journal_ino, offset), data, base_signature[1] + offset)
+    return data
 
 def save_json(filename, data):
-    """Save JSON file with backup"""
+    """Save JSON file, replacing it atomically (backups are taken by models.backups)"""
     try:
-        # Handle both old format and new format
-        if not filename.startswith('data/'):
-            # Map old filenames to new structure
-            old_to_new = {
-                'proposals_db.json': Config.DATABASES['proposals'],
-                'projects_db.json': Config.DATABASES['projects'],
-                'users_db.json': Config.DATABASES['users'],
-                'counters_db.json': Config.DATABASES['counters'],
-                'analytics_db.json': Config.DATABASES['analytics'],
-                'system_settings.json': Config.DATABASES['settings'],
-                'deletion_logs.json': Config.DATABASES['deletion_log']
-            }
-            filename = old_to_new.get(filename, filename)
-        
-        # Create backup before saving
-        if os.path.exists(filename):
-            backup_name = f"{filename}.backup"
-            shutil.copy2(filename, backup_name)
-        
-        with open(filename, 'w') as f:
-            json.dump(data, f, indent=2)
+        filename = _resolve_path(filename)
+        _snapshot_drop(filename)
+        name = _collection_name(filename)
+        
+        if _use_sqlite(name):
+            from models import sqlite_store
+            version, size = sqlite_store.write_collection(name, data)
+            _cache_put(filename, ('sqlite', version), data, size)
+            _notify_change(name, [(None, None, None)], version)
+            return
+        
+        if _is_journaled(name):
+            _save_journaled(filename, data)
+            _notify_change(name, [(None, None, None)])
+            return
+        
+        # Written to a temporary file and renamed into place, so readers
+        # never see a half-written document and a failed save leaves the
+        # previous one intact
+        json_store.write_atomic(filename, data)
+        
+        # The saved object is now exactly what is on disk
+        signature = _file_signature(filename)
+        _cache_put(filename, signature, data, signature[1])
+        if name is not None:
+            _notify_change(name, [(None, None, None)])
     except Exception as e:
         print(f"Error saving {filename}: {e}")
-        # Restore from backup if save failed
-        backup_name = f"{filename}.backup"
-        if os.path.exists(backup_name):
-            shutil.copy2(backup_name, filename)
+        _cache_invalidate(filename)
+
+def _save_journaled(filename, data):
+    """Rewrite a record collection's base file and fold its journal away"""
+    with json_store.collection_lock(filename):
+        # The base is replaced atomically, so a failed save leaves it intact
+        json_store.write_base(filename, data)
+        signature = _file_signature(filename)
+        _cache_put(filename, (signature, None, 0), data, signature[1])
+        # The document may have been edited in place before being saved
+        with _field_indexes_lock:
+            _field_indexes.pop(filename, None)
+
+def register_change_listener(collection, callback):
+    """Call callback(collection, changes, version) after every write to a record collection"""
+    _change_listeners.setdefault(collection, []).append(callback)
+
+def _notify_change(collection, changes, version=None):
+    for callback in _change_listeners.get(collection, []):
+        try:
+            callback(collection, changes, version)
+        except Exception as e:
+            print(f"Error in change listener for {collection}: {e}")
+
+def collection_version(name):
+    """Get a cheap token that changes whenever a collection's data changes
+    
+    Compares equal only while nothing has been written to the collection.
+    None if the collection does not exist yet. Within a request, the version
+    of the request's snapshot.
+    """
+    filename = Config.DATABASES[name]
+    snapshot = _request_snapshot()
+    if snapshot is not None and not json_store.holds_lock(filename):
+        entry = snapshot.setdefault(filename, {})
+        if 'version' not in entry:
+            entry['version'] = _current_version(name, filename)
+        return entry['version']
+    return _current_version(name, filename)
+
+def _current_version(name, filename):
+    try:
+        if _use_sqlite(name):
+            from models import sqlite_store
+            return ('sqlite', sqlite_store.get_version(name))
+        if _is_journaled(name):
+            return (_file_signature(filename), json_store.journal_state(filename))
+        return _file_signature(filename)
+    except FileNotFoundError:
+        return None
+
+def changes_since(collection, version):
+    """Get {key: record or None if deleted} of the records written after a collection_version
+    
+    Only the writes are read: the journal past the version's offset on the
+    JSON backend, the change log on SQLite. Returns None when they can't be
+    listed (no version, the collection was replaced by save_json or
+    compacted, or the SQLite log no longer reaches back) and the caller has
+    to read the whole collection. Records are copies, and may be newer than
+    the collection's current version.
+    """
+    filename = _record_collection(collection)
+    if version is None:
+        return None
+    if _use_sqlite(collection):
+        from models import sqlite_store
+        return sqlite_store.changes_since(collection, version[1])
+    
+    base_signature, (journal_ino, offset) = version
+    changes = {}
+    try:
+        if _file_signature(filename) != base_signature:
+            return None
+        json_store.replay_journal(filename, {}, journal_ino, offset,
+                                  on_op=lambda op: changes.__setitem__(op['key'], op.get('value')))
+        # Compacted while we read: the journal no longer holds every write
+        if _file_signature(filename) != base_signature:
+            return None
+    except FileNotFoundError:
+        return None
+    return changes
+
+def _record_collection(collection):
+    """Get the path of a record collection, rejecting whole-document collections"""
+    if collection not in Config.RECORD_COLLECTIONS:
+        raise ValueError(f"{collection} is not a record collection")
+    return Config.DATABASES[collection]
+
+def _write_records(collection, ops, sync=False):
+    """Apply put/del operations to a record collection without rewriting it
+    
+    sync makes the journal append durable before returning.
+    """
+    filename = _record_collection(collection)
+    _snapshot_drop(filename)
+    # Callers keep using their dicts; the cache must not share them
+    ops = [dict(op, value=copy.deepcopy(op['value'])) if 'value' in op else op for op in ops]
+    
+    if _use_sqlite(collection):
+        from models import sqlite_store
+        for op in ops:
+            if op['op'] == 'put':
+                version, old = sqlite_store.put_record(collection, op['key'], op['value'])
+            else:
+                version, old = sqlite_store.delete_record(collection, op['key'])
+            _cache_apply_sqlite(filename, version, op)
+            _notify_change(collection, [(op['key'], old, op.get('value'))], version)
+        return
+    
+    with json_store.collection_lock(filename):
+        data = load_json(filename)
+        
+        # Previous values, as seen by each op in turn
+        changes = []
+        current = {}
+        for op in ops:
+            key = op['key']
+            old = current[key] if key in current else data.get(key)
+            current[key] = op.get('value')
+            changes.append((key, old, current[key]))
+        
+        journal_ino, journal_size = json_store.append_ops(filename, data, ops, sync=sync)
+        _index_changes(filename, data, changes)
+        base_signature = _file_signature(filename)
+        _cache_put(filename, (base_signature, journal_ino, journal_size), data,
+                   base_signature[1] + journal_size)
+        
+        # Fold the journal into the base once it outgrows it, so writes stay
+        # proportional to the record on average and loads stay cheap
+        if journal_size > max(Config.JOURNAL_COMPACT_BYTES, base_signature[1]):
+            json_store.write_base(filename, data)
+            signature = _file_signature(filename)
+            _cache_put(filename, (signature, None, 0), data, signature[1])
+        
+        _notify_change(collection, changes)
+
+def write_records(collection, ops):
+    """Apply several {'op': 'put'|'del', 'key': ..., 'value': ...} operations in one write"""
+    _write_records(collection, ops)
+
+def _cache_apply_sqlite(filename, version, op):
+    """Apply a record write to the cached SQLite document if it was current"""
+    with _document_cache_lock:
+        entry = _document_cache.get(filename)
+        if entry is None or entry[0] != ('sqlite', version - 1):
+            _cache_invalidate(filename)
+            return
+        signature, data, size = entry
+        if op['op'] == 'put':
+            data[op['key']] = op['value']
+        else:
+            data.pop(op['key'], None)
+        _document_cache[filename] = (('sqlite', version), data, size)
+
+# Units of work: writes to several record collections that must land
+# together are staged into a {collection: [ops]} dict with stage() and
+# committed with commit_work(). On the JSON backend the collections' locks
+# are taken, the records' old and new values are written to an intent file
+# in Config.TRANSACTION_DIR with one fsync (the commit point), the ops are
+# appended to each collection's journal and synced, and only then is the
+# intent file removed.
+# recover_transactions() finishes any unit of work a crash interrupted after
+# the commit point. On SQLite a unit of work is one transaction.
+
+def stage(work, collection, key, record):
+    """Stage a put of a record in a unit of work; a record of None stages a delete"""
+    _record_collection(collection)
+    if record is None:
+        op = {'op': 'del', 'key': key}
+    else:
+        op = {'op': 'put', 'key': key, 'value': copy.deepcopy(record)}
+    work.setdefault(collection, []).append(op)
+
+def commit_work(work):
+    """Write staged {collection: [ops]} so that either all of them land or none do"""
+    collections = [name for name in Config.RECORD_COLLECTIONS if work.get(name)]
+    if not collections:
+        return
+    
+    if Config.STORAGE_BACKEND == 'sqlite':
+        from models import sqlite_store
+        for collection, op, version, old in sqlite_store.write_batch(
+                {name: work[name] for name in collections}):
+            _snapshot_drop(Config.DATABASES[collection])
+            _cache_apply_sqlite(Config.DATABASES[collection], version, op)
+            _notify_change(collection, [(op['key'], old, op.get('value'))], version)
+        return
+    
+    with contextlib.ExitStack() as locks:
+        # Always in Config.RECORD_COLLECTIONS order, so units of work over
+        # overlapping collections cannot deadlock
+        for name in collections:
+            locks.enter_context(json_store.collection_lock(Config.DATABASES[name]))
+        
+        changes = {}
+        for name in collections:
+            data = load_json(Config.DATABASES[name])
+            before = {}
+            after = {}
+            for op in work[name]:
+                before.setdefault(op['key'], data.get(op['key']))
+                after[op['key']] = op.get('value')
+            changes[name] = [[key, before[key], after[key]] for key in after]
+        
+        intent = _write_intent(changes)
+        # Synced, so the intent is never gone while part of the unit of work
+        # is not yet on disk
+        for name in collections:
+            _write_records(name, work[name], sync=True)
+        os.remove(intent)
+
+def _write_intent(changes):
+    """Durably record a unit of work before any of it is applied; returns the file path"""
+    folder = Config.TRANSACTION_DIR
+    os.makedirs(folder, exist_ok=True)
+    
+    # Named by time so recovery rolls units forward in commit order
+    name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(folder, f"{name}.json")
+    tmp_name = f"{path}.tmp"
+    with open(tmp_name, 'w') as f:
+        json.dump({'id': name, 'changes': changes}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    # The rename is the commit point: a unit of work without an intent file
+    # never touched the collections
+    os.replace(tmp_name, path)
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    return path
+
+def recover_transactions():
+    """Finish units of work that a crash left half-applied; returns how many
+    
+    Each record the unit of work changed is set to its new value if it still
+    holds the value from before; records already written, or written again
+    since, are left alone.
+    """
+    folder = Config.TRANSACTION_DIR
+    if Config.STORAGE_BACKEND == 'sqlite' or not os.path.isdir(folder):
+        return 0
+    if not os.listdir(folder):
+        return 0
+    
+    recovered = 0
+    with contextlib.ExitStack() as locks:
+        # A unit of work holds its locks until its intent file is gone, so
+        # with every lock held the files left are from crashed processes
+        for name in Config.RECORD_COLLECTIONS:
+            locks.enter_context(json_store.collection_lock(Config.DATABASES[name]))
+        
+        for filename in sorted(os.listdir(folder)):
+            path = os.path.join(folder, filename)
+            if not filename.endswith('.json'):
+                # Crashed before the commit point
+                os.remove(path)
+                continue
+            
+            with open(path, 'r') as f:
+                intent = json.load(f)
+            for collection, changes in intent['changes'].items():
+                data = load_json(Config.DATABASES[collection])
+                ops = []
+                for key, before, after in changes:
+                    current = data.get(key)
+                    if current == after or current != before:
+                        continue
+                    if after is None:
+                        ops.append({'op': 'del', 'key': key})
+                    else:
+                        ops.append({'op': 'put', 'key': key, 'value': after})
+                if ops:
+                    _write_records(collection, ops, sync=True)
+            os.remove(path)
+            recovered += 1
+            print(f"Recovered unit of work {intent['id']}")
+    return recovered
+
+def _record_lock(collection):
+    filename = _record_collection(collection)
+    if _use_sqlite(collection):
+        # SQLite serializes the write itself
+        return contextlib.nullcontext()
+    return json_store.collection_lock(filename)
+
+def get_record(collection, key):
+    """Get a copy of one record, or None if it does not exist"""
+    filename = _record_collection(collection)
+    if _use_sqlite(collection):
+        from models import sqlite_store
+        return sqlite_store.get_record(collection, key)
+    
+    record = load_json(filename).get(key)
+    return copy.deepcopy(record) if record is not None else None
+
+def upsert_record(collection, key, record):
+    """Insert or replace one record, writing only that record"""
+    _write_records(collection, [{'op': 'put', 'key': key, 'value': record}])
+    return record
+
+def patch_record(collection, key, changes):
+    """Update some fields of one record; returns the updated record, or None if it does not exist"""
+    if _use_sqlite(collection):
+        from models import sqlite_store
+        version, old, record = sqlite_store.patch_record(collection, key, changes)
+        _snapshot_drop(_record_collection(collection))
+        if record is not None:
+            _cache_apply_sqlite(_record_collection(collection), version,
+                                {'op': 'put', 'key': key, 'value': copy.deepcopy(record)})
+            _notify_change(collection, [(key, old, copy.deepcopy(record))], version)
+        return record
+    
+    with _record_lock(collection):
+        record = get_record(collection, key)
+        if record is None:
+            return None
+        record.update(changes)
+        _write_records(collection, [{'op': 'put', 'key': key, 'value': record}])
+    return record
+
+def delete_record(collection, key):
+    """Delete one record; returns the deleted record, or None if it did not exist"""
+    with _record_lock(collection):
+        record = get_record(collection, key)
+        if record is not None:
+            _write_records(collection, [{'op': 'del', 'key': key}])
+    return record
+
+def iter_chunks(collection, chunk_size=1000):
+    """Stream a record collection as {key: record} chunks without loading it whole
+    
+    Returns (version, chunks): the SQLite version the stream reads at (None
+    on the JSON backend) and an iterator of dicts of up to chunk_size records.
+    On the JSON backend, hold the collection lock while consuming the chunks.
+    """
+    filename = _record_collection(collection)
+    if _use_sqlite(collection):
+        from models import sqlite_store
+        items = sqlite_store.iter_records(collection, chunk_size)
+        version = next(items)
+    else:
+        if not os.path.exists(filename):
+            init_databases()
+        items = json_store.iter_records(filename)
+        version = None
+    
+    def chunks():
+        chunk = {}
+        for key, record in items:
+            chunk[key] = record
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = {}
+        if chunk:
+            yield chunk
+    return version, chunks()
+
+def count_records(collection):
+    """Get the number of records in a record collection"""
+    filename = _record_collection(collection)
+    if _use_sqlite(collection):
+        from models import sqlite_store
+        return sqlite_store.count_records(collection)
+    return len(load_json(filename))
+
+def _index_add(postings, field, key, record):
+    try:
+        postings.setdefault(record.get(field), {})[key] = None
+    except TypeError:
+        # Unhashable values can't equal the strings queried for
+        pass
+
+def _index_remove(postings, field, key, record):
+    value = record.get(field)
+    try:
+        keys = postings.get(value)
+    except TypeError:
+        return
+    if keys is not None:
+        keys.pop(key, None)
+        if not keys:
+            del postings[value]
+
+def _index_changes(filename, data, changes):
+    """Update the secondary indexes of a document for (key, old, new) changes"""
+    with _field_indexes_lock:
+        entry = _field_indexes.get(filename)
+        if entry is None or entry['data'] is not data:
+            return
+        for field, postings in entry['fields'].items():
+            for key, old, new in changes:
+                if old is not None and new is not None and old.get(field) == new.get(field):
+                    continue
+                if old is not None:
+                    _index_remove(postings, field, key, old)
+                if new is not None:
+                    _index_add(postings, field, key, new)
+
+def _indexed_keys(filename, data, field, value):
+    """Get the keys of a document's records whose field equals value"""
+    with _field_indexes_lock:
+        entry = _field_indexes.get(filename)
+        if entry is None or entry['data'] is not data:
+            entry = _field_indexes[filename] = {'data': data, 'fields': {}}
+        postings = entry['fields'].get(field)
+        if postings is None:
+            postings = entry['fields'][field] = {}
+            for key, record in data.items():
+                _index_add(postings, field, key, record)
+        try:
+            return list(postings.get(value, ()))
+        except TypeError:
+            return []
+
+def query(collection, **filters):
+    """Get {key: record} of records whose fields equal the given values
+    
+    Records are shared with the document cache; copy before modifying.
+    """
+    filename = _record_collection(collection)
+    if _use_sqlite(collection):
+        from models import sqlite_store
+        if set(filters) <= set(sqlite_store.INDEXED_FIELDS):
+            return sqlite_store.query_records(collection, **filters)
+    
+    records = load_json(filename)
+    indexed = [field for field in filters if field in Config.RECORD_INDEXES.get(collection, [])]
+    if indexed and not _use_sqlite(collection):
+        # Only read the records the index holds under the first indexed value
+        keys = _indexed_keys(filename, records, indexed[0], filters[indexed[0]])
+        candidates = ((k, records[k]) for k in keys if k in records)
+    else:
+        candidates = records.items()
+    return {k: v for k, v in candidates
+            if all(v.get(field) == value for field, value in filters.items())}
 
 def init_databases():
     """Initialize all database files"""
@@ -75,49 +747,49 @@ def init_databases():
         if not os.path.exists(folder):
             os.makedirs(folder)
     
+    if Config.STORAGE_BACKEND == 'sqlite':
+        from models import sqlite_store
+        sqlite_store.init_schema()
+    
     # Initialize database files
     for db_name, db_path in Config.DATABASES.items():
         if not os.path.exists(db_path):
             with open(db_path, 'w') as f:
-                if db_name == 'counters':
-                    json.dump({
-                        'total_projects': 0,
-                        'office_counters': {},
-                        'last_reset': datetime.now().strftime('%Y-%m-%d')
-                    }, f)
-                elif db_name == 'analytics':
-                    json.dump({
-                        'monthly_proposals': {},
-                        'monthly_wins': {},
-                        'monthly_revenue': {},
-                        'office_performance': {},
-                        'pm_performance': {}
-                    }, f)
-                elif db_name == 'settings':
-                    from utils.helpers import DEFAULT_SETTINGS
-                    json.dump(DEFAULT_SETTINGS, f, indent=2)
-                elif db_name in ['audit_log', 'deletion_log', 'email_log', 'activity_log']:
-                    json.dump([], f)
-                else:
-                    json.dump({}, f)
+                json.dump(_default_document(db_name), f, indent=2)
+
+def _default_document(db_name):
+    """Get the initial contents of a collection"""
+    if db_name == 'counters':
+        return {
+            'total_projects': 0,
+            'office_counters': {},
+            'last_reset': datetime.now().strftime('%Y-%m-%d')
+        }
+    elif db_name == 'analytics':
+        return {
+            'monthly_proposals': {},
+            'monthly_wins': {},
+            'monthly_revenue': {},
+            'office_performance': {},
+            'pm_performance': {}
+        }
+    elif db_name == 'settings':
+        from utils.helpers import DEFAULT_SETTINGS
+        return copy.deepcopy(DEFAULT_SETTINGS)
+    elif db_name in ['audit_log', 'deletion_log', 'email_log', 'activity_log']:
+        return []
+    else:
+        return {}
 
 def log_activity(action, details, user_email=None):
-    """Log user activity for audit trail"""
-    activity_log = load_json(Config.DATABASES['activity_log'])
-    if not isinstance(activity_log, list):
-        activity_log = []
+    """Log user activity for audit trail (queued for the background activity log writer)"""
+    from models import activity_log
     
-    activity_log.append({
+    # Request details are captured here, the writer thread has no request context
+    activity_log.log_entry({
         'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         'user': user_email or session.get('user_email', 'system'),
         'action': action,
         'details': details,
         'ip_address': request.remote_addr if request else None
     })
-    
-    # Keep only last 10000 entries
-    if len(activity_log) > 10000:
-        activity_log = activity_log[-10000:]
-    
-    save_json(Config.DATABASES['activity_log'], activity_log)
-
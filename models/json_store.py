@@ -0,0 +1,285 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+# Record collections on the JSON backend are a base file plus an append-only
+# journal ("<file>.journal") of per-record operations, one JSON object per line:
+#
+#   {"base": [inode, mtime_ns]}           header, ties the journal to its base
+#   {"op": "put", "key": k, "value": {}}  insert or replace a record
+#   {"op": "del", "key": k}               delete a record
+#
+# A single-record write appends one line instead of rewriting the collection.
+# When the journal outgrows the base it is folded back in (compaction). The
+# base is always replaced by rename, so a journal whose header no longer
+# matches the base is left over from before a full save and is ignored.
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+_held = threading.local()
+
+def journal_path(filename):
+    return f"{filename}.journal"
+
+def _base_identity(filename):
+    st = os.stat(filename)
+    return [st.st_ino, st.st_mtime_ns]
+
+@contextmanager
+def collection_lock(filename):
+    """Serialize writers of one collection across threads and worker processes"""
+    with _thread_locks_guard:
+        lock = _thread_locks.setdefault(filename, threading.RLock())
+    
+    held = _held.__dict__.setdefault('depth', {})
+    with lock:
+        # Re-entrant: only the outermost holder takes the file lock
+        if fcntl is None or held.get(filename):
+            held[filename] = held.get(filename, 0) + 1
+            try:
+                yield
+            finally:
+                held[filename] -= 1
+            return
+        
+        with open(f"{filename}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            held[filename] = 1
+            try:
+                yield
+            finally:
+                held[filename] = 0
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def holds_lock(filename):
+    """Whether the calling thread holds a collection's lock"""
+    return bool(getattr(_held, 'depth', {}).get(filename))
+
+def journal_state(filename):
+    """Return (inode, size) of the journal, or (None, 0) if there is none"""
+    try:
+        st = os.stat(journal_path(filename))
+    except FileNotFoundError:
+        return None, 0
+    return st.st_ino, st.st_size
+
+def _apply(data, op):
+    if op.get('op') == 'put':
+        data[op['key']] = op['value']
+    elif op.get('op') == 'del':
+        data.pop(op['key'], None)
+
+def replay_journal(filename, data, journal_ino=None, offset=0, on_op=None):
+    """Apply journal operations from offset onwards to data in place
+    
+    Only complete lines are applied; on_op(op) is called before each one.
+    Returns the (inode, offset) reached.
+    """
+    try:
+        f = open(journal_path(filename), 'rb')
+    except FileNotFoundError:
+        return None, 0
+    
+    with f:
+        ino = os.fstat(f.fileno()).st_ino
+        if ino != journal_ino:
+            # A different journal than the one we had read from
+            offset = 0
+        f.seek(offset)
+        chunk = f.read()
+    
+    # A writer may be midway through appending the last line
+    consumed = chunk.rfind(b'\n') + 1
+    lines = chunk[:consumed].splitlines()
+    
+    if offset == 0 and lines:
+        header = json.loads(lines.pop(0))
+        if header.get('base') != _base_identity(filename):
+            return ino, consumed
+    
+    for line in lines:
+        if line.strip():
+            op = json.loads(line)
+            if on_op is not None:
+                on_op(op)
+            _apply(data, op)
+    return ino, offset + consumed
+
+def _fsync_dir(folder):
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def append_ops(filename, data, ops, sync=False):
+    """Append operations to the journal and apply them to data in place
+    
+    Must be called under collection_lock with data already caught up with
+    the journal. Returns the (inode, size) of the journal afterwards.
+    """
+    journal = journal_path(filename)
+    identity = _base_identity(filename)
+    
+    fresh = True
+    if os.path.exists(journal):
+        with open(journal, 'rb') as f:
+            first = f.readline()
+        try:
+            fresh = json.loads(first).get('base') != identity
+        except ValueError:
+            fresh = True
+        if fresh:
+            os.remove(journal)
+    
+    lines = []
+    if fresh:
+        lines.append(json.dumps({'base': identity}))
+    lines.extend(json.dumps(op, separators=(',', ':')) for op in ops)
+    payload = ('\n'.join(lines) + '\n').encode('utf-8')
+    
+    fd = os.open(journal, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, payload)
+        if sync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+    if sync and fresh:
+        # A new journal also needs its directory entry on disk
+        _fsync_dir(os.path.dirname(journal) or '.')
+    
+    for op in ops:
+        _apply(data, op)
+    return journal_state(filename)
+
+def write_atomic(filename, data):
+    """Replace a JSON file by writing a synced temporary file and renaming it into place"""
+    tmp_name = f"{filename}.tmp.{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(tmp_name, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, filename)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+def write_base(filename, data):
+    """Atomically replace the base file with data and drop the journal"""
+    write_atomic(filename, data)
+    
+    try:
+        os.remove(journal_path(filename))
+    except FileNotFoundError:
+        pass
+
+def _journal_overrides(filename):
+    """Final value of every record the journal touches ({key: record or None if deleted})"""
+    overrides = {}
+    try:
+        f = open(journal_path(filename), 'rb')
+    except FileNotFoundError:
+        return overrides
+    
+    with f:
+        header = f.readline()
+        try:
+            if json.loads(header).get('base') != _base_identity(filename):
+                return overrides
+        except ValueError:
+            return overrides
+        for line in f:
+            if not line.endswith(b'\n'):
+                break  # a writer is midway through this line
+            if line.strip():
+                op = json.loads(line)
+                overrides[op['key']] = op.get('value') if op.get('op') == 'put' else None
+    return overrides
+
+def _iter_object_items(f, read_size):
+    """Yield the (key, value) pairs of the JSON object in a text file without loading all of it"""
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+    
+    def fill():
+        nonlocal buffer, pos, eof
+        data = f.read(read_size)
+        eof = not data
+        buffer, pos = buffer[pos:] + data, 0
+    
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+    
+    def next_char():
+        skip_whitespace()
+        if pos >= len(buffer):
+            raise ValueError('unexpected end of JSON document')
+        return buffer[pos]
+    
+    def decode():
+        nonlocal pos
+        while True:
+            skip_whitespace()
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # A number cut by the end of the buffer may continue in the next read
+                if eof or (end < len(buffer) and buffer[end] in ',:}] \t\r\n'):
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+    
+    fill()
+    if next_char() != '{':
+        raise ValueError('expected a JSON object')
+    pos += 1
+    if next_char() == '}':
+        return
+    
+    while True:
+        key = decode()
+        if next_char() != ':':
+            raise ValueError('expected : in JSON object')
+        pos += 1
+        yield key, decode()
+        
+        separator = next_char()
+        pos += 1
+        if separator == '}':
+            return
+        if separator != ',':
+            raise ValueError('expected , or } in JSON object')
+
+def iter_records(filename, read_size=1024 * 1024):
+    """Stream (key, record) pairs of a record collection: base file plus journal
+    
+    Memory is bounded by the read size, the largest record and the records
+    the journal touches. Call under collection_lock for a consistent view.
+    """
+    overrides = _journal_overrides(filename)
+    with open(filename, 'r') as f:
+        for key, record in _iter_object_items(f, read_size):
+            if key not in overrides:
+                yield key, record
+    for key, record in overrides.items():
+        if record is not None:
+            yield key, record
@@ -0,0 +1,114 @@
+import threading
+from collections import Counter
+from config import Config
+from models.database import load_json, collection_version, changes_since
+
+# Index of the projects in the legal queue by legal status, behind the legal
+# queue page. A project is in the queue once it needs legal review or has a
+# legal status, and is filed under its legal_status ('new_request' when the
+# field is missing). Each status keeps the keys of its projects, so the stats
+# bar is the size of each bucket and the review queue is read from the
+# buckets instead of every project.
+#
+# Like the search index, it catches up with just the projects written since
+# the version it last saw (database.changes_since), so a write re-files one
+# project; the collection is read whole only to build the index. The queued
+# projects themselves are kept, so the review queue reads no other record.
+
+# Stats bar statuses
+STATUSES = ['new_request', 'under_review', 'questions_to_pm', 'edits_to_client',
+            'negotiating', 'signed', 'on_hold']
+
+_lock = threading.Lock()
+_index = {
+    'version': None,
+    'records': {},      # key -> queued project
+    'status': {},       # key -> legal status, for queued projects only
+    'buckets': {}       # legal status -> {key: None}
+}
+
+def in_queue(project):
+    """Whether a project belongs in the legal queue"""
+    return bool(project.get('needs_legal_review') or project.get('legal_status'))
+
+def _unfile(key):
+    if key not in _index['status']:
+        return
+    status = _index['status'].pop(key)
+    bucket = _index['buckets'][status]
+    del bucket[key]
+    if not bucket:
+        del _index['buckets'][status]
+
+def _file(key, project):
+    status = project.get('legal_status', 'new_request')
+    if key in _index['status'] and _index['status'][key] == status:
+        return
+    _unfile(key)
+    _index['status'][key] = status
+    _index['buckets'].setdefault(status, {})[key] = None
+
+def _update(key, project):
+    """File or unfile one project; a project of None removes it"""
+    if project is not None and in_queue(project):
+        _file(key, project)
+        _index['records'][key] = project
+    else:
+        _unfile(key)
+        _index['records'].pop(key, None)
+
+def _sync():
+    """Bring the index up to date with the projects collection (hold _lock)"""
+    version = collection_version('projects')
+    if version is not None and version == _index['version']:
+        return
+    
+    changes = changes_since('projects', _index['version'])
+    if changes is None:
+        for part in ['records', 'status', 'buckets']:
+            _index[part].clear()
+        changes = load_json(Config.DATABASES['projects'])
+    for key, project in changes.items():
+        _update(key, project)
+    _index['version'] = version
+
+def status_counts():
+    """Get {legal status: number of queued projects} for the stats bar statuses"""
+    with _lock:
+        _sync()
+        return {status: len(_index['buckets'].get(status, ())) for status in STATUSES}
+
+def queue_size():
+    """Number of projects in the review queue, i.e. queued and not signed"""
+    with _lock:
+        _sync()
+        return sum(len(bucket) for status, bucket in _index['buckets'].items() if status != 'signed')
+
+def review_queue(status=None, office=None, pm=None):
+    """Get {key: project} of the projects under legal review, by project number
+    
+    Signed projects have left the review queue. Records are shared with the
+    index; copy before modifying.
+    """
+    with _lock:
+        _sync()
+        statuses = [status] if status else list(_index['buckets'])
+        projects = {key: _index['records'][key] for s in statuses if s != 'signed'
+                    for key in _index['buckets'].get(s, ())}
+    
+    queue = {}
+    for key in sorted(projects):
+        project = projects[key]
+        if office and project.get('office') != office:
+            continue
+        if pm and project.get('project_manager') != pm:
+            continue
+        queue[key] = project
+    return queue
+
+def queue_stats(queue):
+    """Count a filtered review queue by status, with signed counted over every project"""
+    counts = Counter(project.get('legal_status', 'new_request') for project in queue.values())
+    stats = {status: counts.get(status, 0) for status in STATUSES}
+    stats['signed'] = status_counts()['signed']
+    return stats
@@ -0,0 +1,129 @@
+import re
+import time
+import uuid
+from config import Config
+from models import json_store
+from models.database import load_json, get_record, upsert_record
+
+# Sequential number allocation for proposal and project numbers. Each
+# counter ('project', 'proposal:<office>') is one record in the
+# number_counters collection:
+#
+#     {'next': next unused number, 'free': [numbers handed back],
+#      'leases': {lease id: {'number': n, 'expires': timestamp}}}
+#
+# A form reserves its number when it opens: the number is held under a lease
+# until the form is submitted (commit) or the lease runs out, after which it
+# goes back to the free list and is handed out again, lowest first. peek
+# shows the number the next reservation would get without taking it.
+#
+# Every change is one record written under the collection's file lock, so
+# allocation is atomic across workers and costs a journal append rather
+# than a rewrite of the counters file.
+
+COLLECTION = 'number_counters'
+
+# Sequence part of proposal (OC-2024-0001-P-GT) and project (G-000001-02-01) numbers
+PROPOSAL_NUMBER = re.compile(r'^([A-Za-z]+)-\d{4}-(\d+)-')
+PROJECT_NUMBER = re.compile(r'^G-(\d+)-')
+
+def _lock():
+    return json_store.collection_lock(Config.DATABASES[COLLECTION])
+
+def _highest_used(counter):
+    """Highest number of a counter already used in the proposals or projects"""
+    highest = 0
+    if counter == 'project':
+        proposals = load_json(Config.DATABASES['proposals'])
+        numbers = list(load_json(Config.DATABASES['projects']))
+        numbers += [p.get('project_number') or '' for p in proposals.values()]
+        for number in numbers:
+            match = PROJECT_NUMBER.match(number)
+            if match:
+                highest = max(highest, int(match.group(1)))
+        return highest
+    
+    office = counter.split(':', 1)[1]
+    for number in load_json(Config.DATABASES['proposals']):
+        match = PROPOSAL_NUMBER.match(number)
+        if match and match.group(1) == office:
+            highest = max(highest, int(match.group(2)))
+    return highest
+
+def _seed(counter):
+    """Next number of a counter that predates this collection
+    
+    counters_db.json was not advanced by every path that created records,
+    so the numbers already in use count as well.
+    """
+    counters = load_json(Config.DATABASES['counters'])
+    if counter == 'project':
+        last = counters.get('total_projects', 0)
+    else:
+        last = counters.get('office_counters', {}).get(counter.split(':', 1)[1], 0)
+    return max(last, _highest_used(counter)) + 1
+
+def _load(counter, now):
+    """Get a counter's state with expired leases moved back to the free list"""
+    state = get_record(COLLECTION, counter) or {'next': _seed(counter), 'free': [], 'leases': {}}
+    expired = [lease for lease, held in state['leases'].items() if held['expires'] <= now]
+    for lease in expired:
+        state['free'].append(state['leases'].pop(lease)['number'])
+    state['free'].sort()
+    return state
+
+def _take(state):
+    if state['free']:
+        return state['free'].pop(0)
+    state['next'] += 1
+    return state['next'] - 1
+
+def peek(counter):
+    """Number the next reservation of a counter would get, without taking it"""
+    state = _load(counter, time.time())
+    return state['free'][0] if state['free'] else state['next']
+
+def reserve(counter, ttl=None):
+    """Hold the next number of a counter for ttl seconds; returns {'lease', 'number', 'expires'}"""
+    now = time.time()
+    expires = now + (ttl if ttl is not None else Config.NUMBER_LEASE_SECONDS)
+    with _lock():
+        state = _load(counter, now)
+        number = _take(state)
+        lease = uuid.uuid4().hex
+        state['leases'][lease] = {'number': number, 'expires': expires}
+        upsert_record(COLLECTION, counter, state)
+    return {'lease': lease, 'number': number, 'expires': expires}
+
+def commit(counter, lease):
+    """Make a reserved number final; None if the lease ran out and its number was reused"""
+    with _lock():
+        state = get_record(COLLECTION, counter)
+        held = state['leases'].pop(lease, None) if state and lease else None
+        if held is None:
+            return None
+        upsert_record(COLLECTION, counter, state)
+    return held['number']
+
+def release(counter, lease):
+    """Hand a reserved number back for reuse"""
+    with _lock():
+        state = get_record(COLLECTION, counter)
+        held = state['leases'].pop(lease, None) if state and lease else None
+        if held is None:
+            return
+        state['free'].append(held['number'])
+        state['free'].sort()
+        upsert_record(COLLECTION, counter, state)
+
+def allocate(counter):
+    """Take the next number of a counter for good"""
+    with _lock():
+        state = _load(counter, time.time())
+        number = _take(state)
+        upsert_record(COLLECTION, counter, state)
+    return number
+
+def proposal_counter(office):
+    """Counter of an office's proposal numbers"""
+    return f"proposal:{office}"
@@ -0,0 +1,89 @@
+import threading
+import time
+
+# Process-local cache of computed results (e.g. analytics), one entry per
+# name. An entry is reused while the caller's key (typically the versions of
+# the collections the result was computed from) is unchanged and it is
+# younger than the TTL. Concurrent misses for the same key are coalesced:
+# one caller computes, the others wait for its result.
+#
+# Cached results are shared between callers: treat them as read-only.
+
+_lock = threading.Lock()
+_entries = {}
+_in_flight = {}
+_stats = {}
+
+def _stats_for(name):
+    return _stats.setdefault(name, {'hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0,
+                                    'compute_seconds': 0.0, 'last_compute_ms': 0})
+
+def get_or_compute(name, key, compute, ttl=None):
+    """Get the cached result for (name, key), computing it once if missing or expired"""
+    with _lock:
+        stats = _stats_for(name)
+        entry = _entries.get(name)
+        if entry is not None and entry['key'] == key and \
+                (not ttl or time.monotonic() - entry['computed_at'] < ttl):
+            stats['hits'] += 1
+            return entry['value']
+        
+        flight = _in_flight.get(name)
+        if flight is not None and flight['key'] == key:
+            stats['coalesced'] += 1
+            leader = False
+        else:
+            flight = {'key': key, 'done': threading.Event(), 'value': None, 'error': None}
+            _in_flight[name] = flight
+            stats['misses'] += 1
+            leader = True
+    
+    if not leader:
+        flight['done'].wait()
+        if flight['error'] is not None:
+            raise flight['error']
+        return flight['value']
+    
+    started = time.perf_counter()
+    try:
+        flight['value'] = compute()
+    except Exception as e:
+        flight['error'] = e
+        with _lock:
+            stats['errors'] += 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        with _lock:
+            if flight['error'] is None:
+                _entries[name] = {'key': key, 'value': flight['value'],
+                                  'computed_at': time.monotonic()}
+                stats['compute_seconds'] += elapsed
+                stats['last_compute_ms'] = round(elapsed * 1000, 1)
+            if _in_flight.get(name) is flight:
+                del _in_flight[name]
+        flight['done'].set()
+    return flight['value']
+
+def invalidate(name=None):
+    """Drop one cached result, or all of them"""
+    with _lock:
+        if name is None:
+            _entries.clear()
+        else:
+            _entries.pop(name, None)
+
+def get_stats():
+    """Get hit ratio and compute time per cached result"""
+    with _lock:
+        result = {}
+        for name, stats in _stats.items():
+            lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+            computed = stats['misses'] - stats['errors']
+            result[name] = {
+                **stats,
+                'compute_seconds': round(stats['compute_seconds'], 3),
+                'hit_ratio': round((stats['hits'] + stats['coalesced']) / lookups * 100, 1) if lookups else 0,
+                'avg_compute_ms': round(stats['compute_seconds'] / computed * 1000, 1) if computed else 0
+            }
+        return result
@@ -0,0 +1,210 @@
+from datetime import date, datetime, timedelta
+from models import counter_store
+from models.aggregates import label, parse_fee
+
+# Time-series rollups for the analytics charts: proposals created, wins,
+# losses, revenue and completions per day, ISO week, month and quarter, in
+# total and broken down by office, PM and service type. Buckets are keyed
+# "<granularity>|<period>" (e.g. "month|2025-03", "week|2025-W11") with flat
+# counter fields "<metric>" and "<metric>|<dimension>|<value>". They are kept
+# up to date on every proposal and project write (see counter_store), so a
+# range query only merges the buckets it covers.
+
+COLLECTION = 'analytics_rollups'
+STORE_FORMAT = 2
+
+GRANULARITIES = ['day', 'week', 'month', 'quarter']
+
+# (dimension, record field)
+DIMENSIONS = [
+    ('office', 'office'),
+    ('pm', 'project_manager'),
+    ('service_type', 'service_type')
+]
+
+# Metric name as returned by queries, and the counter field it is kept in
+METRICS = {
+    'proposals': 'proposals',
+    'wins': 'wins',
+    'losses': 'losses',
+    'revenue': 'revenue_cents',
+    'completions': 'completions'
+}
+
+# Longest range a query may span, in periods of its granularity
+MAX_PERIODS = 5000
+
+def parse_day(value):
+    """Get the date of a 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS' string, or None"""
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+def period_start(granularity, day):
+    """First day of the period containing day"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    if granularity == 'quarter':
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    return day
+
+def next_period(granularity, start):
+    """First day of the period after the one starting on start"""
+    if granularity == 'day':
+        return start + timedelta(days=1)
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    months = 3 if granularity == 'quarter' else 1
+    month = start.month - 1 + months
+    return date(start.year + month // 12, month % 12 + 1, 1)
+
+def period_label(granularity, day):
+    """Label of the period containing day, as used in bucket keys"""
+    if granularity == 'week':
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    if granularity == 'month':
+        return day.strftime('%Y-%m')
+    if granularity == 'quarter':
+        return f"{day.year}-Q{(day.month - 1) // 3 + 1}"
+    return day.isoformat()
+
+def _event_counters(counters, field, day, amount, record):
+    """Add one dated event of a record to every granularity's bucket"""
+    fields = {field: amount}
+    for dimension, record_field in DIMENSIONS:
+        fields[f"{field}|{dimension}|{label(record.get(record_field, 'Unknown'))}"] = amount
+    
+    for granularity in GRANULARITIES:
+        counter_store.add_counters(
+            counters, {f"{granularity}|{period_label(granularity, day)}": fields})
+
+def proposal_counters(proposal):
+    """Rollup counters one proposal contributes"""
+    counters = {}
+    
+    created = parse_day(proposal.get('date'))
+    if created:
+        _event_counters(counters, 'proposals', created, 1, proposal)
+    
+    status = proposal.get('status')
+    if status == 'converted_to_project':
+        won = parse_day(proposal.get('won_date'))
+        if won:
+            _event_counters(counters, 'wins', won, 1, proposal)
+            cents = int(round(parse_fee(proposal) * 100))
+            if cents:
+                _event_counters(counters, 'revenue_cents', won, cents, proposal)
+    elif status == 'lost':
+        lost = parse_day(proposal.get('loss_date'))
+        if lost:
+            _event_counters(counters, 'losses', lost, 1, proposal)
+    return counters
+
+def project_counters(project):
+    """Rollup counters one project contributes"""
+    counters = {}
+    if project.get('status') == 'completed':
+        completed = parse_day(project.get('completion_date'))
+        if completed:
+            _event_counters(counters, 'completions', completed, 1, project)
+    return counters
+
+COUNTERS = {
+    'proposals': proposal_counters,
+    'projects': project_counters
+}
+
+def build_rollups(proposals, projects):
+    """Compute the whole rollup store from the collections"""
+    rollups = {}
+    for proposal in proposals.values():
+        counter_store.add_counters(rollups, proposal_counters(proposal))
+    for project in projects.values():
+        counter_store.add_counters(rollups, project_counters(project))
+    return rollups
+
+def rebuild_rollups():
+    """Recompute the rollup store from the proposals and projects collections"""
+    return counter_store.rebuild(COLLECTION, build_rollups, STORE_FORMAT)
+
+def load_rollups():
+    """Get the rollup store, rebuilding it if it is missing, stale or out of step"""
+    return counter_store.load(COLLECTION, build_rollups, STORE_FORMAT)
+
+def _merge(buckets, group_by):
+    """Sum bucket counters into {metric: value}, or {group value: {metric: value}}"""
+    if group_by is None:
+        totals = {metric: 0 for metric in METRICS}
+        for bucket in buckets:
+            for metric, field in METRICS.items():
+                totals[metric] += bucket.get(field, 0)
+        totals['revenue'] /= 100
+        return totals
+    
+    groups = {}
+    for bucket in buckets:
+        for field, amount in bucket.items():
+            parts = field.split('|', 2)
+            if len(parts) == 3 and parts[1] == group_by:
+                groups.setdefault(parts[2], {}).setdefault(parts[0], 0)
+                groups[parts[2]][parts[0]] += amount
+    
+    metrics_by_field = {field: metric for metric, field in METRICS.items()}
+    result = {}
+    for value, fields in groups.items():
+        totals = {metric: 0 for metric in METRICS}
+        for field, amount in fields.items():
+            totals[metrics_by_field[field]] = amount
+        totals['revenue'] /= 100
+        result[value] = totals
+    return result
+
+def query_rollups(start, end, granularity='month', group_by=None):
+    """Get the metrics per period between two dates (inclusive)
+    
+    Whole periods are read from their own bucket; periods cut by the range
+    are merged from daily buckets. Returns a list of {'period', 'from', 'to',
+    <metric>: value} or, with group_by, {'period', 'from', 'to', 'groups':
+    {value: {<metric>: value}}}. Raises ValueError on invalid arguments.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    dimensions = [dimension for dimension, _ in DIMENSIONS]
+    if group_by is not None and group_by not in dimensions:
+        raise ValueError(f"group_by must be one of {', '.join(dimensions)}")
+    if end < start:
+        raise ValueError('to must not be before from')
+    
+    rollups = load_rollups()
+    series = []
+    period = period_start(granularity, start)
+    while period <= end:
+        if len(series) >= MAX_PERIODS:
+            raise ValueError(f"range spans more than {MAX_PERIODS} periods")
+        
+        following = next_period(granularity, period)
+        first, last = max(period, start), min(following - timedelta(days=1), end)
+        if (first, last) == (period, following - timedelta(days=1)):
+            keys = [f"{granularity}|{period_label(granularity, period)}"]
+        else:
+            keys = [f"day|{(first + timedelta(days=i)).isoformat()}"
+                    for i in range((last - first).days + 1)]
+        merged = _merge([rollups[k] for k in keys if k in rollups], group_by)
+        
+        entry = {'period': period_label(granularity, period),
+                 'from': first.isoformat(), 'to': last.isoformat()}
+        if group_by is None:
+            entry.update(merged)
+        else:
+            entry['groups'] = merged
+        series.append(entry)
+        period = following
+    return series
+
+counter_store.track(COLLECTION, COUNTERS)
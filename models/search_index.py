@@ -0,0 +1,155 @@
+import threading
+from config import Config
+from models.database import load_json, collection_version, changes_since
+
+# In-memory search index over the fields the dashboard search box matches.
+# Every distinct lowercased field value is indexed once under its trigrams
+# and maps to the records holding it; client and PM names repeat a lot, so
+# the postings stay small. A query intersects the postings of its trigrams
+# (queries shorter than three characters scan the distinct values) and then
+# checks the substring itself, so matches are exactly what
+# `query in field.lower()` gives.
+#
+# The index catches up on each search with the records written since the
+# version it last saw (database.changes_since: the journal on the JSON
+# backend, the change log on SQLite), so only those are re-tokenized,
+# whichever worker wrote them. The whole collection is read only to build the
+# index, or when the writes can't be listed (e.g. after a full save).
+
+# Collection -> field holding the record's number (searched first)
+NUMBER_FIELDS = {
+    'proposals': 'proposal_number',
+    'projects': 'project_number'
+}
+
+SEARCH_FIELDS = ['client', 'project_manager', 'project_name']
+
+# Match quality, best first
+EXACT, PREFIX, WORD, SUBSTRING = 3, 2, 1, 0
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def _new_index():
+    return {
+        'lock': threading.Lock(),
+        'version': None,
+        'fields': {},       # key -> lowercased field values, number first
+        'value_keys': {},   # value -> keys of records holding it
+        'trigrams': {}      # trigram -> values containing it
+    }
+
+def _get_index(collection):
+    with _indexes_lock:
+        return _indexes.setdefault(collection, _new_index())
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _field_values(collection, record):
+    return tuple(str(record.get(field) or '').lower()
+                 for field in [NUMBER_FIELDS[collection]] + SEARCH_FIELDS)
+
+def _add(index, key, fields):
+    index['fields'][key] = fields
+    for value in set(fields):
+        if not value:
+            continue
+        keys = index['value_keys'].get(value)
+        if keys is None:
+            keys = index['value_keys'][value] = set()
+            for trigram in _trigrams(value):
+                index['trigrams'].setdefault(trigram, set()).add(value)
+        keys.add(key)
+
+def _remove(index, key):
+    fields = index['fields'].pop(key, ())
+    for value in set(fields):
+        keys = index['value_keys'].get(value)
+        if keys is None:
+            continue
+        keys.discard(key)
+        if not keys:
+            del index['value_keys'][value]
+            for trigram in _trigrams(value):
+                values = index['trigrams'].get(trigram)
+                if values is not None:
+                    values.discard(value)
+                    if not values:
+                        del index['trigrams'][trigram]
+
+def _update(collection, index, key, record):
+    """Re-index one record; a record of None removes it"""
+    if record is None:
+        _remove(index, key)
+        return
+    fields = _field_values(collection, record)
+    if index['fields'].get(key) != fields:
+        _remove(index, key)
+        _add(index, key, fields)
+
+def _sync(collection, index):
+    """Bring the index up to date with the collection (hold the index lock)"""
+    version = collection_version(collection)
+    if version is not None and version == index['version']:
+        return
+    
+    # Re-applying a write already indexed is harmless, so the writes may
+    # run past the version
+    changes = changes_since(collection, index['version'])
+    if changes is None:
+        index.update(_new_index(), lock=index['lock'])
+        changes = load_json(Config.DATABASES[collection])
+    for key, record in changes.items():
+        _update(collection, index, key, record)
+    index['version'] = version
+
+def _quality(value, query):
+    if value == query:
+        return EXACT
+    if value.startswith(query):
+        return PREFIX
+    position = value.find(query)
+    while position > 0:
+        if not value[position - 1].isalnum():
+            return WORD
+        position = value.find(query, position + 1)
+    return SUBSTRING
+
+def score(fields, query):
+    """Rank of a record for a query it matches; higher is better
+    
+    The match quality counts first, then which field matched (the record
+    number, then client, PM and project name).
+    """
+    best = -1
+    for position, value in enumerate(fields):
+        if query in value:
+            best = max(best, _quality(value, query) * len(fields) + len(fields) - 1 - position)
+    return best
+
+def search(collection, query):
+    """Get [(key, score)] of records with query in one of the searched fields, best first
+    
+    query is matched case-insensitively as a substring, like the dashboard
+    search always has.
+    """
+    query = query.lower()
+    index = _get_index(collection)
+    with index['lock']:
+        _sync(collection, index)
+        
+        if len(query) >= 3:
+            postings = sorted((index['trigrams'].get(t, ()) for t in _trigrams(query)), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+        else:
+            candidates = index['value_keys']
+        keys = set()
+        for value in candidates:
+            if query in value:
+                keys.update(index['value_keys'][value])
+        
+        fields = index['fields']
+        ranked = [(key, score(fields[key], query)) for key in keys]
+    ranked.sort(key=lambda item: (-item[1], item[0]))
+    return ranked
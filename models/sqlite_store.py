@@ -0,0 +1,357 @@
+import json
+import os
+import sqlite3
+import threading
+from config import Config
+from models import json_store
+
+# Collections stored one row per record, with the fields below copied into
+# indexed columns so they can be queried without decoding every row.
+INDEXED_FIELDS = ['status', 'project_manager', 'office', 'project_number']
+
+# Writes per record collection the change log keeps, so in-memory indexes
+# can catch up by reading only the keys written since they last looked
+CHANGE_LOG_SIZE = 10000
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
+def get_connection():
+    """Get this thread's connection to the SQLite database (WAL mode)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        folder = os.path.dirname(Config.SQLITE_DATABASE)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        
+        # Autocommit mode; writes open explicit transactions
+        conn = sqlite3.connect(Config.SQLITE_DATABASE, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        _local.conn = conn
+        init_schema(conn)
+    return conn
+
+def init_schema(conn=None):
+    """Create tables and indexes if they do not exist"""
+    conn = conn or get_connection()
+    with _schema_lock:
+        if Config.SQLITE_DATABASE in _schema_ready:
+            return
+        
+        conn.execute('''CREATE TABLE IF NOT EXISTS documents (
+            name TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS collection_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )''')
+        # The key each version of a record collection wrote; NULL for a
+        # whole-collection write
+        conn.execute('''CREATE TABLE IF NOT EXISTS record_changes (
+            name TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            key TEXT,
+            PRIMARY KEY (name, version)
+        )''')
+        
+        for name in Config.RECORD_COLLECTIONS:
+            conn.execute(f'''CREATE TABLE IF NOT EXISTS {name} (
+                key TEXT PRIMARY KEY,
+                status TEXT,
+                project_manager TEXT,
+                office TEXT,
+                project_number TEXT,
+                data TEXT NOT NULL
+            )''')
+            for field in INDEXED_FIELDS:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{name}_{field} ON {name} ({field})')
+        
+        _schema_ready.add(Config.SQLITE_DATABASE)
+
+def is_record_collection(name):
+    """Check whether a collection is stored one row per record"""
+    return name in Config.RECORD_COLLECTIONS
+
+def _encode(value):
+    return json.dumps(value, separators=(',', ':'))
+
+def _index_values(record):
+    """Extract the indexed column values from a record"""
+    values = []
+    for field in INDEXED_FIELDS:
+        value = record.get(field) if isinstance(record, dict) else None
+        values.append(str(value) if value is not None else None)
+    return values
+
+def _upsert_sql(name):
+    # ON CONFLICT keeps the rowid, so collections keep their insertion order
+    return f'''INSERT INTO {name} (key, status, project_manager, office, project_number, data)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(key) DO UPDATE SET
+                   status = excluded.status,
+                   project_manager = excluded.project_manager,
+                   office = excluded.office,
+                   project_number = excluded.project_number,
+                   data = excluded.data'''
+
+def _bump_version(conn, name):
+    conn.execute('''INSERT INTO collection_versions (name, version) VALUES (?, 1)
+                    ON CONFLICT(name) DO UPDATE SET version = version + 1''', (name,))
+
+def _get_version(conn, name):
+    row = conn.execute('SELECT version FROM collection_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+def _log_change(conn, name, key):
+    """Bump a record collection's version and log the key written; returns the new version"""
+    _bump_version(conn, name)
+    version = _get_version(conn, name)
+    conn.execute('INSERT OR REPLACE INTO record_changes (name, version, key) VALUES (?, ?, ?)',
+                 (name, version, key))
+    conn.execute('DELETE FROM record_changes WHERE name = ? AND version <= ?',
+                 (name, version - CHANGE_LOG_SIZE))
+    return version
+
+def get_version(name):
+    """Get the write counter of a collection"""
+    return _get_version(get_connection(), name)
+
+def read_collection(name, default=None):
+    """Read a whole collection as one consistent snapshot
+    
+    Returns (version, approximate size in bytes, data).
+    """
+    conn = get_connection()
+    conn.execute('BEGIN')
+    try:
+        version = _get_version(conn, name)
+        if is_record_collection(name):
+            data = {}
+            size = 0
+            for key, text in conn.execute(f'SELECT key, data FROM {name} ORDER BY rowid'):
+                data[key] = json.loads(text)
+                size += len(text)
+        else:
+            row = conn.execute('SELECT data FROM documents WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                data, size = default, 0
+            else:
+                data, size = json.loads(row[0]), len(row[0])
+    finally:
+        conn.execute('COMMIT')
+    return version, size, data
+
+def write_collection(name, data):
+    """Replace a whole collection, writing only the rows that changed
+    
+    Returns (new version of the collection, approximate size in bytes).
+    """
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        size = 0
+        if is_record_collection(name):
+            existing = dict(conn.execute(f'SELECT key, data FROM {name}'))
+            for key, record in data.items():
+                text = _encode(record)
+                size += len(text)
+                if existing.pop(key, None) != text:
+                    conn.execute(_upsert_sql(name),
+                                 (key, *_index_values(record), text))
+            # Whatever is left was removed from the collection
+            conn.executemany(f'DELETE FROM {name} WHERE key = ?', [(k,) for k in existing])
+            version = _log_change(conn, name, None)
+        else:
+            text = _encode(data)
+            size = len(text)
+            conn.execute('INSERT OR REPLACE INTO documents (name, data) VALUES (?, ?)',
+                         (name, text))
+            _bump_version(conn, name)
+            version = _get_version(conn, name)
+        conn.execute('COMMIT')
+        return version, size
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def get_record(name, key):
+    """Get one record of a record collection, or None"""
+    return _read_record(get_connection(), name, key)
+
+def _read_record(conn, name, key):
+    row = conn.execute(f'SELECT data FROM {name} WHERE key = ?', (key,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def put_record(name, key, record):
+    """Insert or replace one record
+    
+    Returns (new collection version, previous record or None).
+    """
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        old = _read_record(conn, name, key)
+        conn.execute(_upsert_sql(name),
+                     (key, *_index_values(record), _encode(record)))
+        version = _log_change(conn, name, key)
+        conn.execute('COMMIT')
+        return version, old
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def patch_record(name, key, changes):
+    """Update fields of one record in a single transaction
+    
+    Returns (new collection version, previous record, updated record), or
+    (None, None, None) if the record does not exist.
+    """
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute(f'SELECT data FROM {name} WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            conn.execute('ROLLBACK')
+            return None, None, None
+        old = json.loads(row[0])
+        record = json.loads(row[0])
+        record.update(changes)
+        conn.execute(_upsert_sql(name), (key, *_index_values(record), _encode(record)))
+        version = _log_change(conn, name, key)
+        conn.execute('COMMIT')
+        return version, old, record
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def delete_record(name, key):
+    """Delete one record
+    
+    Returns (new collection version, deleted record or None).
+    """
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        old = _read_record(conn, name, key)
+        conn.execute(f'DELETE FROM {name} WHERE key = ?', (key,))
+        version = _log_change(conn, name, key)
+        conn.execute('COMMIT')
+        return version, old
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def write_batch(changes):
+    """Apply {collection: [put/del ops]} to several collections in one transaction
+    
+    Returns [(collection, op, collection version after the op, previous
+    record or None)] in the order applied.
+    """
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        applied = []
+        for name, ops in changes.items():
+            for op in ops:
+                old = _read_record(conn, name, op['key'])
+                if op['op'] == 'put':
+                    conn.execute(_upsert_sql(name),
+                                 (op['key'], *_index_values(op['value']), _encode(op['value'])))
+                else:
+                    conn.execute(f'DELETE FROM {name} WHERE key = ?', (op['key'],))
+                applied.append((name, op, _log_change(conn, name, op['key']), old))
+        conn.execute('COMMIT')
+        return applied
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def changes_since(name, version):
+    """Get {key: record or None if deleted} of the records written after a version
+    
+    None if the change log does not cover every version since (it was
+    trimmed, predates the log, or holds a whole-collection write).
+    """
+    conn = get_connection()
+    conn.execute('BEGIN')
+    try:
+        current = _get_version(conn, name)
+        keys = [key for key, in conn.execute(
+            'SELECT key FROM record_changes WHERE name = ? AND version > ? ORDER BY version',
+            (name, version))]
+        if len(keys) != current - version or None in keys:
+            return None
+        return {key: _read_record(conn, name, key) for key in keys}
+    finally:
+        conn.execute('COMMIT')
+
+def iter_records(name, chunk_size=1000):
+    """Stream (key, record) pairs of a collection from one read snapshot
+    
+    The first item yielded is the collection version the snapshot is at.
+    """
+    conn = get_connection()
+    conn.execute('BEGIN')
+    try:
+        yield _get_version(conn, name)
+        cursor = conn.execute(f'SELECT key, data FROM {name} ORDER BY rowid')
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for key, text in rows:
+                yield key, json.loads(text)
+    finally:
+        conn.execute('COMMIT')
+
+def count_records(name):
+    """Get the number of records in a collection"""
+    return get_connection().execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0]
+
+def query_records(name, **filters):
+    """Get {key: record} for records whose indexed columns equal the given values"""
+    unknown = set(filters) - set(INDEXED_FIELDS)
+    if unknown:
+        raise ValueError(f"Cannot query {name} on non-indexed fields: {', '.join(sorted(unknown))}")
+    
+    sql = f'SELECT key, data FROM {name}'
+    if filters:
+        sql += ' WHERE ' + ' AND '.join(f'{field} = ?' for field in filters)
+    sql += ' ORDER BY rowid'
+    rows = get_connection().execute(sql, [str(v) for v in filters.values()])
+    return {key: json.loads(text) for key, text in rows}
+
+def migrate_from_json(overwrite=False):
+    """One-shot import of every Config.DATABASES JSON file into SQLite
+    
+    Collections that already hold data are skipped unless overwrite is set.
+    Returns {collection: number of records or 'skipped'/'missing'}.
+    """
+    conn = get_connection()
+    results = {}
+    for name, path in Config.DATABASES.items():
+        if not os.path.exists(path):
+            results[name] = 'missing'
+            continue
+        
+        if not overwrite and _get_version(conn, name) > 0:
+            results[name] = 'skipped'
+            continue
+        
+        with open(path, 'r') as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError:
+                results[name] = 'invalid'
+                continue
+        if name in Config.RECORD_COLLECTIONS:
+            # Records written since the base was last compacted
+            json_store.replay_journal(path, data)
+        
+        write_collection(name, data)
+        results[name] = len(data) if isinstance(data, (dict, list)) else 1
+    return results
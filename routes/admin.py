@@ -1,9 +1,12 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
 from datetime import datetime, timedelta
 import json
 
-from models.database import load_json, save_json, log_activity
+from models.database import load_json, save_json, log_activity, get_cache_stats
+from models.activity_log import iter_activity, get_logger_stats
+from models import result_cache
 from models.analytics import get_analytics
+from models.rollups import query_rollups
 from utils.decorators import login_required, admin_required
 from utils.helpers import get_system_setting, set_system_setting
 from config import Config
@@ -18,6 +21,31 @@ def admin_panel():
     settings = load_json(Config.DATABASES['settings'])
     return render_template('admin_panel.html', settings=settings)
 
+@admin_bp.route('/admin/activity_log')
+@admin_required
+def activity_log():
+    """Recent activity, newest first"""
+    limit = min(request.args.get('limit', 200, type=int), 5000)
+    entries = list(iter_activity(limit=limit,
+                                 action=request.args.get('action') or None,
+                                 user=request.args.get('user') or None))
+    return jsonify({
+        'status': 'success',
+        'count': len(entries),
+        'data': entries,
+        'logger': get_logger_stats()
+    })
+
+@admin_bp.route('/admin/cache_stats')
+@admin_required
+def cache_stats():
+    """Hit ratios and compute times of this worker's caches"""
+    return jsonify({
+        'status': 'success',
+        'documents': get_cache_stats(),
+        'results': result_cache.get_stats()
+    })
+
 @admin_bp.route('/admin/update_setting', methods=['POST'])  # Changed from '/update_setting'
 @admin_required
 def update_setting():
@@ -91,17 +119,17 @@ def analytics():
     completed_data = []
     revenue_data = []
     
-    # Get last 6 months
-    for i in range(5, -1, -1):
-        date = datetime.now() - timedelta(days=i*30)
-        month_key = date.strftime('%Y-%m')
-        month_name = date.strftime('%b %Y')
-        
-        months.append(month_name)
-        monthly_data = analytics_data.get('monthly_data', {})
-        proposals_data.append(monthly_data.get('monthly_proposals', {}).get(month_key, 0))
-        completed_data.append(monthly_data.get('monthly_completed', {}).get(month_key, 0))
-        revenue_data.append(monthly_data.get('monthly_revenue', {}).get(month_key, 0))
+    # Last 6 calendar months, from the time-series rollups
+    today = datetime.now().date()
+    first_month = today.replace(day=1)
+    for _ in range(5):
+        first_month = (first_month - timedelta(days=1)).replace(day=1)
+    
+    for period in query_rollups(first_month, today, granularity='month'):
+        months.append(datetime.strptime(period['from'], '%Y-%m-%d').strftime('%b %Y'))
+        proposals_data.append(period['proposals'])
+        completed_data.append(period['completions'])
+        revenue_data.append(period['revenue'])
     
     # Calculate total revenue for percentage calculations
     total_revenue = analytics_data.get('total_revenue', 0)
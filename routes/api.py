@@ -1,12 +1,14 @@
 from flask import Blueprint, request, jsonify, session
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from models.database import load_json, save_json, log_activity
 from models.analytics import get_analytics
+from models.rollups import query_rollups
+from models import search_index
 from utils.decorators import login_required
 from config import Config
 
-api_bp = Blueprint('api', __name__)
+api_bp = Blueprint('api', __name__, url_prefix='/api')
 
 @api_bp.route('/proposals', methods=['GET'])
 @login_required
@@ -59,14 +61,90 @@ def api_get_projects():
         'data': filtered
     })
 
+@api_bp.route('/search', methods=['GET'])
+@login_required
+def api_search():
+    """Search proposals and projects by number, client, PM or project name, best match first
+    
+    Query parameters: q (required), collection (proposals, projects or all)
+    and limit (default 50).
+    """
+    query = request.args.get('q', '')
+    collection = request.args.get('collection', 'all')
+    if not query.strip():
+        return jsonify({'status': 'error', 'message': 'q is required'}), 400
+    if collection != 'all' and collection not in search_index.NUMBER_FIELDS:
+        return jsonify({'status': 'error', 'message': 'collection must be proposals, projects or all'}), 400
+    try:
+        limit = max(int(request.args.get('limit', 50)), 0)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'limit must be a number'}), 400
+    
+    names = list(search_index.NUMBER_FIELDS) if collection == 'all' else [collection]
+    matches = []
+    for name in names:
+        matches.extend((score, name, key) for key, score in search_index.search(name, query))
+    matches.sort(key=lambda match: (-match[0], names.index(match[1]), match[2]))
+    
+    results = []
+    documents = {}
+    for score, name, key in matches[:limit]:
+        if name not in documents:
+            documents[name] = load_json(Config.DATABASES[name])
+        record = documents[name].get(key)
+        if record is not None:
+            results.append({'collection': name, 'key': key, 'score': score, 'record': record})
+    
+    return jsonify({
+        'status': 'success',
+        'count': len(matches),
+        'data': results
+    })
+
+def _query_series():
+    """Run a rollup range query from the from/to/granularity/group_by query parameters"""
+    today = datetime.now().date()
+    end = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else today
+    start = (datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from')
+             else end.replace(day=1) - timedelta(days=334))
+    return query_rollups(start, end,
+                         granularity=request.args.get('granularity', 'month'),
+                         group_by=request.args.get('group_by') or None)
+
 @api_bp.route('/analytics', methods=['GET'])
 @login_required
 def api_get_analytics():
-    """API endpoint to get analytics (for future Azure integration)"""
+    """API endpoint to get analytics (for future Azure integration)
+    
+    With from/to (YYYY-MM-DD), granularity or group_by the time series of
+    /api/analytics/series is included as 'series'.
+    """
     analytics = get_analytics()
-    return jsonify({
+    response = {
         'status': 'success',
         'data': analytics
+    }
+    
+    if any(request.args.get(arg) for arg in ['from', 'to', 'granularity', 'group_by']):
+        try:
+            response['series'] = _query_series()
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify(response)
+
+@api_bp.route('/analytics/series', methods=['GET'])
+@login_required
+def api_get_analytics_series():
+    """Proposals, wins, losses, revenue and completions per day/week/month/quarter"""
+    try:
+        series = _query_series()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    return jsonify({
+        'status': 'success',
+        'count': len(series),
+        'data': series
     })
 
 
@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
 from models.database import log_activity
-from utils.helpers import is_authorized_email, get_system_setting
+from utils.helpers import is_authorized_email, get_system_setting, resolve_pm_name
 from utils.decorators import login_required
 
 auth_bp = Blueprint('auth', __name__)
@@ -23,22 +23,9 @@ def extract_name_from_email(email):
 
 def find_pm_name_in_system(extracted_name):
     """Find the actual PM name in system that matches the extracted name"""
-    project_managers = get_system_setting('project_managers', [])
-    
-    # Try exact match first
-    for pm in project_managers:
-        if pm.lower() == extracted_name.lower():
-            return pm
-    
-    # Try lastname match (since email format is lastname@geoconinc.com)
-    extracted_lastname = extracted_name.split()[-1].lower()  # Get last word as lastname
-    for pm in project_managers:
-        pm_lastname = pm.split()[-1].lower()  # Get PM's lastname
-        if pm_lastname == extracted_lastname:
-            return pm
-    
-    # If no match found, return the extracted name
-    return extracted_name
+    # Full name first, then last name (email format is lastname@geoconinc.com);
+    # if no match found, return the extracted name
+    return resolve_pm_name(extracted_name) or extracted_name
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
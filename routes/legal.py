@@ -1,10 +1,14 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, session,
+                   jsonify, get_template_attribute)
 from datetime import datetime
 import uuid
 
-from models.database import load_json, save_json, log_activity
+from models.database import (load_json, log_activity, get_record, upsert_record,
+                             patch_record, query, count_records, stage, commit_work)
+from models import legal_index
 from utils.decorators import login_required
 from utils.helpers import get_system_setting
+from utils.pagination import paginate
 from utils.email_service import send_email
 from config import Config
 import uuid
@@ -19,8 +23,6 @@ legal_bp = Blueprint('legal', __name__)
 def add_pw_dir_question():
     """Add a new PW & DIR question"""
     if request.method == 'POST':
-        pw_dir_questions = load_json(Config.DATABASES['pw_dir_questions'])
-        
         question_id = str(uuid.uuid4())
         question_data = {
             'id': question_id,
@@ -37,8 +39,7 @@ def add_pw_dir_question():
             'added_by': session['user_email']
         }
         
-        pw_dir_questions[question_id] = question_data
-        save_json(Config.DATABASES['pw_dir_questions'], pw_dir_questions)
+        upsert_record('pw_dir_questions', question_id, question_data)
         
         log_activity('pw_dir_question_added', {'question_id': question_id})
         flash('PW & DIR question added successfully!', 'success')
@@ -47,72 +48,98 @@ def add_pw_dir_question():
     return render_template('add_pw_dir_question.html',
                          offices=get_system_setting('office_codes', {}))
 
+# Tabs of the legal queue page: tab -> (label, list name, collection, sorts, macro)
+LEGAL_TABS = {
+    'review-queue': ('Legal Review Queue', 'review', 'projects', ['date', 'fee', 'pm'], 'review_tab'),
+    'executed-contracts': ('Executed Contracts', 'contracts', 'executed_contracts', ['date', 'pm'], 'contracts_tab'),
+    'insurance-requests': ('Insurance Requests', 'insurance', 'insurance_requests', ['date', 'pm'], 'insurance_tab'),
+    'sub-requests': ('Sub Requests', 'subs', 'sub_requests', ['date', 'pm'], 'subs_tab'),
+    'pw-dir-questions': ('PW & DIR Questions', 'pw_dir', 'pw_dir_questions', ['date'], 'pw_dir_tab')
+}
+
+# Query parameters filtering the department tabs, and the fields they match
+TAB_FILTERS = {'status': 'dept_status', 'office': 'office'}
+
+def _render_tab(tab):
+    """Render one page of a legal queue tab for the request's filters and sort order
+    
+    Returns (page items, pagination meta, tab HTML).
+    """
+    _, name, collection, sorts, macro = LEGAL_TABS[tab]
+    render = get_template_attribute('_legal_tabs.html', macro)
+    
+    if tab == 'review-queue':
+        # Projects under legal review, from the legal status index; the fee
+        # is stored on the project when it is created or its proposal is edited
+        filters = {arg: request.args.get(arg, '') for arg in ['status', 'office', 'pm']}
+        review_queue = legal_index.review_queue(filters['status'], filters['office'], filters['pm'])
+        
+        # Statistics: the index's counters, unless the queue is filtered
+        if any(filters.values()):
+            stats = legal_index.queue_stats(review_queue)
+        else:
+            stats = legal_index.status_counts()
+        
+        items, meta = paginate(review_queue, name, collection, sorts=sorts)
+        return items, meta, render(items, meta, stats, filters,
+                                   get_system_setting('office_codes', {}),
+                                   get_system_setting('project_managers', []))
+    
+    fields = {field: request.args[arg] for arg, field in TAB_FILTERS.items() if request.args.get(arg)}
+    records = query(collection, **fields) if fields else load_json(Config.DATABASES[collection])
+    items, meta = paginate(records, name, collection, sorts=sorts)
+    return items, meta, render(items, meta)
+
 @legal_bp.route('/legal_queue')  # Changed from '/queue'
 @login_required
 def legal_queue():
-    """View legal department tabs"""
+    """View legal department tabs
+    
+    Only the open tab is read and rendered; the page fetches the others from
+    legal_queue_tab when they are opened.
+    """
     log_activity('legal_queue_view', {})
     
-    projects = load_json(Config.DATABASES['projects'])
-    proposals = load_json(Config.DATABASES['proposals'])
-    executed_contracts = load_json(Config.DATABASES['executed_contracts'])
-    insurance_requests = load_json(Config.DATABASES['insurance_requests'])
-    sub_requests = load_json(Config.DATABASES['sub_requests'])
-    pw_dir_questions = load_json(Config.DATABASES['pw_dir_questions'])
-    
-    # Get filter parameters
-    status_filter = request.args.get('status', '')
-    office_filter = request.args.get('office', '')
-    pm_filter = request.args.get('pm', '')
     tab = request.args.get('tab', 'review-queue')
-    
-    # Filter projects for review queue
-    review_queue = {}
-    for proj_num, project in projects.items():
-        # Include projects that need legal review or have legal status
-        if project.get('needs_legal_review') or project.get('legal_status'):
-            # Exclude signed projects from review queue
-            if project.get('legal_status') == 'signed':
-                continue
-                
-            # Apply filters
-            if status_filter and project.get('legal_status', 'new_request') != status_filter:
-                continue
-            if office_filter and project.get('office') != office_filter:
-                continue
-            if pm_filter and project.get('project_manager') != pm_filter:
-                continue
-            
-            # Add proposal fee if available
-            if project.get('proposal_number') in proposals:
-                project['fee'] = proposals[project['proposal_number']].get('fee', 0)
-            
-            review_queue[proj_num] = project
-    
-    # Calculate statistics
-    stats = {
-        'new_request': sum(1 for p in review_queue.values() if p.get('legal_status', 'new_request') == 'new_request'),
-        'under_review': sum(1 for p in review_queue.values() if p.get('legal_status') == 'under_review'),
-        'questions_to_pm': sum(1 for p in review_queue.values() if p.get('legal_status') == 'questions_to_pm'),
-        'edits_to_client': sum(1 for p in review_queue.values() if p.get('legal_status') == 'edits_to_client'),
-        'negotiating': sum(1 for p in review_queue.values() if p.get('legal_status') == 'negotiating'),
-        'signed': sum(1 for p in projects.values() if p.get('legal_status') == 'signed'),
-        'on_hold': sum(1 for p in review_queue.values() if p.get('legal_status') == 'on_hold'),
-    }
-    
-    # Get list of project managers for filter
-    project_managers = get_system_setting('project_managers', [])
+    if tab not in LEGAL_TABS:
+        tab = 'review-queue'
+    _, meta, tab_html = _render_tab(tab)
+    
+    # Counts for the tab buttons, without reading the closed tabs' records
+    tab_list = []
+    for tab_id, (label, _, collection, _, _) in LEGAL_TABS.items():
+        if tab_id == tab:
+            count = meta['total']
+        elif tab_id == 'review-queue':
+            count = legal_index.queue_size()
+        else:
+            count = count_records(collection)
+        tab_list.append((tab_id, label, count))
     
     return render_template('legal_queue.html',
-                         review_queue=review_queue,
-                         executed_contracts=executed_contracts,
-                         insurance_requests=insurance_requests,
-                         sub_requests=sub_requests,
-                         pw_dir_questions=pw_dir_questions,
-                         stats=stats,
-                         offices=get_system_setting('office_codes', {}),
-                         project_managers=project_managers,
-                         tab=tab)
+                         tab_list=tab_list,
+                         active_tab=tab,
+                         tab_html=tab_html)
+
+@legal_bp.route('/api/legal_queue/<tab>')
+@login_required
+def legal_queue_tab(tab):
+    """One page of a legal queue tab as JSON, with the rendered tab
+    
+    Takes the same filter, sort and page parameters as the legal queue page.
+    """
+    if tab not in LEGAL_TABS:
+        return jsonify({'status': 'error', 'message': f"Unknown tab: {tab}"}), 404
+    
+    items, meta, html = _render_tab(tab)
+    return jsonify({
+        'status': 'success',
+        'tab': tab,
+        'count': meta['total'],
+        'page': meta,
+        'data': [{'key': key, 'record': record} for key, record in items.items()],
+        'html': str(html)
+    })
 
 @legal_bp.route('/legal_queue_detail/<project_number>')  # Changed from '/queue_detail/<project_number>'
 @login_required
@@ -120,18 +147,15 @@ def legal_queue_detail(project_number):
     """View detailed legal queue information for a project"""
     log_activity('legal_queue_detail_view', {'project_number': project_number})
     
-    projects = load_json(Config.DATABASES['projects'])
-    proposals = load_json(Config.DATABASES['proposals'])
+    project = get_record('projects', project_number)
     
-    if project_number not in projects:
+    if project is None:
         flash('Project not found.', 'error')
         return redirect(url_for('legal.legal_queue'))
     
-    project = projects[project_number]
-    
     # Get associated proposal for fee
-    if project.get('proposal_number') in proposals:
-        proposal = proposals[project['proposal_number']]
+    proposal = get_record('proposals', project.get('proposal_number', ''))
+    if proposal is not None:
         project['fee'] = proposal.get('fee', 0)
         project['office'] = proposal.get('office', '')
     
@@ -141,14 +165,12 @@ def legal_queue_detail(project_number):
 @login_required
 def update_legal_status(project_number):
     """Update the legal status of a project"""
-    projects = load_json(Config.DATABASES['projects'])
+    project = get_record('projects', project_number)
     
-    if project_number not in projects:
+    if project is None:
         flash('Project not found.', 'error')
         return redirect(url_for('legal.legal_queue'))
     
-    project = projects[project_number]
-    
     if request.method == 'POST':
         new_status = request.form.get('new_status')
         status_notes = request.form.get('status_notes', '')
@@ -156,6 +178,9 @@ def update_legal_status(project_number):
         # Store old status
         old_status = project.get('legal_status', 'new_request')
         
+        # The project and its notification are written together
+        work = {}
+        
         # Update status
         project['legal_status'] = new_status
         project['reviewed_by'] = session['user_email']
@@ -199,7 +224,7 @@ def update_legal_status(project_number):
             
             Login to the system and look for the project in "Projects Pending Additional Information" section.
             """
-            send_email(pm_email, subject, body)
+            send_email(pm_email, subject, body, category='action_required', work=work)
             
         # If marked as not signed, update project status
         elif new_status == 'not_signed':
@@ -221,7 +246,7 @@ def update_legal_status(project_number):
             
             The project has been moved to Dead Jobs.
             """
-            send_email(pm_email, subject, body)
+            send_email(pm_email, subject, body, category='legal_status', work=work)
         
         # If questions to PM, send notification
         elif new_status == 'questions_to_pm':
@@ -237,11 +262,11 @@ def update_legal_status(project_number):
             
             Please respond to the legal team as soon as possible.
             """
-            send_email(pm_email, subject, body)
+            send_email(pm_email, subject, body, category='legal_questions', work=work)
         
         # Save updates
-        projects[project_number] = project
-        save_json(Config.DATABASES['projects'], projects)
+        stage(work, 'projects', project_number, project)
+        commit_work(work)
         
         log_activity('legal_status_updated', {
             'project_number': project_number,
@@ -260,8 +285,6 @@ def update_legal_status(project_number):
 def add_executed_contract():
     """Add a new executed contract record"""
     if request.method == 'POST':
-        contracts = load_json(Config.DATABASES['executed_contracts'])
-        
         contract_id = str(uuid.uuid4())
         contract_data = {
             'id': contract_id,
@@ -274,8 +297,7 @@ def add_executed_contract():
             'added_by': session['user_email']
         }
         
-        contracts[contract_id] = contract_data
-        save_json(Config.DATABASES['executed_contracts'], contracts)
+        upsert_record('executed_contracts', contract_id, contract_data)
         
         log_activity('executed_contract_added', {'contract_id': contract_id})
         flash('Executed contract record added successfully!', 'success')
@@ -288,8 +310,6 @@ def add_executed_contract():
 def add_insurance_request():
     """Add a new insurance request"""
     if request.method == 'POST':
-        requests = load_json(Config.DATABASES['insurance_requests'])
-        
         request_id = str(uuid.uuid4())
         request_data = {
             'id': request_id,
@@ -309,8 +329,7 @@ def add_insurance_request():
             'added_by': session['user_email']
         }
         
-        requests[request_id] = request_data
-        save_json(Config.DATABASES['insurance_requests'], requests)
+        upsert_record('insurance_requests', request_id, request_data)
         
         log_activity('insurance_request_added', {'request_id': request_id})
         flash('Insurance request added successfully!', 'success')
@@ -323,14 +342,13 @@ def add_insurance_request():
 @login_required
 def mark_insurance_issued(request_id):
     """Mark an insurance request as issued"""
-    requests = load_json(Config.DATABASES['insurance_requests'])
+    issued = patch_record('insurance_requests', request_id, {
+        'dept_status': 'issued',
+        'issued_date': datetime.now().strftime('%Y-%m-%d'),
+        'issued_by': session['user_email']
+    })
     
-    if request_id in requests:
-        requests[request_id]['dept_status'] = 'issued'
-        requests[request_id]['issued_date'] = datetime.now().strftime('%Y-%m-%d')
-        requests[request_id]['issued_by'] = session['user_email']
-        save_json(Config.DATABASES['insurance_requests'], requests)
-        
+    if issued is not None:
         log_activity('insurance_request_issued', {'request_id': request_id})
         flash('Insurance request marked as issued!', 'success')
     
@@ -340,17 +358,18 @@ def mark_insurance_issued(request_id):
 @login_required
 def legal_action(project_number):
     """Legal team action on project - updated to require additional info after signing"""
-    projects = load_json(Config.DATABASES['projects'])
+    project = get_record('projects', project_number)
     
-    if project_number not in projects:
+    if project is None:
         flash('Project not found.', 'error')
         return redirect(url_for('index'))
     
-    project = projects[project_number]
-    
     if request.method == 'POST':
         action = request.form.get('action')
         
+        # The project and its notification are written together
+        work = {}
+        
         if action == 'signed':
             # Change: Set to pending_additional_info instead of active
             project['status'] = 'pending_additional_info'
@@ -375,7 +394,7 @@ def legal_action(project_number):
             
             Login to the system and look for the project in "Projects Pending Additional Information" section.
             """
-            send_email(pm_email, subject, body)
+            send_email(pm_email, subject, body, category='action_required', work=work)
             
             flash(f'Project {project_number} signed! Pending additional information from PM.', 'success')
             
@@ -389,8 +408,8 @@ def legal_action(project_number):
             
             flash(f'Project {project_number} marked as not signed and moved to Dead Jobs.', 'success')
         
-        projects[project_number] = project
-        save_json(Config.DATABASES['projects'], projects)
+        stage(work, 'projects', project_number, project)
+        commit_work(work)
         
         log_activity('legal_action', {
             'project_number': project_number,
@@ -405,17 +424,15 @@ def legal_action(project_number):
 @login_required
 def edit_sub_request(request_id):
     """Edit a sub request - legal department can update status and reviewed_by"""
-    sub_requests = load_json(Config.DATABASES['sub_requests'])
+    sub_request = get_record('sub_requests', request_id)
     
-    if request_id not in sub_requests:
+    if sub_request is None:
         flash('Sub request not found.', 'error')
         return redirect(url_for('legal.legal_queue', tab='sub-requests'))
     
-    sub_request = sub_requests[request_id]
-    
     if request.method == 'POST':
         # Update the sub request
-        sub_request.update({
+        patch_record('sub_requests', request_id, {
             'dept_status': request.form.get('dept_status', sub_request.get('dept_status')),
             'reviewed_by': request.form.get('reviewed_by', sub_request.get('reviewed_by')),
             'notes': request.form.get('notes', sub_request.get('notes')),
@@ -423,9 +440,6 @@ def edit_sub_request(request_id):
             'last_modified_by': session['user_email']
         })
         
-        sub_requests[request_id] = sub_request
-        save_json(Config.DATABASES['sub_requests'], sub_requests)
-        
         log_activity('sub_request_updated', {'request_id': request_id})
         flash('Sub request updated successfully!', 'success')
         return redirect(url_for('legal.legal_queue', tab='sub-requests'))
@@ -438,17 +452,15 @@ def edit_sub_request(request_id):
 @login_required
 def edit_pw_dir_question(question_id):
     """Edit a PW & DIR question - legal department can update status and reviewed_by"""
-    pw_dir_questions = load_json(Config.DATABASES['pw_dir_questions'])
+    question = get_record('pw_dir_questions', question_id)
     
-    if question_id not in pw_dir_questions:
+    if question is None:
         flash('PW & DIR question not found.', 'error')
         return redirect(url_for('legal.legal_queue', tab='pw-dir-questions'))
     
-    question = pw_dir_questions[question_id]
-    
     if request.method == 'POST':
         # Update the question
-        question.update({
+        patch_record('pw_dir_questions', question_id, {
             'dept_status': request.form.get('dept_status', question.get('dept_status')),
             'reviewed_by': request.form.get('reviewed_by', question.get('reviewed_by')),
             'notes': request.form.get('notes', question.get('notes')),
@@ -456,9 +468,6 @@ def edit_pw_dir_question(question_id):
             'last_modified_by': session['user_email']
         })
         
-        pw_dir_questions[question_id] = question
-        save_json(Config.DATABASES['pw_dir_questions'], pw_dir_questions)
-        
         log_activity('pw_dir_question_updated', {'question_id': question_id})
         flash('PW & DIR question updated successfully!', 'success')
         return redirect(url_for('legal.legal_queue', tab='pw-dir-questions'))
@@ -471,14 +480,13 @@ def edit_pw_dir_question(question_id):
 @login_required
 def mark_pw_dir_complete(question_id):
     """Mark a PW & DIR question as complete"""
-    pw_dir_questions = load_json(Config.DATABASES['pw_dir_questions'])
+    completed = patch_record('pw_dir_questions', question_id, {
+        'dept_status': 'complete',
+        'completion_date': datetime.now().strftime('%Y-%m-%d'),
+        'reviewed_by': session.get('user_name', session.get('user_email', ''))
+    })
     
-    if question_id in pw_dir_questions:
-        pw_dir_questions[question_id]['dept_status'] = 'complete'
-        pw_dir_questions[question_id]['completion_date'] = datetime.now().strftime('%Y-%m-%d')
-        pw_dir_questions[question_id]['reviewed_by'] = session.get('user_name', session.get('user_email', ''))
-        save_json(Config.DATABASES['pw_dir_questions'], pw_dir_questions)
-        
+    if completed is not None:
         log_activity('pw_dir_question_completed', {'question_id': question_id})
         flash('PW & DIR question marked as complete!', 'success')
     
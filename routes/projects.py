@@ -1,12 +1,15 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
 from datetime import datetime
 import uuid
-from models.database import load_json, save_json, log_activity
+from models.database import (log_activity, get_record, upsert_record,
+                             patch_record, query, stage, commit_work)
 from models.analytics import update_analytics
+from models import numbering
 from utils.decorators import login_required
-from utils.helpers import get_system_setting, get_next_project_number
+from utils.helpers import get_system_setting, get_next_project_number, format_project_number
+from utils.pagination import paginate, paginate_status
 from utils.email_service import send_email
-from config import Config, PROJECT_REVENUE_CODES, PROJECT_SCOPES_DETAILED, PROJECT_TYPES_DETAILED, PROJECT_TEAMS, US_STATES, CA_COUNTIES
+from config import PROJECT_REVENUE_CODES, PROJECT_SCOPES_DETAILED, PROJECT_TYPES_DETAILED, PROJECT_TEAMS, US_STATES, CA_COUNTIES
 
 projects_bp = Blueprint('projects', __name__)
 
@@ -14,25 +17,31 @@ projects_bp = Blueprint('projects', __name__)
 @login_required
 def mark_won(proposal_number):
     """Mark proposal as won and create project with auto-population for insurance and contracts"""
-    proposals = load_json(Config.DATABASES['proposals'])
+    proposal = get_record('proposals', proposal_number)
     
-    if proposal_number not in proposals:
+    if proposal is None:
         flash('Proposal not found.', 'error')
         return redirect(url_for('index'))
     
-    proposal = proposals[proposal_number]
-    
     # Get form data
     needs_legal_review = request.form.get('needs_legal_review') == 'yes'
     project_folder_path = request.form.get('project_folder_path', '')
     
     # Get project number from form (either auto-generated or custom)
     project_number = request.form.get('project_number', '')
+    lease = request.form.get('number_lease')
     
-    # If no project number provided, generate one
-    if not project_number:
+    # Take the reserved number unless another one was typed in, in which
+    # case the reservation is handed back
+    if not project_number or project_number == request.form.get('generated_project_number'):
         team_number = proposal.get('team_number', '00')
-        project_number = get_next_project_number(team_number)
+        project_number = get_next_project_number(team_number, lease)
+    else:
+        if lease:
+            numbering.release('project', lease)
+        if get_record('projects', project_number) is not None:
+            flash(f'Project number {project_number} is already in use.', 'error')
+            return redirect(url_for('projects.mark_won_form', proposal_number=proposal_number))
     
     # Update proposal
     proposal['status'] = 'converted_to_project'
@@ -67,6 +76,7 @@ def mark_won(proposal_number):
         'created_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         'email_history': [],
         'office': proposal.get('office', ''),
+        'service_type': proposal.get('service_type', ''),
         'fee': proposal.get('fee', 0),
         
         # Legal Queue Fields (if needed)
@@ -83,15 +93,16 @@ def mark_won(proposal_number):
         'legal_can_contact': request.form.get('legal_can_contact', 'yes'),
         'file_lien_notice': request.form.get('file_lien_notice', 'no'),
         'coi_needed': coi_needed,
-
+        
         'notes_comments': request.form.get('notes_comments', ''),
         'legal_status_history': []
     }
     
+    # Every record below is written together at the end, or none of them
+    work = {}
+    
     # Handle COI needed - auto-populate insurance request
     if coi_needed:
-        insurance_requests = load_json(Config.DATABASES['insurance_requests'])
-        
         request_id = str(uuid.uuid4())
         insurance_data = {
             'id': request_id,
@@ -113,8 +124,7 @@ def mark_won(proposal_number):
             'auto_generated': True
         }
         
-        insurance_requests[request_id] = insurance_data
-        save_json(Config.DATABASES['insurance_requests'], insurance_requests)
+        stage(work, 'insurance_requests', request_id, insurance_data)
         
         log_activity('insurance_request_auto_created', {
             'request_id': request_id,
@@ -124,8 +134,6 @@ def mark_won(proposal_number):
     # Handle subcontractors needed - auto-populate sub request
     need_subcontractors = request.form.get('need_subcontractors') == 'yes'
     if need_subcontractors:
-        sub_requests = load_json(Config.DATABASES['sub_requests'])
-        
         sub_id = str(uuid.uuid4())
         sub_data = {
             'id': sub_id,
@@ -146,8 +154,7 @@ def mark_won(proposal_number):
             'auto_generated': True
         }
         
-        sub_requests[sub_id] = sub_data
-        save_json(Config.DATABASES['sub_requests'], sub_requests)
+        stage(work, 'sub_requests', sub_id, sub_data)
         
         log_activity('sub_request_auto_created', {
             'sub_id': sub_id,
@@ -160,8 +167,6 @@ def mark_won(proposal_number):
         project_data['legal_approved_by'] = 'Auto-approved (No legal review required)'
         
         # Auto-populate executed contracts
-        executed_contracts = load_json(Config.DATABASES['executed_contracts'])
-        
         contract_id = str(uuid.uuid4())
         contract_data = {
             'id': contract_id,
@@ -177,8 +182,7 @@ def mark_won(proposal_number):
             'auto_generated': True
         }
         
-        executed_contracts[contract_id] = contract_data
-        save_json(Config.DATABASES['executed_contracts'], executed_contracts)
+        stage(work, 'executed_contracts', contract_id, contract_data)
         
         log_activity('executed_contract_auto_created', {
             'contract_id': contract_id,
@@ -196,7 +200,7 @@ def mark_won(proposal_number):
         
         ACTION REQUIRED: Please complete the additional project information in the system.
         """
-        send_email(pm_email, subject, body)
+        send_email(pm_email, subject, body, category='action_required', work=work)
         
         flash(f'Proposal marked as won! Project {project_number} created. Please complete additional information.', 'success')
     else:
@@ -220,16 +224,13 @@ def mark_won(proposal_number):
         
         {'COI Required: Yes' if coi_needed else ''}
         """
-        send_email(legal_email, subject, body)
+        send_email(legal_email, subject, body, category='legal_review', work=work)
         flash(f'Proposal marked as won! Project {project_number} created and sent for legal review.', 'success')
     
     # Save updates
-    proposals[proposal_number] = proposal
-    save_json(Config.DATABASES['proposals'], proposals)
-    
-    projects = load_json(Config.DATABASES['projects'])
-    projects[project_number] = project_data
-    save_json(Config.DATABASES['projects'], projects)
+    stage(work, 'proposals', proposal_number, proposal)
+    stage(work, 'projects', project_number, project_data)
+    commit_work(work)
     
     # Update analytics
     update_analytics('proposal_won', proposal)
@@ -247,15 +248,13 @@ def mark_won(proposal_number):
 @login_required
 def mark_won_form(proposal_number):
     """Show form for marking proposal as won"""
-    proposals = load_json(Config.DATABASES['proposals'])
+    proposal = get_record('proposals', proposal_number)
     
-    if proposal_number not in proposals:
+    if proposal is None:
         flash('Proposal not found.', 'error')
         return redirect(url_for('index'))
     
-    proposal = proposals[proposal_number]
     
-
     
     return render_template('mark_won_form.html', proposal=proposal)
 
@@ -263,37 +262,28 @@ def mark_won_form(proposal_number):
 @login_required
 def view_project(project_number):
     """View project details"""
-    projects = load_json(Config.DATABASES['projects'])
+    project = get_record('projects', project_number)
     
-    if project_number not in projects:
+    if project is None:
         flash('Project not found.', 'error')
         return redirect(url_for('index'))
     
-    project = projects[project_number]
-    
     # Get associated proposal
-    proposals = load_json(Config.DATABASES['proposals'])
-    associated_proposal = proposals.get(project.get('proposal_number'))
+    associated_proposal = None
+    if project.get('proposal_number'):
+        associated_proposal = get_record('proposals', project['proposal_number'])
     
     # Get insurance requests for this project
-    insurance_requests = load_json(Config.DATABASES['insurance_requests'])
-    project_insurance = {k: v for k, v in insurance_requests.items() 
-                        if v.get('project_number') == project_number}
+    project_insurance = query('insurance_requests', project_number=project_number)
     
     # Get sub requests for this project
-    sub_requests = load_json(Config.DATABASES['sub_requests'])
-    project_sub_requests = {k: v for k, v in sub_requests.items() 
-                           if v.get('project_number') == project_number}
+    project_sub_requests = query('sub_requests', project_number=project_number)
     
     # Get PW/DIR questions for this project
-    pw_dir_questions = load_json(Config.DATABASES['pw_dir_questions'])
-    project_pw_dir = {k: v for k, v in pw_dir_questions.items() 
-                      if v.get('project_number') == project_number}
+    project_pw_dir = query('pw_dir_questions', project_number=project_number)
     
     # Get executed contracts for this project
-    executed_contracts = load_json(Config.DATABASES['executed_contracts'])
-    project_contracts = {k: v for k, v in executed_contracts.items() 
-                        if v.get('project_number') == project_number}
+    project_contracts = query('executed_contracts', project_number=project_number)
     
     log_activity('project_viewed', {'project_number': project_number})
     
@@ -309,14 +299,12 @@ def view_project(project_number):
 @login_required
 def project_info_form(project_number):
     """Display form to enter additional project information"""
-    projects = load_json(Config.DATABASES['projects'])
+    project = get_record('projects', project_number)
     
-    if project_number not in projects:
+    if project is None:
         flash('Project not found.', 'error')
         return redirect(url_for('index'))
     
-    project = projects[project_number]
-    
     # Check if project is in correct status
     if project.get('status') != 'pending_additional_info':
         # Allow admin to override and edit anyway
@@ -325,8 +313,7 @@ def project_info_form(project_number):
             return redirect(url_for('index'))
     
     # Get proposal data for pre-filling
-    proposals = load_json(Config.DATABASES['proposals'])
-    proposal = proposals.get(project.get('proposal_number'), {})
+    proposal = get_record('proposals', project.get('proposal_number', '')) or {}
     
     # Pre-fill some fields from proposal
     if proposal:
@@ -350,13 +337,11 @@ def project_info_form(project_number):
 @login_required
 def submit_project_info(project_number):
     """Submit additional project information and complete project setup"""
-    projects = load_json(Config.DATABASES['projects'])
+    project = get_record('projects', project_number)
     
-    if project_number not in projects:
+    if project is None:
         flash('Project not found.', 'error')
         return redirect(url_for('index'))
-    
-    project = projects[project_number]
     action = request.form.get('action')
     
     # Debug logging
@@ -458,8 +443,7 @@ def submit_project_info(project_number):
         flash(f'Project {project_number} information submitted successfully! Project moved to Past Projects.', 'success')
     
     # Save project (for both submit and other cases)
-    projects[project_number] = project
-    save_json(Config.DATABASES['projects'], projects)
+    upsert_record('projects', project_number, project)
     
     # Debug logging
     print(f"DEBUG: Project {project_number} saved with status: {project.get('status')}")
@@ -471,22 +455,17 @@ def submit_project_info(project_number):
 @login_required
 def mark_project_complete(project_number):
     """Mark project as complete - anyone can do this"""
-    projects = load_json(Config.DATABASES['projects'])
+    # Update status
+    project = patch_record('projects', project_number, {
+        'status': 'completed',
+        'completion_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'completed_by': session['user_email']
+    })
     
-    if project_number not in projects:
+    if project is None:
         flash('Project not found.', 'error')
         return redirect(url_for('index'))
     
-    project = projects[project_number]
-    
-    # Update status
-    project['status'] = 'completed'
-    project['completion_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    project['completed_by'] = session['user_email']
-    
-    projects[project_number] = project
-    save_json(Config.DATABASES['projects'], projects)
-    
     # Update analytics
     update_analytics('project_completed', project)
     
@@ -501,28 +480,46 @@ def past_projects():
     """View completed projects, lost proposals, and dead jobs"""
     log_activity('past_projects_view', {})
     
-    projects = load_json(Config.DATABASES['projects'])
-    proposals = load_json(Config.DATABASES['proposals'])
-    
-    # Filter categories
-    completed_projects = {k: v for k, v in projects.items() if v.get('status') == 'completed'}
-    lost_proposals = {k: v for k, v in proposals.items() if v.get('status') == 'lost'}
-    dead_jobs = {k: v for k, v in projects.items() if v.get('status') == 'dead'}
+    # Years of closed jobs: read one page of each status from its sort order,
+    # newest first by default
+    completed_projects, completed_page = paginate_status(
+        'projects', 'completed', 'completed', default_sort='completion_date',
+        default_order='desc', sorts=['completion_date', 'date', 'pm', 'fee'])
+    lost_proposals, lost_page = paginate_status(
+        'proposals', 'lost', 'lost', default_sort='date', default_order='desc',
+        sorts=['date', 'pm', 'fee'])
+    dead_jobs, dead_page = paginate_status(
+        'projects', 'dead', 'dead', default_sort='date', default_order='desc',
+        sorts=['date', 'pm', 'fee'])
     
     return render_template('past_projects.html', 
                          projects=completed_projects,
                          lost_proposals=lost_proposals,
                          dead_jobs=dead_jobs,
+                         pages={'completed': completed_page, 'lost': lost_page, 'dead': dead_page},
                          user_email=session.get('user_email'))
 
 @projects_bp.route('/get_next_project_number')
 @login_required
 def get_next_project_number_ajax():
-    """Get the next project number for display in form"""
+    """Get the next project number for display, without taking it"""
     team_number = request.args.get('team', '00')
-    next_number = get_next_project_number(team_number)
+    next_number = format_project_number(team_number, numbering.peek('project'))
     return jsonify({'next_number': next_number})
 
+@projects_bp.route('/reserve_project_number', methods=['POST'])
+@login_required
+def reserve_project_number():
+    """Reserve the next project number for the mark won form"""
+    team_number = request.form.get('team', '00')
+    reservation = numbering.reserve('project')
+    return jsonify({
+        'status': 'success',
+        'next_number': format_project_number(team_number, reservation['number']),
+        'lease': reservation['lease'],
+        'expires': reservation['expires']
+    })
+
 @projects_bp.route('/delete/<project_number>', methods=['GET', 'POST'])
 @login_required
 def delete_project_route(project_number):
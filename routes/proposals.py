@@ -3,11 +3,14 @@ from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
 import os
 
-from models.database import load_json, save_json, log_activity
+from models.database import (load_json, log_activity, get_record, upsert_record,
+                             patch_record)
 from models.analytics import get_enhanced_analytics, update_analytics
+from models import dashboard, numbering
 from utils.decorators import login_required
-from utils.helpers import (get_system_setting, get_next_proposal_number,
-                          check_follow_up_reminders)
+from utils.helpers import (get_system_setting, get_setting_lookup, resolve_pm_name,
+                           get_next_proposal_number)
+from utils.pagination import paginate
 from utils.email_service import send_email
 from config import Config
 
@@ -18,243 +21,53 @@ def index():
     """Main dashboard with auto-filtering by logged-in user's PM name"""
     log_activity('dashboard_view', {})
     
-    proposals = load_json(Config.DATABASES['proposals'])
-    projects = load_json(Config.DATABASES['projects'])
-    
-    # Get the PM name for filtering from session
-    logged_in_pm = session.get('pm_filter_name', '')
-    is_admin = session.get('is_admin', False)
-    
-    # Check if all filters are set to "All" (no specific filters)
-    search_query = request.args.get('search', '').lower()
-    status_filter = request.args.get('status', '')
-    office_filter = request.args.get('office', '')
-    pm_filter = request.args.get('pm_filter', '') if is_admin else logged_in_pm
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    
-    # Determine if we should show all items (when no filters are applied)
-    show_all_items = not any([search_query, status_filter, office_filter, 
-                              (pm_filter if is_admin else False), date_from, date_to])
-    
-    # Debug logging
-    print(f"DEBUG: show_all_items = {show_all_items}")
-    print(f"DEBUG: search_query = '{search_query}'")
-    print(f"DEBUG: status_filter = '{status_filter}'")
-    print(f"DEBUG: office_filter = '{office_filter}'")
-    print(f"DEBUG: pm_filter = '{pm_filter}'")
-    print(f"DEBUG: date_from = '{date_from}'")
-    print(f"DEBUG: date_to = '{date_to}'")
-    print(f"DEBUG: is_admin = {is_admin}")
-    print(f"DEBUG: logged_in_pm = '{logged_in_pm}'")
-    
-    # Filter active items - Show all when no filters, otherwise filter by PM
-    active_proposals = {}
-    for k, v in proposals.items():
-        if v.get('status') == 'pending':
-            # Show all if no filters applied, otherwise filter by PM
-            if show_all_items or is_admin or v.get('project_manager') == logged_in_pm:
-                active_proposals[k] = v
-    
-    # Filter projects by different statuses - Show all when no filters, otherwise filter by PM
-    pending_legal_projects = {}
-    pending_additional_info_projects = {}
-    active_projects = {}
-    
-    for k, v in projects.items():
-        # Projects pending legal review
-        if v.get('status') == 'pending_legal':
-            # Show all if no filters applied, otherwise filter by PM
-            if show_all_items or is_admin or v.get('project_manager') == logged_in_pm:
-                pending_legal_projects[k] = v
-        
-        # Projects pending additional information
-        elif v.get('status') == 'pending_additional_info':
-            # Calculate days pending
-            if v.get('legal_approved_date'):
-                try:
-                    approved_date = datetime.strptime(v['legal_approved_date'].split(' ')[0], '%Y-%m-%d')
-                    days_pending = (datetime.now() - approved_date).days
-                    v['days_pending'] = days_pending
-                except:
-                    v['days_pending'] = 0
-            else:
-                v['days_pending'] = 0
-            
-            # Show all if no filters applied, otherwise filter by PM
-            if show_all_items or is_admin or v.get('project_manager') == logged_in_pm:
-                pending_additional_info_projects[k] = v
-        
-        # Active projects
-        elif v.get('status') == 'active' and not v.get('needs_legal_review'):
-            # Show all if no filters applied, otherwise filter by PM
-            if show_all_items or is_admin or v.get('project_manager') == logged_in_pm:
-                active_projects[k] = v
-    
-    # Filter parameters are now declared above
-    
-    # Apply additional filters to already-filtered proposals
-    filtered_proposals = {}
-    for prop_num, proposal in active_proposals.items():
-        # Search filter
-        if search_query:
-            search_fields = [
-                proposal.get('proposal_number', '').lower(),
-                proposal.get('client', '').lower(),
-                proposal.get('project_manager', '').lower(),
-                proposal.get('project_name', '').lower()
-            ]
-            if not any(search_query in field for field in search_fields):
-                continue
-        
-        # Status filter
-        if status_filter and proposal.get('status') != status_filter:
-            continue
-        
-        # Office filter
-        if office_filter and proposal.get('office') != office_filter:
-            continue
-        
-        # PM filter (only applies if admin wants to override and not showing all items)
-        if not show_all_items and is_admin and pm_filter and (proposal.get('project_manager') != pm_filter and 
-                                       proposal.get('project_director') != pm_filter):
-            continue
-        
-        # Date range filter
-        if date_from and proposal.get('date', '') < date_from:
-            continue
-        if date_to and proposal.get('date', '') > date_to:
-            continue
-        
-        filtered_proposals[prop_num] = proposal
-    
-    # Initialize filtered project collections
-    filtered_pending_legal = {}
-    filtered_pending_additional_info = {}
-    
-    # Apply filters to pending legal projects
-    for proj_num, project in pending_legal_projects.items():
-        # Search filter
-        if search_query:
-            search_fields = [
-                project.get('project_number', '').lower(),
-                project.get('client', '').lower(),
-                project.get('project_manager', '').lower(),
-                project.get('project_name', '').lower()
-            ]
-            if not any(search_query in field for field in search_fields):
-                continue
-        
-        # Status filter - only show if status filter matches or is empty
-        if status_filter and status_filter != 'pending_legal':
-            continue
-        
-        # Office filter
-        if office_filter and project.get('office') != office_filter:
-            continue
-        
-        # PM filter (only applies if admin wants to override and not showing all items)
-        if not show_all_items and is_admin and pm_filter and (project.get('project_manager') != pm_filter and 
-                                       project.get('project_director') != pm_filter):
-            continue
-        
-        # Date range filter
-        if date_from and project.get('date', '') < date_from:
-            continue
-        if date_to and project.get('date', '') > date_to:
-            continue
-        
-        filtered_pending_legal[proj_num] = project
-    
-    # Apply filters to pending additional info projects
-    for proj_num, project in pending_additional_info_projects.items():
-        # Search filter
-        if search_query:
-            search_fields = [
-                project.get('project_number', '').lower(),
-                project.get('client', '').lower(),
-                project.get('project_manager', '').lower(),
-                project.get('project_name', '').lower()
-            ]
-            if not any(search_query in field for field in search_fields):
-                continue
-        
-        # Status filter - only show if status filter matches or is empty
-        if status_filter and status_filter != 'pending_additional_info':
-            continue
-        
-        # Office filter
-        if office_filter and project.get('office') != office_filter:
-            continue
-        
-        # PM filter (only applies if admin wants to override and not showing all items)
-        if not show_all_items and is_admin and pm_filter and (project.get('project_manager') != pm_filter and 
-                                       project.get('project_director') != pm_filter):
-            continue
-        
-        # Date range filter
-        if date_from and project.get('date', '') < date_from:
-            continue
-        if date_to and project.get('date', '') > date_to:
-            continue
-        
-        filtered_pending_additional_info[proj_num] = project
+    spec = dashboard.make_spec(request.args, session)
+    if spec['is_admin'] and spec['pm']:
+        # Match the PM filter to the configured spelling of the name
+        spec['pm'] = resolve_pm_name(spec['pm'], by_last_name=False) or spec['pm']
+    sections = dashboard.query_dashboard(spec)
     
-    # Get enhanced analytics - but only for this user's data unless admin
-    analytics = get_enhanced_analytics()
+    # One page of each section; searched sections keep their best-match order
+    # unless a sort is picked
+    pages = {}
+    for section, collection, _, _ in dashboard.SECTIONS:
+        sections[section], pages[section] = paginate(sections[section], section, collection,
+                                                     sorts=['date', 'fee', 'pm', 'due_date'])
     
-    # Check if user can view full analytics - only admins can view analytics
+    # Get enhanced analytics - only admins can view analytics
+    analytics = get_enhanced_analytics()
+    is_admin = spec['is_admin']
     can_view_analytics = is_admin
     
-    # Debug logging for counts
-    print(f"DEBUG: Total active_proposals = {len(active_proposals)}")
-    print(f"DEBUG: Total pending_legal_projects = {len(pending_legal_projects)}")
-    print(f"DEBUG: Total pending_additional_info_projects = {len(pending_additional_info_projects)}")
-    print(f"DEBUG: Filtered proposals = {len(filtered_proposals)}")
-    print(f"DEBUG: Filtered pending_legal = {len(filtered_pending_legal)}")
-    print(f"DEBUG: Filtered pending_additional_info = {len(filtered_pending_additional_info)}")
-    
     # Get project managers for filter dropdown (only show to admin)
     project_managers = get_system_setting('project_managers', [])
     
-    # Check for follow-up reminders
-    check_follow_up_reminders()
-    
     return render_template('dashboard.html', 
-                         proposals=filtered_proposals, 
-                         pending_legal_projects=filtered_pending_legal,
-                         pending_additional_info_projects=filtered_pending_additional_info,
+                         proposals=sections['proposals'], 
+                         pending_legal_projects=sections['pending_legal'],
+                         pending_additional_info_projects=sections['pending_additional_info'],
                          user_email=session.get('user_email'),
                          user_name=session.get('user_name'),
-                         logged_in_pm=logged_in_pm,
+                         logged_in_pm=spec['logged_in_pm'],
                          is_admin=is_admin,
                          offices=get_system_setting('office_codes', {}),
                          project_managers=project_managers,
-                         search_query=search_query,
-                         status_filter=status_filter,
-                         office_filter=office_filter,
-                         pm_filter=pm_filter,
-                         date_from=date_from,
-                         date_to=date_to,
+                         search_query=spec['search'],
+                         status_filter=spec['status'],
+                         office_filter=spec['office'],
+                         pm_filter=spec['pm'],
+                         date_from=spec['date_from'],
+                         date_to=spec['date_to'],
                          analytics=analytics,
-                         can_view_analytics=can_view_analytics)
+                         can_view_analytics=can_view_analytics,
+                         pages=pages)
 
 # Remove permission restrictions from all other routes
 @proposals_bp.route('/new_proposal')
 @login_required  # Only login required, no other restrictions
 def new_proposal():
     """New proposal form - accessible to all users"""
-    counters = load_json(Config.DATABASES['counters'])
-    
-    # Get the next proposal number
-    max_counter = 0
-    if 'office_counters' in counters:
-        for office, count in counters['office_counters'].items():
-            if count > max_counter:
-                max_counter = count
-    
-    next_number = max_counter + 1
-    
+    # The number is reserved from reserve_proposal_number once an office is picked
     return render_template('new_proposal.html',
                          offices=get_system_setting('office_codes', {}),
                          proposal_types=get_system_setting('proposal_types', {}),
@@ -262,9 +75,8 @@ def new_proposal():
                          project_scopes=get_system_setting('project_scopes', []),
                          project_types=get_system_setting('project_types', []),
                          project_managers=get_system_setting('project_managers', []),
-                         project_directors=list(get_system_setting('team_assignments', {}).keys()),
-                         team_assignments=get_system_setting('team_assignments', {}),
-                         next_proposal_number=next_number)
+                         project_directors=get_setting_lookup('project_directors'),
+                         team_assignments=get_system_setting('team_assignments', {}))
 
 @proposals_bp.route('/submit_proposal', methods=['POST'])
 @login_required  # No other restrictions
@@ -275,12 +87,10 @@ def submit_proposal():
     proposal_type = request.form.get('proposal_type', '')
     service_type = request.form.get('service_type', '')
     
-    # Get pre-generated proposal number from form
-    proposal_number = request.form.get('proposal_number', '')
-    
-    # If no proposal number provided, generate one
-    if not proposal_number:
-        proposal_number = get_next_proposal_number(office, proposal_type, service_type)
+    # Take the number the form reserved for this office, or the next one
+    # if the reservation ran out or was made for another office
+    proposal_number = get_next_proposal_number(office, proposal_type, service_type,
+                                               request.form.get('number_lease'))
     
     # Get fee and remove commas for storage
     fee_input = request.form.get('fee', '0')
@@ -333,9 +143,7 @@ def submit_proposal():
     }
     
     # Save proposal
-    proposals = load_json(Config.DATABASES['proposals'])
-    proposals[proposal_number] = proposal_data
-    save_json(Config.DATABASES['proposals'], proposals)
+    upsert_record('proposals', proposal_number, proposal_data)
     
     # Update analytics
     update_analytics('new_proposal', proposal_data)
@@ -352,14 +160,12 @@ def submit_proposal():
 @login_required  # No other restrictions
 def edit_proposal(proposal_number):
     """Edit proposal form - accessible to all users"""
-    proposals = load_json(Config.DATABASES['proposals'])
+    proposal = get_record('proposals', proposal_number)
     
-    if proposal_number not in proposals:
+    if proposal is None:
         flash('Proposal not found.', 'error')
         return redirect(url_for('index'))
     
-    proposal = proposals[proposal_number]
-    
     return render_template('edit_proposal.html',
                          proposal=proposal,
                          offices=get_system_setting('office_codes', {}),
@@ -368,26 +174,18 @@ def edit_proposal(proposal_number):
                          project_scopes=get_system_setting('project_scopes', []),
                          project_types=get_system_setting('project_types', []),
                          project_managers=get_system_setting('project_managers', []),
-                         project_directors=list(get_system_setting('team_assignments', {}).keys()))
+                         project_directors=get_setting_lookup('project_directors'))
 
 @proposals_bp.route('/update_proposal/<proposal_number>', methods=['POST'])
 @login_required  # No other restrictions
 def update_proposal(proposal_number):
     """Update existing proposal - accessible to all users"""
-    proposals = load_json(Config.DATABASES['proposals'])
-    
-    if proposal_number not in proposals:
-        flash('Proposal not found.', 'error')
-        return redirect(url_for('index'))
-    
-    proposal = proposals[proposal_number]
-    
     # Get fee and remove commas for storage
     fee_input = request.form.get('fee', '0')
     fee = fee_input.replace(',', '') if fee_input else '0'
     
     # Update fields
-    proposal.update({
+    proposal = patch_record('proposals', proposal_number, {
         'project_name': request.form.get('project_name', ''),
         'project_latitude': request.form.get('project_latitude', ''),
         'project_longitude': request.form.get('project_longitude', ''),
@@ -412,8 +210,13 @@ def update_proposal(proposal_number):
         'last_modified_by': session['user_email']
     })
     
-    proposals[proposal_number] = proposal
-    save_json(Config.DATABASES['proposals'], proposals)
+    if proposal is None:
+        flash('Proposal not found.', 'error')
+        return redirect(url_for('index'))
+    
+    # Projects carry their proposal's fee for the legal queue
+    if proposal.get('project_number'):
+        patch_record('projects', proposal['project_number'], {'fee': fee})
     
     log_activity('proposal_updated', {'proposal_number': proposal_number})
     
@@ -425,19 +228,16 @@ def update_proposal(proposal_number):
 @login_required
 def view_proposal(proposal_number):
     """View proposal details - accessible to all users"""
-    proposals = load_json(Config.DATABASES['proposals'])
+    proposal = get_record('proposals', proposal_number)
     
-    if proposal_number not in proposals:
+    if proposal is None:
         flash('Proposal not found.', 'error')
         return redirect(url_for('index'))
     
-    proposal = proposals[proposal_number]
-    
     # Get associated project if exists
-    projects = load_json(Config.DATABASES['projects'])
     associated_project = None
     if proposal.get('project_number'):
-        associated_project = projects.get(proposal['project_number'])
+        associated_project = get_record('projects', proposal['project_number'])
     
     log_activity('proposal_viewed', {'proposal_number': proposal_number})
     
@@ -448,40 +248,52 @@ def view_proposal(proposal_number):
 @proposals_bp.route('/get_next_number')
 @login_required
 def get_next_proposal_number_ajax():
-    """Get the next proposal number for display in form"""
-    counters = load_json(Config.DATABASES['counters'])
-    
-    # Get the highest counter across all offices
-    max_counter = 0
-    if 'office_counters' in counters:
-        for office, count in counters['office_counters'].items():
-            if count > max_counter:
-                max_counter = count
+    """Get the next proposal number of an office for display, without taking it"""
+    office = request.args.get('office')
+    if office:
+        return jsonify({'next_number': numbering.peek(numbering.proposal_counter(office))})
+    
+    # The highest across all offices
+    offices = get_system_setting('office_codes', {})
+    return jsonify({'next_number': max([numbering.peek(numbering.proposal_counter(code))
+                                        for code in offices] or [1])})
+
+@proposals_bp.route('/reserve_proposal_number', methods=['POST'])
+@login_required
+def reserve_proposal_number():
+    """Reserve the next proposal number of an office for the new proposal form
     
-    return jsonify({'next_number': max_counter + 1})
+    The lease and office of an earlier reservation from the same form are
+    released.
+    """
+    office = request.form.get('office', '')
+    if not office:
+        return jsonify({'status': 'error', 'message': 'office is required'}), 400
+    
+    if request.form.get('lease') and request.form.get('lease_office'):
+        numbering.release(numbering.proposal_counter(request.form['lease_office']),
+                          request.form['lease'])
+    reservation = numbering.reserve(numbering.proposal_counter(office))
+    return jsonify({
+        'status': 'success',
+        'next_number': reservation['number'],
+        'lease': reservation['lease'],
+        'expires': reservation['expires']
+    })
 
 @proposals_bp.route('/mark_sent/<proposal_number>')
 @login_required  # No other restrictions
 def mark_sent(proposal_number):
     """Mark proposal as sent to client - accessible to all users"""
-    proposals = load_json(Config.DATABASES['proposals'])
+    proposal = get_record('proposals', proposal_number)
     
-    if proposal_number not in proposals:
+    if proposal is None:
         flash('Proposal not found.', 'error')
         return redirect(url_for('index'))
     
-    proposal = proposals[proposal_number]
-    
-    # Keep status as 'pending' but add sent flag
-    proposal['proposal_sent'] = True
-    proposal['proposal_sent_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    proposal['proposal_sent_by'] = session['user_email']
-    
     # Add to email history
-    if 'email_history' not in proposal:
-        proposal['email_history'] = []
-    
-    proposal['email_history'].append({
+    email_history = proposal.get('email_history', [])
+    email_history.append({
         'type': 'proposal_sent',
         'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         'by': session['user_email'],
@@ -489,8 +301,13 @@ def mark_sent(proposal_number):
         'subject': f"Proposal: {proposal.get('project_name', 'Unknown')}"
     })
     
-    proposals[proposal_number] = proposal
-    save_json(Config.DATABASES['proposals'], proposals)
+    # Keep status as 'pending' but add sent flag
+    patch_record('proposals', proposal_number, {
+        'proposal_sent': True,
+        'proposal_sent_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'proposal_sent_by': session['user_email'],
+        'email_history': email_history
+    })
     
     log_activity('proposal_sent', {'proposal_number': proposal_number})
     
@@ -501,25 +318,22 @@ def mark_sent(proposal_number):
 @login_required  # No other restrictions
 def mark_proposal_lost(proposal_number):
     """Mark proposal as lost - accessible to all users"""
-    proposals = load_json(Config.DATABASES['proposals'])
+    proposal = get_record('proposals', proposal_number)
     
-    if proposal_number not in proposals:
+    if proposal is None:
         flash('Proposal not found.', 'error')
         return redirect(url_for('index'))
     
-    proposal = proposals[proposal_number]
-    
     if request.method == 'POST':
         loss_note = request.form.get('loss_note', '')
         
         # Update proposal status
-        proposal['status'] = 'lost'
-        proposal['loss_date'] = datetime.now().strftime('%Y-%m-%d')
-        proposal['loss_note'] = loss_note
-        proposal['marked_lost_by'] = session['user_email']
-        
-        proposals[proposal_number] = proposal
-        save_json(Config.DATABASES['proposals'], proposals)
+        patch_record('proposals', proposal_number, {
+            'status': 'lost',
+            'loss_date': datetime.now().strftime('%Y-%m-%d'),
+            'loss_note': loss_note,
+            'marked_lost_by': session['user_email']
+        })
         
         log_activity('proposal_marked_lost', {
             'proposal_number': proposal_number,
@@ -1,37 +1,390 @@
+import heapq
+import os
+import smtplib
+import textwrap
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 from datetime import datetime
-from models.database import load_json, save_json
+from email.message import EmailMessage
 from config import Config
+from models import json_store
+from models.database import (load_json, save_json, get_record, upsert_record, write_records, query,
+                             stage, register_change_listener)
 
-def send_email(to_email, subject, body):
-    """Send email notification with logging"""
-    email_log = load_json(Config.DATABASES['email_log'])
-    if not isinstance(email_log, list):
-        email_log = []
+# Outgoing email. send_email() only writes the message to the email_outbox
+# collection (one journal append) and returns; EMAIL_WORKERS background
+# threads per process deliver it. Workers claim messages under the outbox
+# lock before sending, so each message goes out from one worker only, and
+# share a small pool of SMTP connections that stay open between messages.
+# Messages are scheduled by a change listener once their write lands, so a
+# message staged in a unit of work waits for it to commit.
+#
+# A message that fails is retried after EMAIL_RETRY_SECONDS, doubling each
+# time up to EMAIL_RETRY_MAX_SECONDS; after EMAIL_MAX_ATTEMPTS it stays in
+# the outbox with status 'dead' until requeued (manage.py email-outbox).
+# Delivered messages leave the outbox and are recorded in email_log, one
+# write per batch.
+#
+# Messages are digested per recipient: the first non-urgent message to an
+# address opens a window of EMAIL_DIGEST_SECONDS, later ones join it, and
+# when it closes they go out as one email. Categories in
+# EMAIL_URGENT_CATEGORIES skip the window and are sent on their own.
+
+OUTBOX = 'email_outbox'
+
+# Longest single sleep; retries and messages queued by other workers are
+# picked up from the outbox at least this often
+MAX_SLEEP_SECONDS = 60
+
+# A message claimed this long ago by a worker that never finished it (the
+# process died) is queued again
+CLAIM_TIMEOUT_SECONDS = 600
+
+# A pooled SMTP connection idle for longer is checked with NOOP before reuse
+SMTP_IDLE_CHECK_SECONDS = 30
+
+_condition = threading.Condition()
+_heap = []
+_due = {}
+_scan = {'last': 0}
+_pool = []
+_pool_lock = threading.Lock()
+_start_lock = threading.Lock()
+_workers = {'threads': [], 'pid': None}
+
+def send_email(to_email, subject, body, category='notice', work=None):
+    """Queue an email notification for delivery in the background
     
-    # Log email
-    email_entry = {
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    Returns whether the message was queued; delivery failures are retried
+    by the outbox. Given a unit of work, the message is staged in it and
+    only queued if the unit of work commits.
+    """
+    message_id = uuid.uuid4().hex
+    now = time.time()
+    digest = Config.EMAIL_DIGEST_SECONDS > 0 and category not in Config.EMAIL_URGENT_CATEGORIES
+    due = _digest_due(to_email, now) if digest else now
+    message = {
+        'id': message_id,
         'to': to_email,
         'subject': subject,
-        'status': 'sent',
-        'mode': 'development'
+        'body': body,
+        'category': category,
+        'digest': digest,
+        'status': 'queued',
+        'attempts': 0,
+        'next_attempt': due,
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'queued_at': now,
+        'last_error': None
     }
+    start()
+    if work is not None:
+        stage(work, OUTBOX, message_id, message)
+        return True
     
-    # Development mode - print to terminal
-    print(f"\n{'='*50}")
-    print(f"EMAIL NOTIFICATION")
-    print(f"{'='*50}")
-    print(f"TO: {to_email}")
-    print(f"SUBJECT: {subject}")
-    print(f"{'='*50}")
-    print(f"BODY:\n{body}")
-    print(f"{'='*50}\n")
+    try:
+        upsert_record(OUTBOX, message_id, message)
+    except Exception as e:
+        print(f"Error queueing email to {to_email}: {e}")
+        return False
+    return True
+
+def _on_change(collection, changes, version):
+    """Schedule the messages queued by a write to the outbox in this process"""
+    with _condition:
+        for key, old, new in changes:
+            if key is not None and new is not None and new['status'] == 'queued':
+                _schedule(key, new['next_attempt'])
+
+register_change_listener(OUTBOX, _on_change)
+
+def _digest_due(to_email, now):
+    """When a digested message to a recipient goes out: with the open digest, or after a new window"""
+    for message in query(OUTBOX, to=to_email).values():
+        if (message.get('digest') and message['status'] == 'queued' and
+                message['attempts'] == 0 and message['next_attempt'] > now):
+            return message['next_attempt']
+    return now + Config.EMAIL_DIGEST_SECONDS
+
+def _schedule(message_id, due):
+    """Put a message at its due time in the heap (hold _condition)"""
+    if _due.get(message_id) == due:
+        return
+    _due[message_id] = due
+    heapq.heappush(_heap, (due, message_id))
+    if _heap[0] == (due, message_id):
+        _condition.notify()
+
+def _next_due():
+    """Wait for due messages and take up to EMAIL_BATCH_SIZE of them off the heap
     
-    email_log.append(email_entry)
+    Returns None when it is this thread's turn to rescan the outbox.
+    """
+    with _condition:
+        while True:
+            now = time.time()
+            if now - _scan['last'] >= MAX_SLEEP_SECONDS:
+                _scan['last'] = now
+                return None
+            
+            message_ids = []
+            while _heap and len(message_ids) < Config.EMAIL_BATCH_SIZE:
+                due, message_id = _heap[0]
+                if _due.get(message_id) != due:
+                    # Left behind by rescheduling
+                    heapq.heappop(_heap)
+                    continue
+                if due > now:
+                    break
+                heapq.heappop(_heap)
+                del _due[message_id]
+                message_ids.append(message_id)
+            if message_ids:
+                return message_ids
+            
+            wait = _heap[0][0] - now if _heap else MAX_SLEEP_SECONDS
+            _condition.wait(min(wait, MAX_SLEEP_SECONDS))
+
+def _rescan():
+    """Schedule the queued messages in the outbox and requeue abandoned claims"""
+    now = time.time()
+    with _condition:
+        for message_id, message in query(OUTBOX, status='queued').items():
+            _schedule(message_id, message.get('next_attempt', now))
+    
+    with json_store.collection_lock(Config.DATABASES[OUTBOX]):
+        abandoned = [dict(message, status='queued', next_attempt=now)
+                     for message in query(OUTBOX, status='sending').values()
+                     if message.get('claimed_at', 0) < now - CLAIM_TIMEOUT_SECONDS]
+        if abandoned:
+            write_records(OUTBOX, [{'op': 'put', 'key': m['id'], 'value': m} for m in abandoned])
+
+def _claim(message_ids):
+    """Mark due queued messages as being sent by this process; returns the claimed messages
     
-    # Keep only last 1000 emails
-    if len(email_log) > 1000:
-        email_log = email_log[-1000:]
+    A due digested message brings along every queued digested message to
+    the same recipient, so the digest is sent whole even when its messages
+    were scheduled apart (by another process, or split across batches).
+    """
+    now = time.time()
+    claimed = {}
+    with json_store.collection_lock(Config.DATABASES[OUTBOX]):
+        for message_id in message_ids:
+            message = get_record(OUTBOX, message_id)
+            if message is None or message['status'] != 'queued' or message['next_attempt'] > now:
+                continue
+            claimed[message_id] = message
+        
+        for to_email in {message['to'] for message in claimed.values() if message.get('digest')}:
+            for message_id, message in query(OUTBOX, to=to_email).items():
+                if message_id not in claimed and message.get('digest') and message['status'] == 'queued':
+                    claimed[message_id] = dict(message)
+        
+        claimed = list(claimed.values())
+        for message in claimed:
+            message.update(status='sending', claimed_at=now, claimed_by=os.getpid())
+        if claimed:
+            write_records(OUTBOX, [{'op': 'put', 'key': m['id'], 'value': m} for m in claimed])
+    return claimed
+
+def _connect():
+    smtp = smtplib.SMTP(Config.SMTP_SERVER, Config.SMTP_PORT, timeout=Config.SMTP_TIMEOUT)
+    if Config.SMTP_STARTTLS:
+        smtp.starttls()
+    if Config.EMAIL_ADDRESS and Config.EMAIL_PASSWORD:
+        smtp.login(Config.EMAIL_ADDRESS, Config.EMAIL_PASSWORD)
+    return smtp
+
+def _close(smtp):
+    try:
+        smtp.quit()
+    except Exception:
+        smtp.close()
+
+def _is_alive(smtp):
+    try:
+        return smtp.noop()[0] == 250
+    except Exception:
+        return False
+
+@contextmanager
+def _smtp_connection():
+    """Borrow a pooled SMTP connection, opening one if none is idle
     
-    save_json(Config.DATABASES['email_log'], email_log)
-    return True
\ No newline at end of file
+    A connection that fails is closed instead of going back to the pool.
+    """
+    smtp = None
+    while smtp is None:
+        with _pool_lock:
+            if not _pool:
+                break
+            candidate, last_used = _pool.pop()
+        if time.time() - last_used < SMTP_IDLE_CHECK_SECONDS or _is_alive(candidate):
+            smtp = candidate
+        else:
+            _close(candidate)
+    if smtp is None:
+        smtp = _connect()
+    
+    try:
+        yield smtp
+    except Exception:
+        _close(smtp)
+        raise
+    
+    with _pool_lock:
+        if len(_pool) < max(Config.EMAIL_WORKERS, 1):
+            _pool.append((smtp, time.time()))
+            smtp = None
+    if smtp is not None:
+        _close(smtp)
+
+def _transport(message):
+    """Hand one message to the mail server, or print it in development"""
+    if Config.EMAIL_DELIVERY != 'smtp':
+        # Development mode - print to terminal
+        print(f"\n{'='*50}")
+        print(f"EMAIL NOTIFICATION")
+        print(f"{'='*50}")
+        print(f"TO: {message['to']}")
+        print(f"SUBJECT: {message['subject']}")
+        print(f"{'='*50}")
+        print(f"BODY:\n{message['body']}")
+        print(f"{'='*50}\n")
+        return
+    
+    email = EmailMessage()
+    email['From'] = Config.EMAIL_ADDRESS or 'noreply@geoconinc.com'
+    email['To'] = message['to']
+    email['Subject'] = message['subject']
+    email.set_content(message['body'])
+    with _smtp_connection() as smtp:
+        smtp.send_message(email)
+
+def _digest(messages):
+    """Combine messages to one recipient into a single email, oldest first"""
+    messages = sorted(messages, key=lambda message: message.get('queued_at', 0))
+    sections = [f"{message['subject']}\n{'-' * len(message['subject'])}\n"
+                f"{textwrap.dedent(message['body']).strip()}"
+                for message in messages]
+    return {
+        'to': messages[0]['to'],
+        'subject': f"Geocon notifications: {len(messages)} updates",
+        'body': '\n\n'.join(sections)
+    }
+
+def _log_entry(message, status, count=1):
+    return {
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'to': message['to'],
+        'subject': message['subject'],
+        'status': status,
+        'messages': count,
+        'mode': 'smtp' if Config.EMAIL_DELIVERY == 'smtp' else 'development'
+    }
+
+def _write_log(entries):
+    """Append entries to the email log, keeping only the last 1000 emails"""
+    if not entries:
+        return
+    filename = Config.DATABASES['email_log']
+    with json_store.collection_lock(filename):
+        email_log = load_json(filename)
+        if not isinstance(email_log, list):
+            email_log = []
+        save_json(filename, (email_log + entries)[-1000:])
+
+def _deliver(messages):
+    """Send claimed messages, digested per recipient, and record the outcome of each"""
+    groups = {}
+    for message in messages:
+        groups.setdefault(message['to'] if message.get('digest') else message['id'], []).append(message)
+    
+    ops = []
+    entries = []
+    for group in groups.values():
+        outgoing = group[0] if len(group) == 1 else _digest(group)
+        try:
+            _transport(outgoing)
+        except Exception as e:
+            for message in group:
+                attempts = message.get('attempts', 0) + 1
+                if attempts >= Config.EMAIL_MAX_ATTEMPTS:
+                    print(f"Giving up on email to {message['to']} after {attempts} attempts: {e}")
+                    message.update(status='dead', attempts=attempts, last_error=str(e))
+                    entries.append(_log_entry(message, 'failed'))
+                else:
+                    delay = min(Config.EMAIL_RETRY_SECONDS * 2 ** (attempts - 1),
+                                Config.EMAIL_RETRY_MAX_SECONDS)
+                    message.update(status='queued', attempts=attempts, last_error=str(e),
+                                   next_attempt=time.time() + delay)
+                ops.append({'op': 'put', 'key': message['id'], 'value': message})
+        else:
+            ops.extend({'op': 'del', 'key': message['id']} for message in group)
+            entries.append(_log_entry(outgoing, 'sent', len(group)))
+    
+    if ops:
+        write_records(OUTBOX, ops)
+    _write_log(entries)
+
+def _run():
+    while True:
+        try:
+            message_ids = _next_due()
+            if message_ids is None:
+                _rescan()
+            else:
+                _deliver(_claim(message_ids))
+        except Exception as e:
+            print(f"Error delivering email: {e}")
+            time.sleep(1)
+
+def deliver_due():
+    """Deliver every message that is due now in the calling thread; returns how many were tried"""
+    now = time.time()
+    due = [message_id for message_id, message in query(OUTBOX, status='queued').items()
+           if message.get('next_attempt', now) <= now]
+    tried = 0
+    for start_at in range(0, len(due), max(Config.EMAIL_BATCH_SIZE, 1)):
+        claimed = _claim(due[start_at:start_at + Config.EMAIL_BATCH_SIZE])
+        _deliver(claimed)
+        tried += len(claimed)
+    return tried
+
+def requeue_dead():
+    """Queue the dead messages again with a fresh set of attempts; returns how many"""
+    now = time.time()
+    with json_store.collection_lock(Config.DATABASES[OUTBOX]):
+        dead = [dict(message, status='queued', attempts=0, next_attempt=now)
+                for message in query(OUTBOX, status='dead').values()]
+        if dead:
+            write_records(OUTBOX, [{'op': 'put', 'key': m['id'], 'value': m} for m in dead])
+    return len(dead)
+
+def _is_running():
+    return (_workers['pid'] == os.getpid() and
+            any(thread.is_alive() for thread in _workers['threads']))
+
+def start():
+    """Start the delivery threads in this process if they are not running"""
+    if Config.EMAIL_WORKERS <= 0:
+        return
+    with _start_lock:
+        if _is_running():
+            return
+        
+        # After a fork the parent's queue and connections are not ours; the
+        # first rescan picks up whatever is in the outbox
+        with _condition:
+            _heap[:] = []
+            _due.clear()
+            _scan['last'] = 0
+        with _pool_lock:
+            _pool[:] = []
+        threads = [threading.Thread(target=_run, name=f'email-outbox-{i}', daemon=True)
+                   for i in range(Config.EMAIL_WORKERS)]
+        _workers.update(threads=threads, pid=os.getpid())
+        for thread in threads:
+            thread.start()
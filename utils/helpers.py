@@ -1,5 +1,7 @@
+import threading
 from datetime import datetime
-from models.database import load_json, save_json, log_activity
+from models.database import load_json, save_json, log_activity, collection_version, get_record
+from models import numbering
 from config import Config
 
 # Default system settings with expanded options
@@ -211,10 +213,102 @@ def is_authorized_email(email):
     """Check if email is from geoconinc.com domain"""
     return email.endswith('@geoconinc.com')
 
+# Parsed settings and the lookups derived from them, kept until the settings
+# file changes. The file's signature is checked on every read, so a setting
+# saved by another worker is seen on its next request. Entries are replaced
+# whole, never modified, so readers need no lock.
+_settings_cache = {'entry': None}
+_settings_lock = threading.Lock()
+
+# (project managers, their name index), kept while the list is unchanged
+_pm_index_cache = {'entry': None}
+
+def _setting(settings, key, default=None):
+    return settings.get(key, default if default is not None else DEFAULT_SETTINGS.get(key, None))
+
+def _build_pm_index(project_managers):
+    """Map normalized full names, and last names, to the project managers"""
+    full_names = {}
+    last_names = {}
+    for pm in project_managers:
+        words = pm.lower().split()
+        if not words:
+            continue
+        full_names.setdefault(' '.join(words), pm)
+        # Several PMs can share a last name; resolve_pm_name sorts them out
+        same_last_name = last_names.setdefault(words[-1], [])
+        if pm not in same_last_name:
+            same_last_name.append(pm)
+    return {'full_names': full_names, 'last_names': last_names}
+
+def _derive_lookups(settings):
+    """Lookups computed once per version of the settings (hold _settings_lock)"""
+    office_codes = _setting(settings, 'office_codes', {})
+    service_types = _setting(settings, 'service_types', {})
+    
+    project_managers = _setting(settings, 'project_managers', [])
+    pm_entry = _pm_index_cache['entry']
+    if pm_entry is None or pm_entry[0] != project_managers:
+        pm_entry = (list(project_managers), _build_pm_index(project_managers))
+        _pm_index_cache['entry'] = pm_entry
+    
+    return {
+        'office_names': {name: code for code, name in office_codes.items()},
+        'service_names': {name: code for code, name in service_types.items()},
+        'project_directors': list(_setting(settings, 'team_assignments', {}).keys()),
+        'pm_index': pm_entry[1]
+    }
+
+def _load_settings():
+    """Get {version, settings, lookups} for the current settings file"""
+    version = collection_version('settings')
+    entry = _settings_cache['entry']
+    if entry is not None and version is not None and entry['version'] == version:
+        return entry
+    
+    with _settings_lock:
+        entry = _settings_cache['entry']
+        if entry is None or version is None or entry['version'] != version:
+            settings = load_json(Config.DATABASES['settings'])
+            entry = {'version': version, 'settings': settings, 'lookups': _derive_lookups(settings)}
+            _settings_cache['entry'] = entry
+        return entry
+
 def get_system_setting(key, default=None):
     """Get system setting with fallback"""
-    settings = load_json(Config.DATABASES['settings'])
-    return settings.get(key, default if default is not None else DEFAULT_SETTINGS.get(key, None))
+    return _setting(_load_settings()['settings'], key, default)
+
+def get_setting_lookup(name):
+    """Get a lookup derived from the settings
+    
+    office_names and service_names map names back to codes, project_directors
+    lists the directors in team_assignments and pm_index holds the project
+    managers by normalized full name and last name.
+    """
+    return _load_settings()['lookups'][name]
+
+def resolve_pm_name(name, by_last_name=True):
+    """Find the project manager a name refers to, or None
+    
+    The full name is matched case-insensitively first. Failing that, the
+    last name is matched; when several PMs share it, the first name has to
+    match too, and a name that is still ambiguous resolves to nobody.
+    """
+    words = (name or '').lower().split()
+    if not words:
+        return None
+    index = get_setting_lookup('pm_index')
+    
+    pm = index['full_names'].get(' '.join(words))
+    if pm is not None or not by_last_name:
+        return pm
+    
+    candidates = index['last_names'].get(words[-1], [])
+    if len(candidates) > 1 and len(words) > 1:
+        candidates = [pm for pm in candidates if pm.lower().split()[0] == words[0]]
+    if len(candidates) == 1:
+        return candidates[0]
+    return None
 
 def set_system_setting(key, value):
     """Set system setting with audit log"""
@@ -222,6 +316,8 @@ def set_system_setting(key, value):
     old_value = settings.get(key)
     settings[key] = value
     save_json(Config.DATABASES['settings'], settings)
+    with _settings_lock:
+        _settings_cache['entry'] = None
     
     log_activity('setting_changed', {
         'setting': key,
@@ -231,75 +327,44 @@ def set_system_setting(key, value):
 
 
 
-def get_next_proposal_number(office, proposal_type, service_type):
-    """Generate proposal number with proper counter management"""
-    counters = load_json(Config.DATABASES['counters'])
-    
-    year = datetime.now().year
-    
-    # Initialize office counter if not exists
-    if 'office_counters' not in counters:
-        counters['office_counters'] = {}
-    
-    counter = counters['office_counters'].get(office, 0) + 1
-    counters['office_counters'][office] = counter
-    
-    save_json(Config.DATABASES['counters'], counters)
-    
-    # Format: OC-2024-0001-P-GT
-    proposal_number = f"{office}-{year}-{counter:04d}-{proposal_type}-{service_type}"
+def format_proposal_number(office, proposal_type, service_type, counter):
+    """Format: OC-2024-0001-P-GT"""
+    return f"{office}-{datetime.now().year}-{counter:04d}-{proposal_type}-{service_type}"
+
+def format_project_number(team_number, total):
+    """Format: G-000001-02-01"""
+    return f"G-{total:06d}-{team_number}-01"
+
+def get_next_proposal_number(office, proposal_type, service_type, lease=None):
+    """Take the proposal number reserved under lease, or the office's next one if the lease is gone"""
+    counter = numbering.proposal_counter(office)
+    number = numbering.commit(counter, lease) if lease else None
+    if number is None:
+        number = numbering.allocate(counter)
     
+    proposal_number = format_proposal_number(office, proposal_type, service_type, number)
+    # Never hand out the key of an existing proposal
+    while get_record('proposals', proposal_number) is not None:
+        log_activity('proposal_number_in_use', {'number': proposal_number})
+        proposal_number = format_proposal_number(office, proposal_type, service_type,
+                                                 numbering.allocate(counter))
     log_activity('proposal_number_generated', {'number': proposal_number})
     return proposal_number
 
-def get_next_project_number(team_number):
-    """Generate project number with proper counter management"""
-    counters = load_json(Config.DATABASES['counters'])
-    
-    total = counters.get('total_projects', 0) + 1
-    counters['total_projects'] = total
-    
-    save_json(Config.DATABASES['counters'], counters)
-    
-    # Format: G-000001-02-01
-    project_number = f"G-{total:06d}-{team_number}-01"
+def get_next_project_number(team_number, lease=None):
+    """Take the project number reserved under lease, or the next one if the lease is gone"""
+    number = numbering.commit('project', lease) if lease else None
+    if number is None:
+        number = numbering.allocate('project')
     
+    project_number = format_project_number(team_number, number)
+    # Never hand out the key of an existing project
+    while get_record('projects', project_number) is not None:
+        log_activity('project_number_in_use', {'number': project_number})
+        project_number = format_project_number(team_number, numbering.allocate('project'))
     log_activity('project_number_generated', {'number': project_number})
     return project_number
 
-def check_follow_up_reminders():
-    """Check for proposals that need follow-up reminders"""
-    from utils.email_service import send_email
-    
-    proposals = load_json(Config.DATABASES['proposals'])
-    today = datetime.now().date()
-    
-    for proposal_num, proposal in proposals.items():
-        if (proposal.get('follow_up_date') and 
-            proposal.get('status') == 'pending' and 
-            not proposal.get('follow_up_reminder_sent')):
-            try:
-                follow_up_date = datetime.strptime(proposal['follow_up_date'], '%Y-%m-%d').date()
-                if follow_up_date <= today:
-                    # Send reminder
-                    pm_email = f"{proposal['project_manager'].lower().replace(' ', '.')}@geoconinc.com"
-                    subject = f"Follow-up Reminder: {proposal['proposal_number']}"
-                    body = f"""
-                    Follow-up Reminder for Proposal {proposal['proposal_number']}
-                    Project: {proposal['project_name']}
-                    Client: {proposal['client']}
-                    Fee: ${proposal['fee']}
-                    Please follow up with the client.
-                    """
-                    
-                    if send_email(pm_email, subject, body):
-                        proposal['follow_up_reminder_sent'] = True
-                        proposals[proposal_num] = proposal
-            except:
-                pass
-    
-    save_json(Config.DATABASES['proposals'], proposals)
-
 def run_startup_tasks():
     """Run tasks on server startup"""
     print("\n" + "="*60)
@@ -312,7 +377,7 @@ def run_startup_tasks():
     print("  - System: data/system/")
     print("  - Analytics: data/analytics/")
     print("  - Audit Logs: data/audit/")
-
+    
     
     print("\n🔐 Login Credentials:")
     print("  - Regular Users: any@geoconinc.com / geocon123")
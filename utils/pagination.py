@@ -0,0 +1,185 @@
+import threading
+from bisect import bisect_left, insort
+from flask import request, url_for
+from config import Config
+from models.aggregates import parse_fee
+from models.database import load_json, collection_version, changes_since, get_record, query
+
+# Server-side sorting and pagination for the list pages, backed by sort
+# orders kept per (collection, status): the sort values of the records with
+# that status (every record for status None) and, per sort key, their keys
+# in sort order as a list of (value, key). An order is built once, from
+# query(status=...) for one status, and then kept in step with the records
+# written since (database.changes_since), so a write moves a few entries
+# instead of re-sorting the collection. A page of one status is a slice of
+# its order; other filtered lists are ordered by looking up the precomputed
+# values. Lists built from copies with extra fields (e.g. the legal queue's
+# fee) are sorted on their values directly.
+#
+# Query parameters: sort, order (asc/desc), per_page and <list>_page, so
+# several lists on one page page independently.
+
+SORT_KEYS = {
+    'date': lambda r: str(r.get('date') or r.get('date_requested') or r.get('created_date') or ''),
+    'fee': parse_fee,
+    'pm': lambda r: str(r.get('project_manager') or '').lower(),
+    'due_date': lambda r: str(r.get('due_date') or ''),
+    'completion_date': lambda r: str(r.get('completion_date') or '')
+}
+
+SORT_LABELS = {
+    'date': 'Date',
+    'fee': 'Fee',
+    'pm': 'PM',
+    'due_date': 'Due Date',
+    'completion_date': 'Completion Date'
+}
+
+_orders = {}
+_orders_lock = threading.Lock()
+
+def _get_order(collection, status):
+    with _orders_lock:
+        return _orders.setdefault((collection, status), {
+            'lock': threading.Lock(),
+            'version': None,
+            'values': {},   # key -> {sort: value}
+            'sorted': {}    # sort -> [(value, key)], built on first use
+        })
+
+def _place(order, status, key, record):
+    """Move one record's entries in a sort order; a record of None removes it"""
+    old = order['values'].pop(key, None)
+    if old is not None:
+        for sort, entries in order['sorted'].items():
+            position = bisect_left(entries, (old[sort], key))
+            if position < len(entries) and entries[position] == (old[sort], key):
+                del entries[position]
+    
+    if record is not None and (status is None or record.get('status') == status):
+        values = order['values'][key] = {sort: value(record) for sort, value in SORT_KEYS.items()}
+        for sort, entries in order['sorted'].items():
+            insort(entries, (values[sort], key))
+
+def _sync_order(collection, status, order):
+    """Bring a sort order up to date with the collection (hold the order's lock)"""
+    version = collection_version(collection)
+    if version is not None and version == order['version']:
+        return
+    
+    changes = changes_since(collection, order['version'])
+    if changes is None:
+        order.update(values={}, sorted={})
+        if status is None:
+            changes = load_json(Config.DATABASES[collection])
+        else:
+            changes = query(collection, status=status)
+    for key, record in changes.items():
+        _place(order, status, key, record)
+    order['version'] = version
+
+def _sorted(order, sort):
+    """Get the (value, key) entries of a sort order by one sort key (hold the order's lock)"""
+    if sort not in order['sorted']:
+        order['sorted'][sort] = sorted((values[sort], key) for key, values in order['values'].items())
+    return order['sorted'][sort]
+
+def _int_arg(name, default):
+    try:
+        return int(request.args.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def _page_url(**changes):
+    args = request.args.to_dict()
+    args.update(changes)
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+def _sort_args(default_sort, default_order, sorts):
+    """Get the request's (sort, order, per_page), falling back to the defaults"""
+    sort = request.args.get('sort') or default_sort
+    if sort not in sorts:
+        sort = default_sort
+    order = request.args.get('order') or default_order
+    if order not in ('asc', 'desc'):
+        order = default_order
+    per_page = min(max(_int_arg('per_page', Config.PAGE_SIZE), 1), Config.MAX_PAGE_SIZE)
+    return sort, order, per_page
+
+def _page_meta(name, total, per_page, sort, order, sorts):
+    """Get the pager meta for a list, with the requested page clamped to the pages there are"""
+    pages = max((total + per_page - 1) // per_page, 1)
+    page = min(max(_int_arg(f"{name}_page", 1), 1), pages)
+    return {
+        'name': name,
+        'page': page,
+        'pages': pages,
+        'per_page': per_page,
+        'total': total,
+        'sort': sort,
+        'order': order,
+        'prev_url': _page_url(**{f"{name}_page": page - 1}) if page > 1 else None,
+        'next_url': _page_url(**{f"{name}_page": page + 1}) if page < pages else None,
+        # Choosing the current sort again flips its order
+        'sort_links': [(SORT_LABELS[key], key == sort,
+                        _page_url(sort=key, order='desc' if key == sort and order == 'asc' else 'asc',
+                                  **{f"{name}_page": 1}))
+                       for key in sorts]
+    }
+
+def paginate(items, name, collection=None, default_sort=None, default_order='asc', sorts=None):
+    """Sort {key: record} items and cut out the requested page
+    
+    collection names the collection the records come from unchanged, so
+    its precomputed sort values can be used. Returns (page items, meta) where
+    meta holds the page numbers, total and the URLs for the pager.
+    """
+    sorts = sorts or list(SORT_KEYS)
+    sort, order, per_page = _sort_args(default_sort, default_order, sorts)
+    meta = _page_meta(name, len(items), per_page, sort, order, sorts)
+    
+    keys = list(items)
+    if sort:
+        value = SORT_KEYS[sort]
+        if collection is not None:
+            sort_order = _get_order(collection, None)
+            with sort_order['lock']:
+                _sync_order(collection, None, sort_order)
+                values = sort_order['values']
+                keys.sort(key=lambda key: values[key][sort] if key in values else value(items[key]),
+                          reverse=order == 'desc')
+        else:
+            keys.sort(key=lambda key: value(items[key]), reverse=order == 'desc')
+    
+    start = (meta['page'] - 1) * per_page
+    return {key: items[key] for key in keys[start:start + per_page]}, meta
+
+def paginate_status(collection, status, name, default_sort=None, default_order='asc', sorts=None):
+    """Cut the requested page out of the records of a collection with one status
+    
+    Served from the status's sort order, so only the records on the page are
+    read. Returns (page items, meta) like paginate; the items are copies.
+    """
+    sorts = sorts or list(SORT_KEYS)
+    sort, order, per_page = _sort_args(default_sort, default_order, sorts)
+    
+    sort_order = _get_order(collection, status)
+    with sort_order['lock']:
+        _sync_order(collection, status, sort_order)
+        total = len(sort_order['values'])
+        meta = _page_meta(name, total, per_page, sort, order, sorts)
+        start = (meta['page'] - 1) * per_page
+        if not sort:
+            keys = list(sort_order['values'])[start:start + per_page]
+        elif order == 'desc':
+            entries = _sorted(sort_order, sort)
+            keys = [key for _, key in reversed(entries[max(total - start - per_page, 0):total - start])]
+        else:
+            keys = [key for _, key in _sorted(sort_order, sort)[start:start + per_page]]
+    
+    items = {}
+    for key in keys:
+        record = get_record(collection, key)
+        if record is not None:
+            items[key] = record
+    return items, meta
@@ -0,0 +1,184 @@
+import heapq
+import os
+import threading
+import time
+from datetime import datetime
+from config import Config
+from models import json_store
+from models.database import load_json, get_record, patch_record, register_change_listener
+
+# Follow-up reminder scheduler. Pending proposals with a follow_up_date sit in
+# a min-heap keyed by the time their reminder is due (midnight of that date).
+# A background thread sleeps until the earliest one is due, sends it and sets
+# follow_up_reminder_sent on that proposal only. Every proposal write updates
+# the heap through the change listener, so requests do no reminder work.
+#
+# Each worker runs its own scheduler. A reminder is claimed by setting the
+# flag under the proposals lock before the email goes out, so two workers
+# never send the same one. Delivery is retried by the email outbox; if the
+# email can't even be queued the flag is cleared again and the reminder
+# retried after FOLLOW_UP_RETRY_SECONDS.
+
+# Longest single sleep, so wall-clock changes are noticed
+MAX_SLEEP_SECONDS = 300
+
+_condition = threading.Condition()
+_heap = []
+_due = {}
+_retry_after = {}
+_loading = {'changed': None}
+_start_lock = threading.Lock()
+_scheduler = {'thread': None, 'pid': None}
+
+def due_time(proposal):
+    """Timestamp a proposal's follow-up reminder is due at, or None if it needs none"""
+    if (not proposal or proposal.get('status') != 'pending' or
+            proposal.get('follow_up_reminder_sent')):
+        return None
+    try:
+        return datetime.strptime(proposal.get('follow_up_date') or '', '%Y-%m-%d').timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def _schedule(number, due):
+    """Put a proposal at its due time in the heap, or take it out (hold _condition)"""
+    if due is None:
+        _due.pop(number, None)
+        _retry_after.pop(number, None)
+        return
+    due = max(due, _retry_after.get(number, 0))
+    if _due.get(number) == due:
+        return
+    
+    _due[number] = due
+    heapq.heappush(_heap, (due, number))
+    # Entries left behind by rescheduling are skipped when popped; drop them
+    # in bulk once they outnumber the live ones
+    if len(_heap) > 2 * len(_due) + 64:
+        _heap[:] = [(d, n) for n, d in _due.items()]
+        heapq.heapify(_heap)
+    if _heap[0] == (due, number):
+        _condition.notify()
+
+def _is_running():
+    thread = _scheduler['thread']
+    return thread is not None and _scheduler['pid'] == os.getpid() and thread.is_alive()
+
+def _on_change(collection, changes, version):
+    if not _is_running():
+        return
+    if any(key is None for key, _, _ in changes):
+        # The whole collection was replaced
+        threading.Thread(target=_reload, name='follow-up-reload', daemon=True).start()
+        return
+    
+    with _condition:
+        for key, old, new in changes:
+            _schedule(key, due_time(new))
+            if _loading['changed'] is not None:
+                _loading['changed'].add(key)
+
+def _reload():
+    """Rebuild the heap from the proposals collection"""
+    with _condition:
+        _loading['changed'] = set()
+    proposals = load_json(Config.DATABASES['proposals'])
+    
+    with _condition:
+        # Keep what the listener scheduled while the collection was being read
+        changed = _loading['changed']
+        _loading['changed'] = None
+        due = {number: _due[number] for number in changed if number in _due}
+        for number, proposal in proposals.items():
+            if number not in changed:
+                scheduled = due_time(proposal)
+                if scheduled is not None:
+                    due[number] = max(scheduled, _retry_after.get(number, 0))
+        
+        _due.clear()
+        _due.update(due)
+        _heap[:] = [(d, n) for n, d in due.items()]
+        heapq.heapify(_heap)
+        _condition.notify()
+
+def _next_due():
+    """Wait for the next reminder that is due and take it off the heap"""
+    with _condition:
+        while True:
+            while _heap and _due.get(_heap[0][1]) != _heap[0][0]:
+                heapq.heappop(_heap)
+            
+            wait = _heap[0][0] - time.time() if _heap else MAX_SLEEP_SECONDS
+            if wait <= 0:
+                _, number = heapq.heappop(_heap)
+                del _due[number]
+                return number
+            _condition.wait(min(wait, MAX_SLEEP_SECONDS))
+
+def _run():
+    _reload()
+    while True:
+        number = _next_due()
+        try:
+            _send(number)
+        except Exception as e:
+            print(f"Error sending follow-up reminder for {number}: {e}")
+
+def send_follow_up_reminder(proposal):
+    """Email a proposal's PM to follow up with the client"""
+    from utils.email_service import send_email
+    
+    pm_email = f"{proposal['project_manager'].lower().replace(' ', '.')}@geoconinc.com"
+    subject = f"Follow-up Reminder: {proposal['proposal_number']}"
+    body = f"""
+    Follow-up Reminder for Proposal {proposal['proposal_number']}
+    Project: {proposal['project_name']}
+    Client: {proposal['client']}
+    Fee: ${proposal['fee']}
+    Please follow up with the client.
+    """
+    return send_email(pm_email, subject, body, category='follow_up')
+
+def _send(number):
+    """Claim a due reminder, send it, and release the claim if sending fails"""
+    with json_store.collection_lock(Config.DATABASES['proposals']):
+        proposal = get_record('proposals', number)
+        due = due_time(proposal)
+        if due is None:
+            return
+        if due > time.time():
+            # Rescheduled in another worker
+            with _condition:
+                _schedule(number, due)
+            return
+        patch_record('proposals', number, {'follow_up_reminder_sent': True})
+    
+    try:
+        sent = send_follow_up_reminder(proposal)
+    except Exception as e:
+        print(f"Error sending follow-up reminder for {number}: {e}")
+        sent = False
+    
+    if not sent:
+        with _condition:
+            _retry_after[number] = time.time() + Config.FOLLOW_UP_RETRY_SECONDS
+        patch_record('proposals', number, {'follow_up_reminder_sent': False})
+
+def start():
+    """Start the scheduler thread in this process if it is not running"""
+    if not Config.FOLLOW_UP_REMINDERS:
+        return
+    with _start_lock:
+        if _is_running():
+            return
+        
+        # After a fork the parent's heap is not ours; the new thread reloads it
+        with _condition:
+            _heap[:] = []
+            _due.clear()
+            _retry_after.clear()
+        thread = threading.Thread(target=_run, name='follow-up-scheduler', daemon=True)
+        _scheduler.update(thread=thread, pid=os.getpid())
+        thread.start()
+
+register_change_listener('proposals', _on_change)